@@ -552,6 +552,246 @@ def GetDistance(p1, p2):
     else:
         return 100.
 
+#================ COPIED FROM shared/src/wgst/distance.py =================#
+# Byte-for-byte the same as the module, BioNumerics can't import wgst.
+# deployment/test_copies.py checks that they still match
+
+# How many profiles we compare against at once, keeps the
+# temporary boolean masks at a few megabytes
+BLOCK_SIZE = 4096
+
+# Loci scanned between checks in the bounded distances. Far away pairs
+# are usually out after the first two blocks
+LOCI_BLOCK = 128
+
+# Returned by the bounded distances for pairs that are known to be
+# further apart than the bound. Fails every <= threshold comparison
+BEYOND_BOUND = float( 'inf' )
+
+# Set bits in every possible byte, used to count shared loci when
+# numpy doesn't have bitwise_count
+_BYTE_POPCOUNT = np.array( [ bin(i).count('1') for i in range(256) ],
+    dtype=np.uint8 )
+
+def GetDistances(p, profiles, presence=None, blocksize=BLOCK_SIZE, bound=None):
+    """
+    Same as GetDistance, but for one profile against every row
+    of an (N x loci) array of profiles.
+
+    :param p: allele calls for the query isolate
+    :param profiles: 2D array, one row of allele calls per isolate
+    :param presence: optional PackPresence( profiles ), when given the
+        shared loci are counted from the bitsets
+    :param blocksize: number of rows to compare at once
+    :param bound: optional largest distance of interest, see
+        GetBoundedDistances
+    :return: array of N distances, in the same order as the rows
+    """
+    if bound is not None:
+        return GetBoundedDistances( p, profiles, bound, presence, blocksize )
+
+    p = np.asarray( p )
+    nProfiles = len( profiles )
+    dists = np.empty( nProfiles, dtype=float )
+
+    if not nProfiles:
+        return dists
+
+    present = p > 0
+
+    if presence is not None:
+        pBits = PackPresence( p )[0]
+
+    for start in range( 0, nProfiles, blocksize ):
+        block = profiles[ start:start+blocksize ]
+
+        # Loci present in both
+        if presence is None:
+            nCommon = np.sum( np.logical_and( block > 0, present ), axis=1 )
+        else:
+            nCommon = PopCount( presence[ start:start+blocksize ] & pBits )
+
+        # Equal to a called query allele means it is called in both
+        nSame = np.sum( np.logical_and( block == p, present ), axis=1 )
+
+        dists[ start:start+blocksize ] = PercentDistance( nCommon, nSame )
+
+    return dists
+
+def GetBoundedDistances(p, profiles, bound, presence=None,
+    blocksize=BLOCK_SIZE, lociblock=LOCI_BLOCK):
+    """
+    GetDistances for when only the distances up to some bound matter,
+    like the largest naming threshold.
+
+    The shared loci are counted up front, which fixes the number of
+    mismatches a pair can have and still be within the bound. The loci
+    are then scanned a block at a time and a pair is dropped as soon as
+    it has more mismatches than that, the rest of its loci are never
+    looked at.
+
+    :param bound: largest distance of interest
+    :param lociblock: loci to scan between checks
+    :return: array of N distances, exact for the pairs within the bound
+        and BEYOND_BOUND for the others
+    """
+    p = np.asarray( p )
+    nProfiles = len( profiles )
+    dists = np.full( nProfiles, BEYOND_BOUND )
+
+    if not nProfiles:
+        return dists
+
+    present = p > 0
+    pBits = PackPresence( p )[0]
+
+    for start in range( 0, nProfiles, blocksize ):
+        block = profiles[ start:start+blocksize ]
+
+        if presence is None:
+            nCommon = PopCount( PackPresence( block ) & pBits )
+        else:
+            nCommon = PopCount( presence[ start:start+blocksize ] & pBits )
+
+        # Nothing in common is 100 no matter what
+        if 100.0 <= bound:
+            dists[ start + np.flatnonzero( nCommon == 0 ) ] = 100.0
+
+        nMismatch = np.zeros( len( block ), dtype=int )
+        alive = np.flatnonzero( nCommon > 0 )
+
+        for lociStart in range( 0, len( p ), lociblock ):
+            if not len( alive ):
+                break
+
+            loci = slice( lociStart, lociStart+lociblock )
+
+            # No need to gather rows while none have been dropped
+            if len( alive ) == len( block ):
+                calls = block[ :, loci ]
+            else:
+                calls = block[ alive, loci ]
+
+            # Called in both, but not the same
+            differ = calls != p[ loci ]
+            differ &= calls > 0
+            differ &= present[ loci ]
+            nMismatch[ alive ] += np.sum( differ, axis=1 )
+
+            # Mismatches only go up, so past the bound now means past
+            # it for good. Same arithmetic as PercentDistance
+            within = 100.0 * nMismatch[ alive ] / nCommon[ alive ] <= bound
+            alive = alive[ within ]
+
+        dists[ start + alive ] = PercentDistance( nCommon[ alive ],
+            nCommon[ alive ] - nMismatch[ alive ] )
+
+    return dists
+
+def PercentDistance(nCommon, nSame):
+    """
+    Vectorized tail of GetDistance, turns shared/same locus counts
+    into percent distances. Nothing shared means 100.
+    """
+    dists = np.full( np.shape( nCommon ), 100.0 )
+    shared = nCommon > 0
+
+    nCommon = nCommon[ shared ].astype( float )
+    nSame = nSame[ shared ].astype( float )
+
+    # Same order of operations as GetDistance so the results are identical
+    dists[ shared ] = 100.0 * ( nCommon - nSame ) / nCommon
+
+    return dists
+
+def PackPresence(profiles, blocksize=BLOCK_SIZE):
+    """
+    Packs which loci have a call into 64 bit words, one row of words
+    per profile. The 1748 core loci fit in 28 words.
+
+    :param profiles: 1D or 2D array of allele calls
+    :return: N x words array of uint64
+    """
+    profiles = np.atleast_2d( profiles )
+    nProfiles, nLoci = profiles.shape
+
+    # Loci per word, rounded up
+    nWords = ( nLoci + 63 ) // 64
+    packed = np.zeros( ( nProfiles, nWords*8 ), dtype=np.uint8 )
+
+    for start in range( 0, nProfiles, blocksize ):
+        bits = np.packbits( profiles[ start:start+blocksize ] > 0, axis=1 )
+        packed[ start:start+blocksize, :bits.shape[1] ] = bits
+
+    return packed.view( np.uint64 )
+
+def PopCount(words):
+    """
+    Number of set bits along the last axis of an array of uint64 words
+    """
+    if hasattr( np, 'bitwise_count' ):
+        return np.sum( np.bitwise_count( words ), axis=-1, dtype=int )
+
+    words = np.ascontiguousarray( words )
+    return np.sum( _BYTE_POPCOUNT[ words.view( np.uint8 ) ], axis=-1, dtype=int )
+
+class ProfileStack(object):
+    """
+    Growable (N x loci) array of allele calls. Rows are kept in the
+    order they were appended so they line up with a list of keys.
+    The presence bitset of every row is packed once, on append.
+    Without a dtype the stack takes the dtype of the first row, so
+    allele codes stay 16 bit.
+    """
+
+    def __init__(self, capacity=1024, dtype=None):
+        self._array = None
+        self._presence = None
+        self._size = 0
+        self._capacity = capacity
+        self._dtype = dtype
+
+    def Append(self, calls):
+
+        if self._array is None:
+            if self._dtype is None:
+                self._dtype = np.asarray( calls ).dtype
+
+            self._array = np.zeros( ( self._capacity, len( calls ) ),
+                dtype=self._dtype )
+            self._presence = np.zeros( ( self._capacity,
+                PackPresence( calls ).shape[1] ), dtype=np.uint64 )
+
+        # Out of room, double it
+        elif self._size == len( self._array ):
+            self._array = self._Grow( self._array )
+            self._presence = self._Grow( self._presence )
+
+        self._array[ self._size ] = calls
+        self._presence[ self._size ] = PackPresence( calls )[0]
+        self._size += 1
+
+    def Array(self):
+        if self._array is None:
+            return np.zeros( ( 0, 0 ), dtype=self._dtype or int )
+
+        return self._array[ :self._size ]
+
+    def Presence(self):
+        if self._presence is None:
+            return np.zeros( ( 0, 0 ), dtype=np.uint64 )
+
+        return self._presence[ :self._size ]
+
+    def _Grow(self, array):
+        grown = np.zeros( ( 2*len( array ), array.shape[1] ), dtype=array.dtype )
+        grown[ :self._size ] = array[ :self._size ]
+        return grown
+
+    def __len__(self):
+        return self._size
+#============================== END OF COPY ===============================#
+
 #=========================== NAMING FUNCTION ================================#
 def CalcName(named, tree, unNamedEntry, distances, thresholds ):
 
@@ -764,6 +1004,13 @@ class Calculator(object):
 
         # Get all the current names
         namedEntries = list( self._tree.GetNames() )
+
+        # Stack the named allele calls once so each new entry is one
+        # vectorized distance call, row i belongs to namedEntries[i]
+        namedProfiles = ProfileStack( capacity=len(namedEntries)+1 )
+        for named in namedEntries:
+            namedProfiles.Append( self._alleleCalls.GetCalls(named) )
+
         belowQC = defaultdict(list)
         selection = set()
         
@@ -862,9 +1109,10 @@ class Calculator(object):
                 Logger.log('Passed QC', depth=3)
 
             Logger.log('Calculating distances...', depth=2)
-            # Get the distances
-            dists = [GetDistance( eCalls, self._alleleCalls.GetCalls(named) ) \
-                        for named in namedEntries ]
+            # Get the distances, only the ones within the biggest
+            # threshold matter for naming
+            dists = GetBoundedDistances( eCalls, namedProfiles.Array(),
+                max( self._thresholds ), namedProfiles.Presence() ).tolist()
 
             Logger.log('Calculated distances!', depth=3)
 
@@ -877,6 +1125,7 @@ class Calculator(object):
             # Keep track of our new data
             if self._tree.HasName( entry.Key ):
                 namedEntries.append( entry.Key )
+                namedProfiles.Append( eCalls )
                 Logger.log('Successfully assigned name!', depth=3)
 
         if GB_PARAMS['nosave']:
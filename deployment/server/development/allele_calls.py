@@ -20,11 +20,185 @@ class Logger(object):
 	def _log(self, string):
 		print(string)
 
+#================ COPIED FROM shared/src/wgst/codebook.py =================#
+# Byte-for-byte the same as the module, BioNumerics can't import wgst.
+# deployment/test_copies.py checks that they still match
+
+# Every locus has at most a few thousand alleles, so the codes
+# fit in 16 bits. 0 is kept for a missing call
+CODE_DTYPE = np.uint16
+
+class AlleleCodebook(object):
+    """
+    Remaps the allele ids of every locus to small integers, 1, 2, 3...
+    in the order they were first seen. Two calls at the same locus get
+    the same code only if they are the same allele, so the distances
+    on codes are the same as the distances on allele ids.
+
+    New alleles are appended to the end of their locus, so codes that
+    were handed out never change and the codebook can be saved and
+    extended on the next run.
+    """
+
+    def __init__(self, loci):
+        self._loci = list( loci )
+
+        # code - 1 -> allele id, and back
+        self._alleles = [ [] for _ in self._loci ]
+        self._codes = [ {} for _ in self._loci ]
+
+    @classmethod
+    def Load(cls, path, loci):
+        """
+        Codebook for the given loci, in the given order. Loci saved
+        at path keep their codes, anything else starts out empty.
+        """
+        codebook = cls( loci )
+
+        if not os.path.exists( path ):
+            return codebook
+
+        with open( path, 'r' ) as f:
+            data = json.load( f )
+
+        saved = dict( zip( data['loci'], data['alleles'] ) )
+
+        for i, locus in enumerate( codebook._loci ):
+            for allele in saved.get( locus, [] ):
+                codebook._Add( i, allele )
+
+        return codebook
+
+    def Project(self, loci):
+        """
+        Codebook for a subset of the loci with the same codes, for
+        calls that were projected onto another view
+        """
+        index = { locus: i for i, locus in enumerate( self._loci ) }
+        codebook = AlleleCodebook( loci )
+
+        for i, locus in enumerate( codebook._loci ):
+            codebook._alleles[i] = list( self._alleles[ index[ locus ] ] )
+            codebook._codes[i] = dict( self._codes[ index[ locus ] ] )
+
+        return codebook
+
+    def Save(self, path):
+        with open( path, 'w' ) as f:
+            json.dump( { 'loci': self._loci, 'alleles': self._alleles }, f )
+
+    def Encode(self, calls):
+        """
+        Allele ids for one isolate to codes, 0 stays 0
+
+        :param calls: allele ids in the same order as the loci
+        :return: array of CODE_DTYPE
+        """
+        codes = []
+
+        for i, allele in enumerate( np.asarray( calls ).tolist() ):
+
+            if allele <= 0:
+                codes.append( 0 )
+                continue
+
+            code = self._codes[i].get( allele )
+
+            if code is None:
+                code = self._Add( i, allele )
+
+            codes.append( code )
+
+        return np.asarray( codes, dtype=CODE_DTYPE )
+
+    def EncodeArray(self, profiles):
+        """
+        Encode for a whole (N x loci) array at once, a locus at a time.
+        Only the distinct alleles of each locus are looked up.
+        """
+        profiles = np.asarray( profiles )
+        codes = np.zeros( profiles.shape, dtype=CODE_DTYPE )
+
+        for i in range( profiles.shape[1] ):
+            alleles, inverse = np.unique( profiles[:, i], return_inverse=True )
+
+            lookup = np.zeros( len( alleles ), dtype=CODE_DTYPE )
+            for j, allele in enumerate( alleles.tolist() ):
+                if allele > 0:
+                    lookup[j] = self._codes[i].get( allele ) or self._Add( i, allele )
+
+            codes[:, i] = lookup[ inverse.ravel() ]
+
+        return codes
+
+    def Translate(self, other):
+        """
+        Lookup tables from the codes of other, a codebook with at least
+        the same loci, to the codes here. Alleles that aren't here yet
+        are added.
+
+        :return: list with one int array per locus here,
+            table[ code in other ] -> code here, 0 stays 0
+        """
+        index = { locus: i for i, locus in enumerate( other._loci ) }
+        tables = []
+
+        for i, locus in enumerate( self._loci ):
+            alleles = other._alleles[ index[ locus ] ]
+            table = np.zeros( len( alleles ) + 1, dtype=CODE_DTYPE )
+
+            for j, allele in enumerate( alleles, 1 ):
+                table[j] = self._codes[i].get( allele ) or self._Add( i, allele )
+
+            tables.append( table )
+
+        return tables
+
+    def Decode(self, codes):
+        """
+        Codes back to the allele ids, 0 stays 0
+        """
+        return np.asarray( [ self._alleles[i][ code-1 ] if code else 0
+            for i, code in enumerate( np.asarray( codes ).tolist() ) ],
+            dtype=int )
+
+    def DecodeArray(self, codes):
+        """
+        Decode for a whole N x loci array of codes at once, every
+        locus gets a stretch of one flat table and the codes index it
+        """
+        tables = [ [ 0 ] + alleles for alleles in self._alleles ]
+        offsets = np.cumsum( [ 0 ] + [ len( table ) for table in tables[:-1] ] )
+        flat = np.concatenate( tables ).astype( int ) if tables else np.zeros( 0, dtype=int )
+
+        return flat[ np.asarray( codes ) + offsets ]
+
+    def Loci(self):
+        return self._loci
+
+    def _Add(self, i, allele):
+        allele = int( allele )
+        code = len( self._alleles[i] ) + 1
+
+        if code > np.iinfo( CODE_DTYPE ).max:
+            raise ValueError( 'Too many alleles for locus: {}'.format(
+                self._loci[i] ) )
+
+        self._alleles[i].append( allele )
+        self._codes[i][ allele ] = code
+
+        return code
+
+    def __len__(self):
+        return len( self._loci )
+#============================== END OF COPY ===============================#
+
 class AlleleCalls(object):
 
 	def __init__(self, dir_path):
 
 		self._allele_calls = None
+		self._codebook = AlleleCodebook(range(CORE_LOCI))
 		self._dir_path = dir_path
 		self._length = -1
 		self._capacity = -1
@@ -34,7 +208,7 @@ class AlleleCalls(object):
 
 	def invalidate(self, key):
 		index = self._keys_to_index[key]
-		self._allele_calls[index] = -1
+		self._allele_calls[index] = 0
 		self._invalid_indices.add(index)
 
 	def load(self):
@@ -74,9 +248,20 @@ class AlleleCalls(object):
 				raise RuntimeError( 'Missing keys_mapping file for'
 					'associated metadata' )
 
+		# Allele calls are stored as per locus codes, see AlleleCodebook
+		self._codebook = AlleleCodebook.Load(
+			os.path.join(self._dir_path, 'allele_codebook.json'), range(CORE_LOCI) )
+
 		array_path = os.path.join( self._dir_path, 
+			'allele_codes_array.memmap' )
+
+		# Stores from before the codebook only have the raw calls
+		legacy_path = os.path.join( self._dir_path,
 			'allele_calls_array.memmap' )
 
+		if not os.path.exists( array_path ) and os.path.exists( legacy_path ):
+			self._convert_legacy( legacy_path, array_path )
+
 		if os.path.exists( array_path ):
 
 			# In case we need to resize
@@ -99,7 +284,7 @@ class AlleleCalls(object):
 			try:
 
 				self._allele_calls = np.memmap( 
-					array_path, dtype='int32', mode='r+', shape=shape )
+					array_path, dtype=CODE_DTYPE, mode='r+', shape=shape )
 
 				# If we have resized, let's flush to disk (J.I.C.)
 				if flush_flag:
@@ -128,7 +313,7 @@ class AlleleCalls(object):
 				raise RuntimeError('Found array metadata but no array')
 
 			self._allele_calls = np.memmap(
-				array_path, dtype='int32', mode='w+', shape=(2000, CORE_LOCI) )
+				array_path, dtype=CODE_DTYPE, mode='w+', shape=(2000, CORE_LOCI) )
 
 			self._allele_calls.flush()
 
@@ -139,6 +324,29 @@ class AlleleCalls(object):
 			self._capacity = 2000
 			self._last_index = 0
 
+	def _convert_legacy(self, legacy_path, array_path):
+
+		Logger.current._log('Converting allele calls to allele codes...')
+
+		if self._metadata['capacity'] == -1:
+			raise RuntimeError('Missing metadata for '
+				'found memmap file')
+
+		shape = ( self._metadata['capacity'], CORE_LOCI )
+
+		legacy = np.memmap( legacy_path, dtype='int32', mode='r', shape=shape )
+		codes = np.memmap( array_path, dtype=CODE_DTYPE, mode='w+', shape=shape )
+
+		# Invalidated rows are -1, they come out as all missing
+		for start in range(0, shape[0], 4096):
+			codes[start:start+4096] = self._codebook.EncodeArray(
+				np.asarray(legacy[start:start+4096]) )
+
+		codes.flush()
+		del codes, legacy
+
+		self._codebook.Save( os.path.join(self._dir_path, 'allele_codebook.json') )
+
 	def resize(self):
 
 		Logger.current._log('Resizing...')
@@ -154,14 +362,14 @@ class AlleleCalls(object):
 		del self._allele_calls
 
 		# Get the new path
-		array_path = os.path.join(self._dir_path, 'allele_calls_array.memmap' )
+		array_path = os.path.join(self._dir_path, 'allele_codes_array.memmap' )
 
 		# Create the new shape
 		shape = (newsize, CORE_LOCI)
 		
 		# Let's remap the new size
 		self._allele_calls = np.memmap( 
-			array_path, dtype='int32', mode='r+', shape=shape )
+			array_path, dtype=CODE_DTYPE, mode='r+', shape=shape )
 
 		# Store the new capacity:
 		self._capacity = newsize
@@ -190,6 +398,9 @@ class AlleleCalls(object):
 		with open(keys_mapping_path, 'w') as f:
 			json.dump(self._keys_to_index, f)
 
+		codebook_path = os.path.join( self._dir_path, 'allele_codebook.json')
+		self._codebook.Save(codebook_path)
+
 		if self._allele_calls is not None:
 			self._allele_calls.flush()
 
@@ -205,6 +416,8 @@ class AlleleCalls(object):
 			if not isinstance(calls, np.ndarray):
 				return False
 
+			calls = self._codebook.Encode(calls)
+
 			# Check to see if we can fit into the array
 			if self._last_index+1 <= int(self._capacity*0.75):
 
@@ -238,12 +451,13 @@ class AlleleCalls(object):
 
 	def __iter__(self):
 		for key, value in self._keys_to_index.items():
-			yield key, self._allele_calls[value]
+			yield key, self._codebook.Decode(self._allele_calls[value])
 
 	def __getitem__(self, key):
 
 		if key in self._keys_to_index:
-			return self._allele_calls[ self._keys_to_index[key] ]
+			return self._codebook.Decode(
+				self._allele_calls[ self._keys_to_index[key] ])
 
 		else:
 			return None
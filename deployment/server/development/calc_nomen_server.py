@@ -403,6 +403,179 @@ class NamedNode( Node ):
         return self._wgst
 
 ############################ ALLELE CALLS ####################################
+#================ COPIED FROM shared/src/wgst/codebook.py =================#
+# Byte-for-byte the same as the module, BioNumerics can't import wgst.
+# deployment/test_copies.py checks that they still match
+
+# Every locus has at most a few thousand alleles, so the codes
+# fit in 16 bits. 0 is kept for a missing call
+CODE_DTYPE = np.uint16
+
+class AlleleCodebook(object):
+    """
+    Remaps the allele ids of every locus to small integers, 1, 2, 3...
+    in the order they were first seen. Two calls at the same locus get
+    the same code only if they are the same allele, so the distances
+    on codes are the same as the distances on allele ids.
+
+    New alleles are appended to the end of their locus, so codes that
+    were handed out never change and the codebook can be saved and
+    extended on the next run.
+    """
+
+    def __init__(self, loci):
+        self._loci = list( loci )
+
+        # code - 1 -> allele id, and back
+        self._alleles = [ [] for _ in self._loci ]
+        self._codes = [ {} for _ in self._loci ]
+
+    @classmethod
+    def Load(cls, path, loci):
+        """
+        Codebook for the given loci, in the given order. Loci saved
+        at path keep their codes, anything else starts out empty.
+        """
+        codebook = cls( loci )
+
+        if not os.path.exists( path ):
+            return codebook
+
+        with open( path, 'r' ) as f:
+            data = json.load( f )
+
+        saved = dict( zip( data['loci'], data['alleles'] ) )
+
+        for i, locus in enumerate( codebook._loci ):
+            for allele in saved.get( locus, [] ):
+                codebook._Add( i, allele )
+
+        return codebook
+
+    def Project(self, loci):
+        """
+        Codebook for a subset of the loci with the same codes, for
+        calls that were projected onto another view
+        """
+        index = { locus: i for i, locus in enumerate( self._loci ) }
+        codebook = AlleleCodebook( loci )
+
+        for i, locus in enumerate( codebook._loci ):
+            codebook._alleles[i] = list( self._alleles[ index[ locus ] ] )
+            codebook._codes[i] = dict( self._codes[ index[ locus ] ] )
+
+        return codebook
+
+    def Save(self, path):
+        with open( path, 'w' ) as f:
+            json.dump( { 'loci': self._loci, 'alleles': self._alleles }, f )
+
+    def Encode(self, calls):
+        """
+        Allele ids for one isolate to codes, 0 stays 0
+
+        :param calls: allele ids in the same order as the loci
+        :return: array of CODE_DTYPE
+        """
+        codes = []
+
+        for i, allele in enumerate( np.asarray( calls ).tolist() ):
+
+            if allele <= 0:
+                codes.append( 0 )
+                continue
+
+            code = self._codes[i].get( allele )
+
+            if code is None:
+                code = self._Add( i, allele )
+
+            codes.append( code )
+
+        return np.asarray( codes, dtype=CODE_DTYPE )
+
+    def EncodeArray(self, profiles):
+        """
+        Encode for a whole (N x loci) array at once, a locus at a time.
+        Only the distinct alleles of each locus are looked up.
+        """
+        profiles = np.asarray( profiles )
+        codes = np.zeros( profiles.shape, dtype=CODE_DTYPE )
+
+        for i in range( profiles.shape[1] ):
+            alleles, inverse = np.unique( profiles[:, i], return_inverse=True )
+
+            lookup = np.zeros( len( alleles ), dtype=CODE_DTYPE )
+            for j, allele in enumerate( alleles.tolist() ):
+                if allele > 0:
+                    lookup[j] = self._codes[i].get( allele ) or self._Add( i, allele )
+
+            codes[:, i] = lookup[ inverse.ravel() ]
+
+        return codes
+
+    def Translate(self, other):
+        """
+        Lookup tables from the codes of other, a codebook with at least
+        the same loci, to the codes here. Alleles that aren't here yet
+        are added.
+
+        :return: list with one int array per locus here,
+            table[ code in other ] -> code here, 0 stays 0
+        """
+        index = { locus: i for i, locus in enumerate( other._loci ) }
+        tables = []
+
+        for i, locus in enumerate( self._loci ):
+            alleles = other._alleles[ index[ locus ] ]
+            table = np.zeros( len( alleles ) + 1, dtype=CODE_DTYPE )
+
+            for j, allele in enumerate( alleles, 1 ):
+                table[j] = self._codes[i].get( allele ) or self._Add( i, allele )
+
+            tables.append( table )
+
+        return tables
+
+    def Decode(self, codes):
+        """
+        Codes back to the allele ids, 0 stays 0
+        """
+        return np.asarray( [ self._alleles[i][ code-1 ] if code else 0
+            for i, code in enumerate( np.asarray( codes ).tolist() ) ],
+            dtype=int )
+
+    def DecodeArray(self, codes):
+        """
+        Decode for a whole N x loci array of codes at once, every
+        locus gets a stretch of one flat table and the codes index it
+        """
+        tables = [ [ 0 ] + alleles for alleles in self._alleles ]
+        offsets = np.cumsum( [ 0 ] + [ len( table ) for table in tables[:-1] ] )
+        flat = np.concatenate( tables ).astype( int ) if tables else np.zeros( 0, dtype=int )
+
+        return flat[ np.asarray( codes ) + offsets ]
+
+    def Loci(self):
+        return self._loci
+
+    def _Add(self, i, allele):
+        allele = int( allele )
+        code = len( self._alleles[i] ) + 1
+
+        if code > np.iinfo( CODE_DTYPE ).max:
+            raise ValueError( 'Too many alleles for locus: {}'.format(
+                self._loci[i] ) )
+
+        self._alleles[i].append( allele )
+        self._codes[i][ allele ] = code
+
+        return code
+
+    def __len__(self):
+        return len( self._loci )
+#============================== END OF COPY ===============================#
+
 class AlleleCalls(object):
 
     current = None
@@ -410,6 +583,7 @@ class AlleleCalls(object):
     def __init__(self, dir_path, loci_length):
 
         self._allele_calls = None
+        self._codebook = AlleleCodebook(range(loci_length))
         self._dir_path = dir_path
         self._length = -1
         self._capacity = -1
@@ -422,7 +596,7 @@ class AlleleCalls(object):
 
     def invalidate(self, key):
         index = self._keys_to_index[key]
-        self._allele_calls[index] = -1
+        self._allele_calls[index] = 0
         self._invalid_indices.add(index)
 
     def load(self):
@@ -459,9 +633,20 @@ class AlleleCalls(object):
                 raise RuntimeError( 'Missing keys_mapping file for'
                     'associated metadata' )
 
+        # Allele calls are stored as per locus codes, see AlleleCodebook
+        self._codebook = AlleleCodebook.Load(
+            os.path.join(self._dir_path, 'allele_codebook.json'), range(self._loci_length) )
+
         array_path = os.path.join( self._dir_path, 
+            'allele_codes_array.memmap' )
+
+        # Stores from before the codebook only have the raw calls
+        legacy_path = os.path.join( self._dir_path,
             'allele_calls_array.memmap' )
 
+        if not os.path.exists( array_path ) and os.path.exists( legacy_path ):
+            self._convert_legacy( legacy_path, array_path )
+
         if os.path.exists( array_path ):
 
             # In case we need to resize
@@ -484,7 +669,7 @@ class AlleleCalls(object):
             try:
 
                 self._allele_calls = np.memmap( 
-                    array_path, dtype='int32', mode='r+', shape=shape )
+                    array_path, dtype=CODE_DTYPE, mode='r+', shape=shape )
 
                 # If we have resized, let's flush to disk (J.I.C.)
                 if flush_flag:
@@ -513,7 +698,7 @@ class AlleleCalls(object):
                 raise RuntimeError('Found array metadata but no array')
 
             self._allele_calls = np.memmap(
-                array_path, dtype='int32', mode='w+', shape=(2000, self._loci_length) )
+                array_path, dtype=CODE_DTYPE, mode='w+', shape=(2000, self._loci_length) )
 
             self._allele_calls.flush()
 
@@ -528,6 +713,29 @@ class AlleleCalls(object):
         if self._allele_calls is None:
             raise RuntimeError('Why did this happen?')
 
+    def _convert_legacy(self, legacy_path, array_path):
+
+        Logger.current._log('Converting allele calls to allele codes...', depth=3)
+
+        if self._metadata['capacity'] == -1:
+            raise RuntimeError('Missing metadata for '
+                'found memmap file')
+
+        shape = ( self._metadata['capacity'], self._loci_length )
+
+        legacy = np.memmap( legacy_path, dtype='int32', mode='r', shape=shape )
+        codes = np.memmap( array_path, dtype=CODE_DTYPE, mode='w+', shape=shape )
+
+        # Invalidated rows are -1, they come out as all missing
+        for start in range(0, shape[0], 4096):
+            codes[start:start+4096] = self._codebook.EncodeArray(
+                np.asarray(legacy[start:start+4096]) )
+
+        codes.flush()
+        del codes, legacy
+
+        self._codebook.Save( os.path.join(self._dir_path, 'allele_codebook.json') )
+
     def resize(self):
 
         Logger.current._log('Resizing array...', depth=3)
@@ -543,14 +751,14 @@ class AlleleCalls(object):
         del self._allele_calls
 
         # Get the new path
-        array_path = os.path.join(self._dir_path, 'allele_calls_array.memmap' )
+        array_path = os.path.join(self._dir_path, 'allele_codes_array.memmap' )
 
         # Create the new shape
         shape = (newsize, self._loci_length)
         
         # Let's remap the new size
         self._allele_calls = np.memmap( 
-            array_path, dtype='int32', mode='r+', shape=shape )
+            array_path, dtype=CODE_DTYPE, mode='r+', shape=shape )
 
         # Store the new capacity:
         self._capacity = newsize
@@ -579,6 +787,9 @@ class AlleleCalls(object):
         with open(keys_mapping_path, 'w') as f:
             json.dump(self._keys_to_index, f)
 
+        codebook_path = os.path.join( self._dir_path, 'allele_codebook.json')
+        self._codebook.Save(codebook_path)
+
         if self._allele_calls is not None:
             self._allele_calls.flush()
 
@@ -643,8 +854,8 @@ class AlleleCalls(object):
 
         missing_files = []
         # Reference files
-        ref_files = ('allele_calls_array.memmap', 'invalid_indices.json',
-            'keys_mapping.json', 'metadata.json'
+        ref_files = ('allele_codes_array.memmap', 'allele_codebook.json',
+            'invalid_indices.json', 'keys_mapping.json', 'metadata.json'
             )
 
         for x in ref_files:
@@ -693,6 +904,8 @@ class AlleleCalls(object):
             if not isinstance(calls, np.ndarray):
                 return False
 
+            calls = self._codebook.Encode(calls)
+
             # Check to see if we can fit into the array
             if self._last_index+1 <= int(self._capacity*0.75):
 
@@ -729,11 +942,12 @@ class AlleleCalls(object):
 
     def __iter__(self):
         for key, value in self._keys_to_index.items():
-            yield key, self._allele_calls[value]
+            yield key, self._codebook.Decode(self._allele_calls[value])
 
     def __getitem__(self, key):
         if key in self._keys_to_index:
-            return self._allele_calls[ self._keys_to_index[key] ]
+            return self._codebook.Decode(
+                self._allele_calls[ self._keys_to_index[key] ])
 
         else:
             raise KeyError('Do not have calls for this key: {}'.format(key))
@@ -749,6 +963,14 @@ class AlleleCalls(object):
     def __contains__(self, key):
         return key in self._keys_to_index
 
+    def encode(self, calls):
+        # Allele calls to the codes that are stored, see codes
+        return self._codebook.Encode(calls)
+
+    def codes(self, key):
+        # Stored allele codes for a key
+        return np.asarray( self._allele_calls[ self._keys_to_index[key] ] )
+
 def GetDistance(p1, p2):
     common = np.multiply(p1>0, p2>0)
     nCommon = np.sum(common)
@@ -758,6 +980,246 @@ def GetDistance(p1, p2):
     else:
         return 100.
 
+#================ COPIED FROM shared/src/wgst/distance.py =================#
+# Byte-for-byte the same as the module, BioNumerics can't import wgst.
+# deployment/test_copies.py checks that they still match
+
+# How many profiles we compare against at once, keeps the
+# temporary boolean masks at a few megabytes
+BLOCK_SIZE = 4096
+
+# Loci scanned between checks in the bounded distances. Far away pairs
+# are usually out after the first two blocks
+LOCI_BLOCK = 128
+
+# Returned by the bounded distances for pairs that are known to be
+# further apart than the bound. Fails every <= threshold comparison
+BEYOND_BOUND = float( 'inf' )
+
+# Set bits in every possible byte, used to count shared loci when
+# numpy doesn't have bitwise_count
+_BYTE_POPCOUNT = np.array( [ bin(i).count('1') for i in range(256) ],
+    dtype=np.uint8 )
+
+def GetDistances(p, profiles, presence=None, blocksize=BLOCK_SIZE, bound=None):
+    """
+    Same as GetDistance, but for one profile against every row
+    of an (N x loci) array of profiles.
+
+    :param p: allele calls for the query isolate
+    :param profiles: 2D array, one row of allele calls per isolate
+    :param presence: optional PackPresence( profiles ), when given the
+        shared loci are counted from the bitsets
+    :param blocksize: number of rows to compare at once
+    :param bound: optional largest distance of interest, see
+        GetBoundedDistances
+    :return: array of N distances, in the same order as the rows
+    """
+    if bound is not None:
+        return GetBoundedDistances( p, profiles, bound, presence, blocksize )
+
+    p = np.asarray( p )
+    nProfiles = len( profiles )
+    dists = np.empty( nProfiles, dtype=float )
+
+    if not nProfiles:
+        return dists
+
+    present = p > 0
+
+    if presence is not None:
+        pBits = PackPresence( p )[0]
+
+    for start in range( 0, nProfiles, blocksize ):
+        block = profiles[ start:start+blocksize ]
+
+        # Loci present in both
+        if presence is None:
+            nCommon = np.sum( np.logical_and( block > 0, present ), axis=1 )
+        else:
+            nCommon = PopCount( presence[ start:start+blocksize ] & pBits )
+
+        # Equal to a called query allele means it is called in both
+        nSame = np.sum( np.logical_and( block == p, present ), axis=1 )
+
+        dists[ start:start+blocksize ] = PercentDistance( nCommon, nSame )
+
+    return dists
+
+def GetBoundedDistances(p, profiles, bound, presence=None,
+    blocksize=BLOCK_SIZE, lociblock=LOCI_BLOCK):
+    """
+    GetDistances for when only the distances up to some bound matter,
+    like the largest naming threshold.
+
+    The shared loci are counted up front, which fixes the number of
+    mismatches a pair can have and still be within the bound. The loci
+    are then scanned a block at a time and a pair is dropped as soon as
+    it has more mismatches than that, the rest of its loci are never
+    looked at.
+
+    :param bound: largest distance of interest
+    :param lociblock: loci to scan between checks
+    :return: array of N distances, exact for the pairs within the bound
+        and BEYOND_BOUND for the others
+    """
+    p = np.asarray( p )
+    nProfiles = len( profiles )
+    dists = np.full( nProfiles, BEYOND_BOUND )
+
+    if not nProfiles:
+        return dists
+
+    present = p > 0
+    pBits = PackPresence( p )[0]
+
+    for start in range( 0, nProfiles, blocksize ):
+        block = profiles[ start:start+blocksize ]
+
+        if presence is None:
+            nCommon = PopCount( PackPresence( block ) & pBits )
+        else:
+            nCommon = PopCount( presence[ start:start+blocksize ] & pBits )
+
+        # Nothing in common is 100 no matter what
+        if 100.0 <= bound:
+            dists[ start + np.flatnonzero( nCommon == 0 ) ] = 100.0
+
+        nMismatch = np.zeros( len( block ), dtype=int )
+        alive = np.flatnonzero( nCommon > 0 )
+
+        for lociStart in range( 0, len( p ), lociblock ):
+            if not len( alive ):
+                break
+
+            loci = slice( lociStart, lociStart+lociblock )
+
+            # No need to gather rows while none have been dropped
+            if len( alive ) == len( block ):
+                calls = block[ :, loci ]
+            else:
+                calls = block[ alive, loci ]
+
+            # Called in both, but not the same
+            differ = calls != p[ loci ]
+            differ &= calls > 0
+            differ &= present[ loci ]
+            nMismatch[ alive ] += np.sum( differ, axis=1 )
+
+            # Mismatches only go up, so past the bound now means past
+            # it for good. Same arithmetic as PercentDistance
+            within = 100.0 * nMismatch[ alive ] / nCommon[ alive ] <= bound
+            alive = alive[ within ]
+
+        dists[ start + alive ] = PercentDistance( nCommon[ alive ],
+            nCommon[ alive ] - nMismatch[ alive ] )
+
+    return dists
+
+def PercentDistance(nCommon, nSame):
+    """
+    Vectorized tail of GetDistance, turns shared/same locus counts
+    into percent distances. Nothing shared means 100.
+    """
+    dists = np.full( np.shape( nCommon ), 100.0 )
+    shared = nCommon > 0
+
+    nCommon = nCommon[ shared ].astype( float )
+    nSame = nSame[ shared ].astype( float )
+
+    # Same order of operations as GetDistance so the results are identical
+    dists[ shared ] = 100.0 * ( nCommon - nSame ) / nCommon
+
+    return dists
+
+def PackPresence(profiles, blocksize=BLOCK_SIZE):
+    """
+    Packs which loci have a call into 64 bit words, one row of words
+    per profile. The 1748 core loci fit in 28 words.
+
+    :param profiles: 1D or 2D array of allele calls
+    :return: N x words array of uint64
+    """
+    profiles = np.atleast_2d( profiles )
+    nProfiles, nLoci = profiles.shape
+
+    # Loci per word, rounded up
+    nWords = ( nLoci + 63 ) // 64
+    packed = np.zeros( ( nProfiles, nWords*8 ), dtype=np.uint8 )
+
+    for start in range( 0, nProfiles, blocksize ):
+        bits = np.packbits( profiles[ start:start+blocksize ] > 0, axis=1 )
+        packed[ start:start+blocksize, :bits.shape[1] ] = bits
+
+    return packed.view( np.uint64 )
+
+def PopCount(words):
+    """
+    Number of set bits along the last axis of an array of uint64 words
+    """
+    if hasattr( np, 'bitwise_count' ):
+        return np.sum( np.bitwise_count( words ), axis=-1, dtype=int )
+
+    words = np.ascontiguousarray( words )
+    return np.sum( _BYTE_POPCOUNT[ words.view( np.uint8 ) ], axis=-1, dtype=int )
+
+class ProfileStack(object):
+    """
+    Growable (N x loci) array of allele calls. Rows are kept in the
+    order they were appended so they line up with a list of keys.
+    The presence bitset of every row is packed once, on append.
+    Without a dtype the stack takes the dtype of the first row, so
+    allele codes stay 16 bit.
+    """
+
+    def __init__(self, capacity=1024, dtype=None):
+        self._array = None
+        self._presence = None
+        self._size = 0
+        self._capacity = capacity
+        self._dtype = dtype
+
+    def Append(self, calls):
+
+        if self._array is None:
+            if self._dtype is None:
+                self._dtype = np.asarray( calls ).dtype
+
+            self._array = np.zeros( ( self._capacity, len( calls ) ),
+                dtype=self._dtype )
+            self._presence = np.zeros( ( self._capacity,
+                PackPresence( calls ).shape[1] ), dtype=np.uint64 )
+
+        # Out of room, double it
+        elif self._size == len( self._array ):
+            self._array = self._Grow( self._array )
+            self._presence = self._Grow( self._presence )
+
+        self._array[ self._size ] = calls
+        self._presence[ self._size ] = PackPresence( calls )[0]
+        self._size += 1
+
+    def Array(self):
+        if self._array is None:
+            return np.zeros( ( 0, 0 ), dtype=self._dtype or int )
+
+        return self._array[ :self._size ]
+
+    def Presence(self):
+        if self._presence is None:
+            return np.zeros( ( 0, 0 ), dtype=np.uint64 )
+
+        return self._presence[ :self._size ]
+
+    def _Grow(self, array):
+        grown = np.zeros( ( 2*len( array ), array.shape[1] ), dtype=array.dtype )
+        grown[ :self._size ] = array[ :self._size ]
+        return grown
+
+    def __len__(self):
+        return self._size
+#============================== END OF COPY ===============================#
+
 ############################## NAMING FUNCTION ###############################
 def CalcName(named, tree, unNamedEntry, distances, thresholds ):
 
@@ -917,6 +1379,13 @@ class Calculator(object):
 
         # Get all the current names
         namedEntries = list( self._tree.GetNames() )
+
+        # Stack the codes of the named entries so each new entry is one
+        # vectorized distance call, row i belongs to namedEntries[i]
+        namedProfiles = ProfileStack( capacity=len(namedEntries)+1 )
+        for named in namedEntries:
+            namedProfiles.Append( self._alleleCalls.codes( named ) )
+
         belowQC = defaultdict(list)
         
         # Time to assign names:
@@ -1000,13 +1469,15 @@ class Calculator(object):
                     logger._log('Could not add allele calls for'
                         'entry: {}'.format( entry.Key ))
 
-            # Get the distances
-            dists = []
-            for i in range(len(namedEntries)):
-                dist = GetDistance( eCalls, self._alleleCalls[namedEntries[i]] )
+            codes = self._alleleCalls.encode( eCalls )
+
+            # Get the distances to the named entries, only the ones
+            # within the biggest threshold matter for naming
+            namedDists = GetBoundedDistances( codes, namedProfiles.Array(),
+                max( self._thresholds ), namedProfiles.Presence() )
 
-                if dist <= self._thresholds[0]:
-                    dists.append((dist,i))
+            dists = [ (namedDists[i], i) for i in np.flatnonzero(
+                namedDists <= self._thresholds[0] ) ]
 
             # Calculate tree
             self._tree = CalcName(namedEntries, self._tree, entry.Key,
@@ -1015,6 +1486,7 @@ class Calculator(object):
             # Keep track of our new data
             if self._tree.HasName( entry.Key ):
                 namedEntries.append( entry.Key )
+                namedProfiles.Append( codes )
 
         # Number of names given
         namesGiven = 0
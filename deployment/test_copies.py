@@ -0,0 +1,88 @@
+###########################################################
+# Checks that the wgst code pasted into the BioNumerics
+# scripts is still the same as the modules it came from
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import re
+import ast
+
+import pytest
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+SCRIPTS = [ 'deployment/server/development/calc_nomen_server.py',
+    'deployment/server/development/allele_calls.py',
+    'deployment/client/development/calculate_nomenclature_prod.py' ]
+
+# Marks where a copy starts and ends, the start names the module
+COPY_START = re.compile( r'^#=+ COPIED FROM (\S+) =+#$' )
+COPY_END = re.compile( r'^#=+ END OF COPY =+#$' )
+
+def Definitions(text):
+    """
+    Source of every top level function, class and assignment, by name
+    """
+    lines = text.split( '\n' )
+    definitions = {}
+
+    for node in ast.parse( text ).body:
+        if isinstance( node, ( ast.FunctionDef, ast.ClassDef ) ):
+            name = node.name
+        elif isinstance( node, ast.Assign ) and isinstance( node.targets[0], ast.Name ):
+            name = node.targets[0].id
+        else:
+            continue
+
+        definitions[ name ] = '\n'.join( lines[ node.lineno-1:node.end_lineno ] )
+
+    return definitions
+
+def Copies(path):
+    """
+    (module, source) for every marked copy in a script
+    """
+    with open( os.path.join( ROOT, path ), 'r' ) as f:
+        lines = f.read().replace( '\r\n', '\n' ).split( '\n' )
+
+    copies = []
+    module = None
+
+    for line in lines:
+        if module is None:
+            match = COPY_START.match( line )
+
+            if match:
+                module = match.group( 1 )
+                block = []
+
+        elif COPY_END.match( line ):
+            copies.append( ( module, '\n'.join( block ) ) )
+            module = None
+
+        else:
+            block.append( line )
+
+    assert module is None, 'Unterminated copy of {} in {}'.format( module, path )
+
+    return copies
+
+@pytest.mark.parametrize( 'path', SCRIPTS )
+def test_copies_match(path):
+    copies = Copies( path )
+    assert copies, 'No marked copies in {}'.format( path )
+
+    for module, block in copies:
+        with open( os.path.join( ROOT, module ), 'r' ) as f:
+            original = Definitions( f.read().replace( '\r\n', '\n' ) )
+
+        copied = Definitions( block )
+        assert copied
+
+        for name, source in copied.items():
+            assert name in original, '{} is not in {}'.format( name, module )
+            assert source == original[ name ], '{} in {} differs from {}'.format(
+                name, path, module )
@@ -0,0 +1,359 @@
+###############################################################################
+#
+# Benchmarks for the allelic distance functions.
+# AUTHOR: MILAN PATEL
+# CONTACT: mpatel5@cdc.gov
+#
+###############################################################################
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import subprocess
+import multiprocessing
+import numpy as np
+
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Not there on Windows, only the heap gets measured
+    resource = None
+
+from wgst.distance import GetDistance, GetDistances, GetBoundedDistances, \
+    GetDistanceMatrix, GetCrossDistances, GetHamming, GetHammings, PackPresence, \
+    TILE_SIZE
+from wgst.matrix import GetCondensedMatrix
+from wgst.codebook import AlleleCodebook
+
+# Largest naming threshold, for the bounded distances
+BOUND = 4.050815987
+
+#======================== OLD DISTANCE FUNCTION ===========================#
+# From the old timing scripts, kept here so we have
+# something to compare against
+def sim(p1, p2):
+
+    present = np.multiply( p1>0, p2>0)
+    ncommon = np.sum(present)
+    nsame = np.sum( p1[present] == p2[present] )
+
+    return (100 * (float( ncommon ) - float(nsame) ) / ( float(ncommon) ))
+
+#========================== SYNTHETIC DATA ================================#
+def SyntheticProfiles(nIsolates, nLoci, missing=0.02, mutation=0.01,
+    nAlleles=3000, clusterSize=50, dtype=int, seed=0, blocksize=4096):
+    """
+    Allele calls that look roughly like the real thing: isolates come
+    in clusters of close relatives, every isolate picks up a few new
+    alleles, and calls go missing more often at some loci and in some
+    isolates than others.
+
+    :param missing: average fraction of missing calls
+    :param mutation: average fraction of loci that differ from the
+        cluster it came from
+    :return: (nIsolates x nLoci) array of allele ids, 0 is missing
+    """
+    rng = np.random.RandomState( seed )
+
+    nClusters = max( 1, nIsolates // clusterSize )
+    centers = rng.randint( 1, nAlleles, ( nClusters, nLoci ) )
+
+    # Some loci are hard to call, most aren't
+    locusRate = rng.beta( 0.5, 10., nLoci )
+    locusRate *= missing / locusRate.mean()
+
+    profiles = np.zeros( ( nIsolates, nLoci ), dtype=dtype )
+
+    # A block at a time so the temporaries stay small
+    for start in range( 0, nIsolates, blocksize ):
+        nRows = min( blocksize, nIsolates - start )
+
+        block = centers[ rng.randint( 0, nClusters, nRows ) ]
+
+        mutated = rng.random_sample( ( nRows, nLoci ) ) < \
+            rng.exponential( mutation, ( nRows, 1 ) )
+        block[ mutated ] = rng.randint( 1, nAlleles, np.sum( mutated ) )
+
+        # And some isolates are worse than others
+        isolateRate = rng.gamma( 2., 0.5, ( nRows, 1 ) )
+        block[ rng.random_sample( ( nRows, nLoci ) ) < locusRate * isolateRate ] = 0
+
+        profiles[ start:start+nRows ] = block
+
+    return profiles
+
+#============================== ENGINES ===================================#
+# Every engine takes the profiles and the benchmark settings and
+# returns the number of pairs it computed
+
+def PairLoop(func):
+    def Engine(profiles, presence, args):
+        rows = profiles[ :args.loop_isolates ]
+
+        for q in Queries( profiles, args ):
+            for row in rows:
+                func( q, row )
+
+        return args.queries * len( rows )
+
+    return Engine
+
+def OneVsAll(profiles, presence, args):
+    for q in Queries( profiles, args ):
+        GetDistances( q, profiles )
+
+    return args.queries * len( profiles )
+
+def OneVsAllBitsets(profiles, presence, args):
+    for q in Queries( profiles, args ):
+        GetDistances( q, profiles, presence )
+
+    return args.queries * len( profiles )
+
+def OneVsAllBounded(profiles, presence, args):
+    for q in Queries( profiles, args ):
+        GetBoundedDistances( q, profiles, BOUND, presence )
+
+    return args.queries * len( profiles )
+
+def OneVsAllHamming(profiles, presence, args):
+    for q in Queries( profiles, args ):
+        GetHammings( q, profiles )
+
+    return args.queries * len( profiles )
+
+def AllPairs(profiles, presence, args):
+    rows = profiles[ :args.matrix_isolates ]
+    GetDistanceMatrix( rows, args.tilesize )
+
+    return len( rows ) * ( len( rows ) - 1 ) // 2
+
+def AllPairsCondensed(profiles, presence, args):
+    rows = profiles[ :args.matrix_isolates ]
+    GetCondensedMatrix( rows, args.tilesize, args.cores )
+
+    return len( rows ) * ( len( rows ) - 1 ) // 2
+
+def ManyVsMany(hamming):
+    def Engine(profiles, presence, args):
+        # Two halves, so none of the pairs are an isolate against itself
+        rows = profiles[ :args.matrix_isolates//2 ]
+        cols = profiles[ args.matrix_isolates//2:args.matrix_isolates ]
+        GetCrossDistances( rows, cols, args.tilesize, hamming=hamming )
+
+        return len( rows ) * len( cols )
+
+    return Engine
+
+def Queries(profiles, args):
+    # Spread out over the whole set, same ones every time
+    step = max( 1, len( profiles ) // args.queries )
+    return profiles[ ::step ][ :args.queries ]
+
+ENGINES = {
+    'GetDistance':          PairLoop( GetDistance ),
+    'sim':                  PairLoop( sim ),
+    'GetDistances':         OneVsAll,
+    'GetDistances+bitsets': OneVsAllBitsets,
+    'GetBoundedDistances':  OneVsAllBounded,
+    'GetDistanceMatrix':    AllPairs,
+    'GetCondensedMatrix':   AllPairsCondensed,
+    'GetCrossDistances':    ManyVsMany( False ),
+    'GetHamming':           PairLoop( GetHamming ),
+    'GetHammings':          OneVsAllHamming,
+    'GetCrossDistances+hamming': ManyVsMany( True )
+}
+
+#============================ BENCHMARKING ================================#
+def MaxRss(who):
+    # Kilobytes on Linux, bytes on a Mac
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage( who ).ru_maxrss * scale
+
+def Peaks(engine, profiles, presence, args, conn=None):
+    """
+    Peak memory of one run:
+
+        peak_heap_bytes         Python and numpy allocations of this
+                                process only, from tracemalloc
+        peak_rss_bytes          resident memory of this process, memory
+                                maps and shared arrays included
+        peak_worker_rss_bytes   resident memory of the largest worker
+                                it started, 0 without any
+
+    The rss numbers are high water marks for the whole process, so
+    this is run in a process of its own for every engine.
+    """
+    tracemalloc.start()
+    engine( profiles, presence, args )
+    peaks = { 'peak_heap_bytes': tracemalloc.get_traced_memory()[1] }
+    tracemalloc.stop()
+
+    if resource is not None:
+        peaks.update( peak_rss_bytes = MaxRss( resource.RUSAGE_SELF ),
+            peak_worker_rss_bytes = MaxRss( resource.RUSAGE_CHILDREN ) )
+
+    if conn is None:
+        return peaks
+
+    conn.send( peaks )
+    conn.close()
+
+def Measure(engine, profiles, presence, args):
+    """
+    Best time of args.repeat runs, then one more run for the peak
+    memory so measuring it doesn't slow down the timings
+    """
+    times = []
+    for _ in range( args.repeat ):
+        start = time.perf_counter()
+        pairs = engine( profiles, presence, args )
+        times.append( time.perf_counter() - start )
+
+    # Forked, so the profiles don't need to be sent over. Without fork
+    # the rss would be for the whole benchmark, so it's left out.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        recv, send = multiprocessing.Pipe( False )
+        process = multiprocessing.get_context( 'fork' ).Process( target=Peaks,
+            args=( engine, profiles, presence, args, send ) )
+        process.start()
+        peaks = recv.recv()
+        process.join()
+    else:
+        peaks = { 'peak_heap_bytes': Peaks( engine, profiles, presence, args )[
+            'peak_heap_bytes' ] }
+
+    seconds = min( times )
+
+    result = {
+        'pairs':                    pairs,
+        'seconds':                  seconds,
+        'pairs_per_sec':            pairs / seconds if seconds else float('inf'),
+        'peak_rss_bytes':           None,
+        'peak_worker_rss_bytes':    None
+    }
+    result.update( peaks )
+
+    return result
+
+def Revision():
+    try:
+        return subprocess.check_output( [ 'git', 'rev-parse', '--short', 'HEAD' ],
+            cwd=os.path.dirname( os.path.realpath( __file__ ) ),
+            stderr=subprocess.DEVNULL ).decode().strip()
+    except Exception:
+        return None
+
+def Compare(results, path):
+    """
+    Prints the change in pairs/sec against an earlier results file
+    """
+    with open( path, 'r' ) as f:
+        old = json.load( f )
+
+    def Id(result):
+        return ( result['engine'], result['isolates'], result['loci'], result['dtype'] )
+
+    before = { Id( result ): result for result in old['results'] }
+
+    print( '\nCompared to: {} ({})'.format( path, old['meta'].get( 'revision' ) ) )
+
+    for result in results:
+        previous = before.get( Id( result ) )
+        if previous is None:
+            continue
+
+        change = result['pairs_per_sec'] / previous['pairs_per_sec'] - 1.
+        print( '{:<26} {:>8} x {:<5} {:>+8.1%}'.format( result['engine'],
+            result['isolates'], result['loci'], change ) )
+
+def ParseCommandLine():
+    parser = argparse.ArgumentParser( description='Benchmarks the distance '
+        'functions on synthetic allele calls' )
+
+    parser.add_argument( '--isolates', help='Numbers of isolates to try',
+        type=int, nargs='+', default=[ 1000, 10000 ] )
+    parser.add_argument( '--loci', help='Numbers of loci to try',
+        type=int, nargs='+', default=[ 1748, 3002 ] )
+    parser.add_argument( '--missing', help='Average fraction of missing calls',
+        type=float, default=0.02 )
+    parser.add_argument( '--dtype', help='int for allele ids, uint16 for allele codes',
+        choices=[ 'int', 'int32', 'uint16' ], default='int' )
+    parser.add_argument( '--engines', help='Engines to run, default is all of them',
+        nargs='+', choices=sorted( ENGINES ), default=sorted( ENGINES ) )
+    parser.add_argument( '--queries', help='Queries for the one vs all engines',
+        type=int, default=5 )
+    parser.add_argument( '--loop_isolates', help='Isolates per query for the '
+        'pair by pair engines', type=int, default=2000 )
+    parser.add_argument( '--matrix_isolates', help='Isolates for the all pairs '
+        'engines', type=int, default=2000 )
+    parser.add_argument( '--tilesize', type=int, default=TILE_SIZE )
+    parser.add_argument( '--cores', help='Workers for GetCondensedMatrix',
+        type=int, default=1 )
+    parser.add_argument( '--repeat', type=int, default=3 )
+    parser.add_argument( '--seed', type=int, default=0 )
+    parser.add_argument( '--o', '--out', help='Write the results to this json file',
+        type=str, default=None )
+    parser.add_argument( '--c', '--compare', help='Earlier results file to compare to',
+        type=str, default=None )
+
+    return parser.parse_args()
+
+def Main(args):
+
+    results = []
+
+    # Heap is this process's Python allocations, RSS is all of its
+    # resident memory and Workers the largest worker's
+    print( '{:<26} {:>8} x {:<5} {:>12} {:>14} {:>10} {:>10} {:>10}'.format( 'Engine',
+        'Isolates', 'Loci', 'Seconds', 'Pairs/sec', 'Heap MB', 'RSS MB', 'Workers MB' ) )
+
+    for nLoci in args.loci:
+        for nIsolates in args.isolates:
+
+            profiles = SyntheticProfiles( nIsolates, nLoci, missing=args.missing,
+                seed=args.seed, dtype=np.int32 if args.dtype == 'int32' else int )
+
+            if args.dtype == 'uint16':
+                profiles = AlleleCodebook( range( nLoci ) ).EncodeArray( profiles )
+
+            # Packed once, the same way the callers keep them around
+            presence = PackPresence( profiles )
+
+            for name in args.engines:
+                result = Measure( ENGINES[ name ], profiles, presence, args )
+                result.update( engine=name, isolates=nIsolates, loci=nLoci,
+                    dtype=args.dtype )
+                results.append( result )
+
+                print( '{:<26} {:>8} x {:<5} {:>12.4f} {:>14,.0f} {:>10} {:>10} {:>10}'.format(
+                    name, nIsolates, nLoci, result['seconds'], result['pairs_per_sec'],
+                    *( '-' if result[ peak ] is None else '{:.1f}'.format( result[ peak ] / 2.**20 )
+                        for peak in ( 'peak_heap_bytes', 'peak_rss_bytes', 'peak_worker_rss_bytes' ) ) ) )
+
+    if args.o is not None:
+        meta = {
+            'revision':     Revision(),
+            'date':         datetime.now().isoformat(),
+            'python':       platform.python_version(),
+            'numpy':        np.__version__,
+            'machine':      platform.machine(),
+            'processor':    platform.processor(),
+            'cpus':         os.cpu_count(),
+            'settings':     vars( args )
+        }
+
+        with open( args.o, 'w' ) as f:
+            json.dump( { 'meta': meta, 'results': results }, f, indent=2 )
+
+    if args.c is not None:
+        Compare( results, args.c )
+
+if __name__ == '__main__':
+    Main( ParseCommandLine() )
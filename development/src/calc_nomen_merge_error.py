@@ -14,21 +14,12 @@ from copy import deepcopy
 from tqdm import *
 from nomenclature.bn_export_parser import Database, Entry
 from nomenclature.tree import Tree, Node, NamedNode
-from nomenclature.distance_matrix import DistanceMatrix as DM
+from wgst.neighbors import GetNeighborList
 
 from datetime import datetime, date
 from collections import defaultdict
 
 
-def get_distance( p1, p2 ):
-    common = np.multiply(p1>0, p2>0)
-    nCommon = np.sum(common)
-    nSame = np.sum(p1[common]==p2[common])
-    if nCommon:
-        return 100.0 * (float(nCommon) - float(nSame)) / float(nCommon) #nCommon-nSame
-    else:
-        return 100.
-
 def calculate_name(named, tree, unNamedEntry, distances, thresholds, d_matrix ):
 
     margin_error = 0.2860411899
@@ -41,7 +32,7 @@ def calculate_name(named, tree, unNamedEntry, distances, thresholds, d_matrix ):
             for named in mnode.GetChild(node).DFSNamed():
                 to_check.extend(key for key in named.GetChildrenKeys())
 
-        errs = [ thresholds[level-1] - d_matrix[unnamed,other] for other in to_check]
+        errs = [ thresholds[level-1] - d_matrix.Distance(unnamed, other) for other in to_check]
         errs = filter(lambda x: x<0, errs)
 
         if not len(errs):
@@ -61,11 +52,11 @@ def calculate_name(named, tree, unNamedEntry, distances, thresholds, d_matrix ):
 
         for other in keys_to_check:
             t = thresholds[level-1]
-            dist = d_matrix[ unnamed , other]
+            dist = d_matrix.Distance( unnamed, other )
 
             errs.append( t - dist)
 
-        # errs = [ thresholds[level-1]-d_matrix[unnamed,other] for other in keys_to_check ]
+        # errs = [ thresholds[level-1]-d_matrix.Distance(unnamed, other) for other in keys_to_check ]
 
         return errs
 
@@ -209,18 +200,18 @@ def main():
     min_pres = 0.50
     database.qc(min_pres)
 
-    distance_holder = DM()
+    # Only the pairs within the biggest threshold are kept, the merge
+    # costs look further out and those get computed when asked for
+    entries = list( database )
+    distance_holder = GetNeighborList( [ entry.key for entry in entries ],
+        np.asarray( [ entry.allele_calls for entry in entries ] ), max( thresholds ) )
     
     named = []
     i = 0
     for entry in tqdm( database, desc='Clustering' ):
 
-        dists = []
-        for other in named:
-            dists.append( get_distance( entry.allele_calls, database[other].allele_calls ) )
-
+        dists = distance_holder.Distances( entry.key, named ).tolist()
 
-        distance_holder.add( entry.key, dists )
         calculate_name(named, tree, entry.key, deepcopy(dists), thresholds, distance_holder)
 
         if tree.HasName(entry.key):
@@ -0,0 +1,60 @@
+###############################################################################
+#
+# Converts json distance matrix caches to the binary format.
+# AUTHOR: MILAN PATEL
+# CONTACT: mpatel5@cdc.gov
+#
+###############################################################################
+
+import os
+import sys
+import argparse
+
+from tqdm import *
+
+from wgst.matrix import ConvertJsonMatrix, CondensedMatrix, CHUNK_SIZE
+
+def ParseCommandLine():
+    parser = argparse.ArgumentParser( description='Converts dist_data/'
+        'distance_matrix_*_qcd.json caches to the memory mapped binary cache, '
+        'a row at a time, and checks that they are symmetric' )
+
+    parser.add_argument( 'paths', help='json caches to convert', nargs='+' )
+    parser.add_argument( '--t', '--tolerance', help='Largest difference allowed '
+        'between the two directions of a pair', type=float, default=1e-6 )
+    parser.add_argument( '--chunksize', help='Characters read at a time',
+        type=int, default=CHUNK_SIZE )
+    parser.add_argument( '--f', '--force', help='Overwrite binary caches that '
+        'are already there', action='store_true' )
+
+    return parser.parse_args()
+
+def Main(args):
+
+    failed = []
+
+    for jsonPath in args.paths:
+        path = os.path.splitext( jsonPath )[0] + '.npy'
+
+        if os.path.isfile( path ) and not args.f:
+            print( 'Skipping {}, {} is already there'.format( jsonPath, path ) )
+            continue
+
+        try:
+            with tqdm( desc = os.path.basename( jsonPath ), unit = 'rows' ) as progress:
+                matrix = ConvertJsonMatrix( jsonPath, path, args.t, args.chunksize,
+                    progress = progress.update )
+
+        except ValueError as e:
+            print( 'Could not convert {}: {}'.format( jsonPath, e ) )
+            failed.append( jsonPath )
+            continue
+
+        print( 'Wrote {} isolates to {} and {}'.format( len( matrix ), path,
+            CondensedMatrix.KeysPath( path ) ) )
+
+    if failed:
+        sys.exit( 1 )
+
+if __name__ == '__main__':
+    Main( ParseCommandLine() )
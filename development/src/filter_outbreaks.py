@@ -1,6 +1,7 @@
 import os
 import sys
-import csv
+
+from wgst.join import Export, Join
 
 file_path = os.path.join(os.getcwd(), 'ecoli_results/snsp_data/snsp_data_12-14-17@12-40-23.csv')
 out_path = os.path.join( os.getcwd(), 'ecoli_results/filtered_outbreaks/snsp_data_12-14-17@15-34-00.csv')
@@ -29,23 +30,7 @@ filtered = {'1702CAEXH-1',
 '1709MLEXH-2',
 '1601MLEXK-1'}
 
-with open(file_path, 'r') as in_file, open(out_path, 'w') as out_file:
-    in_reader = csv.reader(in_file)
-    out_writer = csv.writer(out_file)
-
-    for row in in_reader:
-
-        if row[0] == 'KEY':
-            out_writer.writerow(row)
-            continue
-
-        if row[1] and row[1] not in filtered:
-            row[1] = ''
-            out_writer.writerow(row)
-        else:
-            out_writer.writerow(row)
-
-
-
-
-
+# Only the outbreaks above are kept, every other one is blanked out
+Join(out_path, Export(file_path, convert={
+    'outbreak': lambda outbreak: outbreak if outbreak in filtered else ''
+    }))
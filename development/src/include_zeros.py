@@ -8,6 +8,7 @@ import json
 from collections import defaultdict, namedtuple
 from itertools import combinations
 from tqdm import *
+from wgst.distance import GetHamming
 
 import_file = os.path.join(os.getcwd(), 'results/clustering_validation/' 
     'database_09-13-17@15-11-39.csv')
@@ -19,15 +20,8 @@ thresholds = ( 4.050815987, 2.914238135, 2.046511241, 1.068159867, 0.041631973 )
 
 def sim(p1, p2):
 
-    return  100. - 100 * ( np.sum( p1 == p2 ) / len(p1) )
-
-def simTri(p1, p2):
-
-    common = np.multiply(p1>0, p2>0)
-    nSame = np.sum( p1[common] == p2[common] )
-    ncommon = np.sum(common)
-
-    return (100 * (float( ncommon ) - float(nsame) ) / ( float(ncommon) ))
+    # Missing calls count as an allele here
+    return 100. * GetHamming( p1, p2 ) / len(p1)
 
 with open(import_file, 'r') as f:
 
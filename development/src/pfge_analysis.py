@@ -1,5 +1,4 @@
 import os
-import csv
 import numpy as np
 from tqdm import *
 import pdb
@@ -7,6 +6,8 @@ from collections import defaultdict
 from json import dumps, loads, JSONEncoder, JSONDecoder
 import pickle
 
+from wgst.join import Export, JoinRows
+
 class PythonObjectEncoder(JSONEncoder):
     def default(self, obj):
 
@@ -22,83 +23,48 @@ def as_python_object(dct):
 
 dir_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 allele_path = os.path.join(dir_path, 'allele_calls/lmo_allele_calls_all_updated.csv')
-
-
-database = {}
-rm_keys = set()
-with open(allele_path, 'r', encoding='cp1252') as f:
-    reader = csv.reader( f )
-    header = tuple(map(str.lower, next(reader)))
-
-    for row in tqdm( reader, desc='Loading' ):
-
-        flds_data = {}
-        allele_calls = []
-        for h, f in zip(header, row):
-
-            if h.startswith('lmo'):
-
-                if f == '' or f=='?':
-                    allele_calls.append(0)
-                else:
-                    try:
-
-                        allele_calls.append(int(f))
-                    except:
-                        rm_keys.add(row[0])
-
-                        break
-
-            else:
-
-                flds_data[h] = f
-
-
-        flds_data['allele_calls'] = allele_calls
-
-        database[row[0]] = flds_data
-
-
-for rm in rm_keys:
-    del database[rm]
-
-
 wgst_path = os.path.join( dir_path, 'results/database/database_11-02-17@15-44-42.csv')
+pfge_path = os.path.join(dir_path, 'allele_calls/lmo_pfge_export.csv')
 
+PFGE = ('pfge-apai-pattern', 'pfge-asci-pattern')
 
-with open(wgst_path, 'r', encoding='cp1252') as f:
-
-    reader = csv.reader(f)
-    header = tuple(map(str.lower, next(reader)))
+def ValidCalls(row):
 
-    for row in tqdm(reader, desc='Loading wgst'):
+    for f in row.Starting('lmo'):
 
-        flds_data = { h:f for h,f in zip(header, row) }
+        if f == '' or f == '?':
+            continue
 
-        if database.get(row[0], False):
+        try:
+            int(f)
+        except ValueError:
+            return False
 
-            database[row[0]]['wgst'] = flds_data['wgst']
+    return True
 
-pfge_path = os.path.join(dir_path, 'allele_calls/lmo_pfge_export.csv')
 
-with open(pfge_path, 'r', encoding='cp1252') as f:
+# Only the keys with valid calls, the wgst names and the patterns
+# are ever held, the exports are each read once
+allele_calls = Export(allele_path, ['key'], where=ValidCalls)
+wgst = Export(wgst_path, ['key', 'wgst'])
+pfge = Export(pfge_path, ('key',) + PFGE)
 
-    reader = csv.reader(f)
-    header = tuple(map(str.lower, next(reader)))
+wgst_list = defaultdict(lambda: defaultdict(set))
+pfge_list = defaultdict(set)
 
-    for row in tqdm(reader, desc='Loading pfge'):
+# One pass over the joined rows for both
+for key, wgst_name, apai, asci in JoinRows(allele_calls, [wgst, pfge]):
 
-        if database.get(row[0], False):
-            database[row[0]].update(((h,f) for h,f in zip(header, row)))
+    if wgst_name:
 
-wgst_list = defaultdict(lambda: defaultdict(set))
+        wgst_list[wgst_name]['pfge-apai-pattern'].add(apai)
+        wgst_list[wgst_name]['pfge-asci-pattern'].add(asci)
 
-for entry in database.values():
+    if apai and asci and wgst_name:
 
-    if entry.get('wgst', False):
+        pfge_str = '{}|{}'.format( apai, asci )
 
-        wgst_list[entry['wgst']]['pfge-apai-pattern'].add(entry['pfge-apai-pattern'])
-        wgst_list[entry['wgst']]['pfge-asci-pattern'].add(entry['pfge-asci-pattern'])
+        pfge_list[pfge_str].add( wgst_name )
 
 
 out_path = os.path.join(dir_path, 'results/wgst_pfge.json')
@@ -106,17 +72,6 @@ with open(out_path, 'w') as f:
     f.write(dumps( wgst_list, cls=PythonObjectEncoder))
 
 
-pfge_list = defaultdict(set)
-
-for entry in database.values():
-
-    if entry.get('pfge-apai-pattern', False) and entry.get('pfge-asci-pattern', False) and entry.get('wgst', False):
-
-        pfge_str = '{}|{}'.format( entry['pfge-apai-pattern'], entry['pfge-asci-pattern'] )
-
-        pfge_list[pfge_str].add( entry['wgst'] )
-
-
 out_path = os.path.join(dir_path, 'results/pfge_wgst.json')
 
 with open(out_path, 'w') as f:
@@ -3,62 +3,31 @@ import csv
 import numpy as np
 from tqdm import *
 
-file = os.path.join(os.getcwd(),'ecoli_allele_calls_all.csv')
-
-calls = {}
-
-with open(file, 'r', encoding='cp1252') as f:
-
-    reader = csv.reader(f)
-    header = list(map(str.lower, next(reader)))
-
-
-    for row in tqdm(reader, 'qcing'):
-        allele_calls = []
-
-        for h,f in zip(header, row):
-
-            if h.startswith('ec'):
-
-                if f == '' or f == '?':
-
-                    allele_calls.append(0)
-
-                else:
-                    allele_calls.append(int(f))
-
-
-
-        calls[row[0]] = allele_calls
-
-
-def qc(calls, val):
-
-    poorqc = []
-
-    val = float(val)
-
-    for entry in tqdm(calls, 'qcing'):
-
-        total = 0
-
-        for i in calls[entry]:
-            if i >0:
-                total += 1
+from wgst.store import ProfileStore
+from wgst.qc import PresenceFractions, QCSweep
 
+file = os.path.join(os.getcwd(),'ecoli_allele_calls_all.csv')
 
-        if 100.*( total / len(calls[entry]) ) < val:
-            poorqc.append( [entry, total/len(calls[entry] ) ] )
+store = ProfileStore.Open(file, 'ec')
+keys = store.Keys()
 
+# A key that's repeated keeps its first place and its last calls
+rows = {}
+for i, key in enumerate(keys):
+    rows[key] = i
 
-    for result in poorqc:
-        yield result
+order = list(dict.fromkeys(keys))
+rows = np.array([rows[key] for key in order], dtype=np.int64)
 
+# One pass over the calls, every cut-off comes out of it
+fractions = PresenceFractions(store.Profiles(store.Codebook()))[rows]
 
 toCheck = (float("inf"),)
 
-for val in toCheck:
+for val, poorqc in QCSweep(fractions, toCheck, scale=100.).items():
+
+    print('{}: {} poor quality entries'.format(val, len(poorqc)))
 
     with open(str(val)+'.csv', 'w') as f:
         writer = csv.writer(f)
-        writer.writerows(qc(calls, val))
+        writer.writerows([order[i], fractions[i]] for i in poorqc.tolist())
@@ -51,7 +51,10 @@ def ParseAndValidateCommandLine():
                 
                 This will automatically calculate
                 the distance matrix if it hasn't
-                been already
+                been already. Matrices are cached
+                per export, views file and QC
+                settings, an unchanged set of inputs
+                reuses its matrix
 
         [--dm]: In case you want to only calculate
                 the distance matrix and optimize 
@@ -60,6 +63,24 @@ def ParseAndValidateCommandLine():
                 use this flag. You will then need to
                 launch another optimize job without this
                 flag
+
+        [--du]: Brings the last distance matrix with the
+                same views and QC settings up to date with
+                --f instead of recalculating it. Only the
+                pairs with a new isolate are computed,
+                isolates that are gone or fail QC are
+                dropped. On its own it only updates the
+                matrix, with --d it goes on to optimize
+
+        [--cs]: Most GB the cached distance matrices can
+                take up, least recently used ones are
+                removed first. Default is 50
+
+        [--r]:  Only keep the distances up to this radius,
+                as sparse neighbor lists instead of the
+                whole matrix. Should be at least your
+                biggest threshold, anything further is
+                computed when it's needed
         
         [--a]:  In case you want to manually define
                 your seed database and 'new' isolates to
@@ -71,6 +92,10 @@ def ParseAndValidateCommandLine():
                 of the database with only your 'new' isolates
                 inside so you can check SN/SP or cluster 
                 search on new data
+
+        [--bo]: Save the allele calls for clustering
+                validation as a binary profile store
+                instead of a csv
         """
         return usagetxt
 
@@ -89,9 +114,21 @@ def ParseAndValidateCommandLine():
     parser.add_argument( '--c', '--clustersearch', help='Search for clusters', type=bool,
         default=False )
 
+    parser.add_argument( '--bo', '--binaryout', help='Save the validation profiles as a '
+        'binary profile store instead of csv', action='store_true' )
+
     parser.add_argument( '--dm', '--dmonly', help='Calculate only the distance matrix', type=str,
         default=False )
 
+    parser.add_argument( '--du', '--dmupdate', help='Extend the cached distance matrix with '
+        'the new isolates in --f', action='store_true' )
+
+    parser.add_argument( '--cs', '--cachesize', help='Most GB the cached distance '
+        'matrices can take up', type=float, default=None )
+
+    parser.add_argument( '--r', '--radius', help='Keep only the distances up to this '
+        'radius', type=float, default=None )
+
     parser.add_argument( '--s', '--scheme', help='core or whole genome', required=True, 
                     type=str )
 
@@ -204,7 +241,7 @@ def ParseAndValidateCommandLine():
 
             if not isinstance( thresholds[-1], float ) and not isinstance( thresholds[-1], int ):
                 raise TypeError('Provide a valid step value as last value in threshold list not in list')
-    elif parser.dm:
+    elif parser.dm or parser.du:
         thresholds = None
     else:
         with open( parser.t, 'r' ) as f:
@@ -239,7 +276,7 @@ if __name__ == '__main__':
 
     args, thresholds = ParseAndValidateCommandLine()
 
-    if args.dm:
+    if args.dm or args.du or args.d:
         from wgst import overlap_v2 as overlap
         distance_matrix = overlap.Main({
             'organism':         args.g,
@@ -248,32 +285,26 @@ if __name__ == '__main__':
             'scheme':           args.s,
             'schemespath':      args.v,
             'recalculate':      args.dm,
+            'update':           args.du,
+            'radius':           args.r,
+            'cachesize':        args.cs and int( args.cs * 2**30 ),
             'outdir':           args.o,
-            'locisize':         args.locisize
-            })
-
-    elif args.d:
-        from wgst import overlap_v2 as overlap
-        distance_matrix = overlap.Main({
-            'organism':         args.g,
-            'fields_path':      args.f,
-            'minPres':          args.m,
-            'scheme':           args.s,
-            'schemespath':      args.v,
-            'recalculate':      args.dm,
-            'outdir':           args.o
+            'locisize':         args.locisize,
+            'cores':            args.d
             })
 
-        from wgst import multi_v2 as multi
-        multi.Main({
-            'cores':        args.d,
-            'matrix':       distance_matrix,
-            'scheme':       args.s,
-            'thresholds':   thresholds,
-            'fields_path':  args.f,
-            'outdir':       args.o,
-            'organism':     args.g
-            })
+        # --dm and --du on their own only bring the matrix up to date
+        if args.d and not args.dm:
+            from wgst import multi_v2 as multi
+            multi.Main({
+                'cores':        args.d,
+                'matrix':       distance_matrix,
+                'scheme':       args.s,
+                'thresholds':   thresholds,
+                'fields_path':  args.f,
+                'outdir':       args.o,
+                'organism':     args.g
+                })
 
     else:
         from wgst import single_v2
@@ -285,6 +316,8 @@ if __name__ == '__main__':
             'thresholds':       thresholds,
             'views_path':       args.v,
             'outdir':           args.o,
+            'radius':           args.r,
             'clustersearch':    args.c,
+            'binaryout':        args.bo,
             'locisize':         args.locisize
             })
\ No newline at end of file
@@ -4,7 +4,7 @@
 # Cost functions
 ##############################################################################
 
-from itertools import combinations
+import numpy as np
 
 __all__ = ['mean_error', 'mean_inter_error', 'ABSOLUTE_MARGIN_ERROR', 'SQUARED_ERROR']
 
@@ -12,25 +12,24 @@ __all__ = ['mean_error', 'mean_inter_error', 'ABSOLUTE_MARGIN_ERROR', 'SQUARED_E
 ABSOLUTE_MARGIN_ERROR = 0.2860411899
 SQUARED_ERROR = -1
 
-def mean_error(unnamed, key_list, d_matrix, thresholds, level, 
-    biased=True, squared=False):
-
-    results = []
-    for key in key_list:
-        err = thresholds[level-1]-d_matrix[unnamed,key]
+def _mean_error(errs, biased, squared):
+    """
+    Mean of the negative errors, or of all of them with the
+    non-negative ones counted as 0. if not biased
+    """
 
-        if err >= 0.:
+    over = errs < 0.
 
-            if biased:
-                continue
-            else:
-                results.append(0.)
+    if biased:
+        errs = errs[over]
+    else:
+        errs = np.where(over, errs, 0.)
 
-        elif squared:
-            results.append(err**2)
+    if squared:
+        errs = errs**2
 
-        else:
-            results.append(err)
+    # Summed in order, same as a loop over the keys would
+    results = errs.tolist()
 
     if len(results):
         return abs(sum(results))/float(len(results))
@@ -38,48 +37,22 @@ def mean_error(unnamed, key_list, d_matrix, thresholds, level,
     else:
         return 0.
 
-def mean_inter_error(unnamed, key_list, d_matrix, thresholds, level,
+def mean_error(unnamed, key_list, d_matrix, thresholds, level, 
     biased=True, squared=False):
 
-    
-    results = []
-
-    for entry, other in combinations(key_list, 2):
-
-        err = thresholds[level-1]-d_matrix[entry,other]
-
-        if err >= 0.:
-
-            if biased:
-                continue
-            else:
-                results.append(0.)
+    errs = thresholds[level-1]-d_matrix.submatrix([unnamed], key_list)[0]
 
-        elif squared:
-            results.append(err**2)
+    return _mean_error(errs, biased, squared)
 
-        else:
-            results.append(err)
-
-    for key in key_list:
-
-        err = thresholds[level-1]-d_matrix[unnamed,key]
-
-        if err >= 0.:
-
-            if biased:
-                continue
-            else:
-                results.append(0.)
-
-        elif squared:
-            results.append(err**2)
+def mean_inter_error(unnamed, key_list, d_matrix, thresholds, level,
+    biased=True, squared=False):
 
-        else:
-            results.append(err)
+    # Every pair in key_list, in the same order as combinations(),
+    # then unnamed against each of them
+    block = d_matrix.submatrix(key_list, key_list)
+    pairs = block[np.triu_indices(len(key_list), 1)]
 
-    if len(results):
-        return abs(sum(results))/float(len(results))
+    errs = thresholds[level-1]-np.concatenate((pairs,
+        d_matrix.submatrix([unnamed], key_list)[0]))
 
-    else:
-        return 0.
\ No newline at end of file
+    return _mean_error(errs, biased, squared)
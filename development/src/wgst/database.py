@@ -8,8 +8,6 @@
 
 import os
 import sys
-import csv
-import re
 import json
 import numpy as np
 import traceback
@@ -17,25 +15,15 @@ import traceback
 from tqdm import *
 from datetime import datetime
 from .environment import Log
+from .codebook import AlleleCodebook
+from .loader import ProjectView
+from .store import ProfileStore
+from .qc import PresenceFractions, QCSweep
+from .export import WriteRows, WriteProfiles, SaveProfiles
+from .keys import KeyRegistry
 
 __all__ = ['Database', 'DatabaseEntry']
 
-# These are used to extract date, if you're seeing issues with
-# dates not being extracted properly, please make sure they're
-# at least in the below formats
-REUPLOADDATE_1 = re.compile( r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})' )
-REUPLOADDATE_2 = re.compile( r'([0-9]{4})/([0-9]{1,2})/([0-9]{1,2})' )
-REUPLOADDATE_3 = re.compile( r'([0-9]{1,2})-([0-9]{1,2})-([0-9]{4})' )
-REUPLOADDATE_4 = re.compile( r'([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})' )
-REUPLOADDATE_5 = re.compile( r'([0-9]{4})' )
-
-REUPLOADDATE = {
-                    REUPLOADDATE_1: '%m/%d/%Y',
-                    REUPLOADDATE_2: '%Y/%m/%d',
-                    REUPLOADDATE_3: '%m-%d-%Y',
-                    REUPLOADDATE_4: '%Y-%m-%d'
-                    }
-
 REQ_HEADERS = ( 'key', 'outbreak', 'sourcetype', 'uploaddate' )
 
 #=================== DATABASE CLASS =====================================#
@@ -53,16 +41,36 @@ class Database(object):
         self._outdir = outdir
         self._train = []
         self._test = []
+        self._codebook = None
+
+        # Every key gets an id on load, entries are also kept by id
+        self._registry = KeyRegistry()
+        self._byId = []
         self.SetSelf( kwargs )
 
-    def AddEntry(self, kwargs):
-        entry = DatabaseEntry(kwargs)
+    def AddEntry(self, kwargs, table=None, row=None):
+        return self.Register( DatabaseEntry(kwargs, table, row) )
+
+    def Register(self, entry):
+        entry._id = self._registry.Intern( entry._key )
         self._entries[ entry._key ] = entry
+
+        if entry._id == len( self._byId ):
+            self._byId.append( entry )
+        else:
+            self._byId[ entry._id ] = entry
+
         return entry
 
     def GetEntry(self, key):
         return self._entries.get( key, None )
 
+    def GetEntryById(self, i):
+        return self._byId[i]
+
+    def Registry(self):
+        return self._registry
+
     def GetEntries(self):
         return self._entries.values()
 
@@ -104,7 +112,9 @@ class Database(object):
             Log( 'Using all loci' )
             self._scheme = 'WHOLE'
 
-    def ExtractData( self, filetype, header, reader ):
+    def ExtractData( self, filetype, store ):
+
+        header = store.Header()
 
         for head in REQ_HEADERS:
             if head not in header:
@@ -113,77 +123,44 @@ class Database(object):
         if not hasattr(self, '_locisize'):
             raise RuntimeError('Must know the amount of loci to expect')
         
-        providedLoci = set()
-        for fld in header:
-            if fld.startswith(self._organism):
-                providedLoci.add( fld )
+        providedLoci = set( store.Loci() )
 
         if self._locisize > 0 and len( providedLoci ) < self._locisize:
             raise ValueError("Only found {} loci, "
                 "make sure you're not missing anything".format( 
                 len(providedLoci) ) )
 
-        if self._scheme == 'WHOLE':
-            activeLoci = providedLoci
-        else:
-            activeLoci = Database.GetView( self._scheme )
+        # Calls are kept as small per locus codes, the codebook is
+        # shared by every file we load
+        if self._codebook is None:
+            self._codebook = AlleleCodebook.Load( self.CodebookPath(),
+                self.ActiveLoci( store ) )
 
-        for row in tqdm( reader, desc= 'Loading metadata and allele calls' ):
-            
-            fldsAndData = {}
-            alleleCalls = []
+        # Every allele call of the file sits in one array, each entry
+        # holds a read only view of its row. The other loci are calls
+        # too, they're not kept around as metadata.
+        profiles = store.Profiles( self._codebook )
 
-            if row[0] == 'key' or self.GetEntry( row[0] ):
-                continue
+        assert profiles.shape[1] == self._locisize
 
-            for h, fld in zip( header, row ):
-                # Match the upload date
-                if h == 'uploaddate':
+        # The other columns stay in the store, the entries look
+        # them up by row
+        table = { h: store.Metadata( h ) for h in store.MetadataNames()
+            if h != 'uploaddate' }
+        uploadDates = store.UploadDates()
 
-                    # Make it a proper variable name
-                    h = '_'+h
+        for i, key in enumerate( tqdm( store.Keys(), desc='Loading metadata and allele calls' ) ):
 
-                    for matchObj in REUPLOADDATE.keys():
-                        matched = matchObj.match( fld )
-
-                        if matched:
-                            fldsAndData[h] = datetime.strptime(
-                                fld,
-                                REUPLOADDATE[matchObj] ).date()
-
-                            break
-
-                    if matched is None:
-
-                        if REUPLOADDATE_5.match( fld ):
-                            fldsAndData[h] = datetime.strptime(
-                                fld,
-                                "%Y" ).date()
-                        else:
-                            fldsAndData[h] = datetime.strptime(
-                                '1/1/2000',
-                                '%m/%d/%Y' ).date()                       
-
-                # Check for the allele calls
-                elif h.startswith( self._organism ) and h in activeLoci:
-                    if fld == '' or fld == '?':
-                        alleleCalls.append( 0 )
-                    else:
-                        try:
-                            alleleCalls.append( int(fld) )
-                        except:
-                            tqdm.write(row[0])
-
-                else:
-                    fldsAndData['_'+h] = fld if fld else None
-
-            alleleCalls = np.asarray( alleleCalls, dtype=int )
-            alleleCalls.flags.writeable = False
+            if self.GetEntry( key ):
+                continue
 
-            assert len(alleleCalls) == self._locisize
+            fldsAndData = {
+                '_key':         key,
+                '_uploaddate':  uploadDates[i],
+                '_allelecalls': profiles[i]
+            }
 
-            fldsAndData['_allelecalls'] = alleleCalls
-            e = self.AddEntry( fldsAndData )
+            e = self.AddEntry( fldsAndData, table, i )
 
             # if filetype == 'train':
             #     if e not in self._test:
@@ -195,57 +172,95 @@ class Database(object):
             # else:
             #     raise RuntimeError('Invalid filetype provided')
 
+    def ActiveLoci(self, store):
+        """
+        The loci of the scheme the store has calls for, all of them for
+        the whole scheme. LoadActiveLoci has to have run.
+        """
+        if self._scheme == 'WHOLE':
+            return list( store.Loci() )
+
+        activeLoci = Database.GetView( self._scheme )
+
+        return [ h for h in store.Loci() if h in activeLoci ]
+
     def LoadCalls(self):
 
         # Let's load them if present
         self.LoadActiveLoci()
 
         # For each file, lets add the data
+        # parsed once into a binary store next to the export
         for filetype, fieldsPath in self._metadata.items():
-            with open(fieldsPath, 'r', encoding='cp1252') as f:
-                reader = csv.reader( f )
-                header = tuple( map( str.lower, next( reader ) ) )
-                self.ExtractData( filetype, header, reader )
+            self.ExtractData( filetype, ProfileStore.Open( fieldsPath, self._organism,
+                cores=getattr( self, '_cores', 1 ) ) )
+
+        # Keep the codes stable for the next run
+        if self._codebook is not None:
+            self._codebook.Save( self.CodebookPath() )
+
+    def CodebookPath(self):
+        return os.path.join( self._outdir, 'allele_codebook_{}_{}.json'.format(
+            self._organism, self._scheme ) )
+
+    def Decode(self, calls):
+        # Allele codes back to allele ids
+        return self._codebook.Decode( calls )
+
+    def SetScheme(self, scheme):
+        """
+        Switches every entry over to another scheme out of the loci
+        already loaded, e.g. core after WHOLE, by gathering the columns
+        out of the loaded calls instead of reading the files again. The
+        codes stay the same, the codebook isn't saved for the new scheme.
+        """
+        activeLoci = Database.GetView( scheme )
+        loci = [ locus for locus in self._codebook.Loci() if locus in activeLoci ]
+        entries = list( self._entries.values() )
+
+        if entries:
+            profiles = ProjectView( np.stack( [ entry._allelecalls for entry in entries ] ),
+                self._codebook.Loci(), loci )
+            profiles.flags.writeable = False
+
+            for entry, alleleCalls in zip( entries, profiles ):
+                entry._allelecalls = alleleCalls
+
+        self._codebook = self._codebook.Project( loci )
+        self._scheme = scheme
 
     def QC( self, minPresence ):
 
-        to_remove = set()
+        to_remove = self.QCSweep( [ minPresence ] )[ minPresence ]
         
-        poorQuality = 0
-        for entry in tqdm( self.GetEntries(), desc='QC'):
-            nonZero = len( entry._allelecalls[entry._allelecalls > 0] )
-            total = len( entry._allelecalls )
-            qcVal = True
-
-            if float( nonZero ) / float( total ) < minPresence:
-                qcVal = False
-                poorQuality += 1
-                to_remove.add(entry._key)
-
-            if not hasattr( entry, '_qc' ):
-                setattr( entry, '_qc', qcVal )
-            else:
-                entry._qc = qcVal
+        for entry in self.GetEntries():
+            entry._qc = True
 
         for rm in to_remove:
             del self._entries[rm]
 
-        print( 'Poor quality entries: {:d}'.format( poorQuality ) )
+        print( 'Poor quality entries: {:d}'.format( len( to_remove ) ) )
 
-    def Save( self ):
-
-        def WriteOut( path, header, attrs ):
+    def QCSweep( self, minPresences ):
+        """
+        Presence QC for several cut-offs in one pass over the calls
 
-            with open(path, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(header)
+        :return: { minPresence: keys of the entries under it }
+        """
+        entries = list( self.GetEntries() )
+        fractions = PresenceFractions( [ entry._allelecalls for entry in entries ] )
 
-                for entry in tqdm(self._entries.values(), 
-                    desc='Saving: {}'.format(path) ):
+        return { minPresence: [ entries[i]._key for i in rows.tolist() ]
+            for minPresence, rows in QCSweep( fractions, minPresences ).items() }
 
-                    oArray = []
-                    oArray.extend( entry.__getattribute__(x) for x in attrs if hasattr(entry, x ) )
-                    writer.writerow( oArray )
+    def Save( self ):
+        """
+        Every output comes out of one pass over the entries. The allele
+        calls for validation are decoded and written a chunk of isolates
+        at a time, or saved as a profile store instead when the database
+        was made with binaryout.
+        """
+        entries = list( self._entries.values() )
 
         DIRS = { x : os.path.join( self._outdir, x) for x in ['database',
         'snsp_data', 'clustering_validation', 'cluster_search' ] }
@@ -257,6 +272,9 @@ class Database(object):
         REF_ATTRS = [ '_key', '_outbreak', '_sourcetype', '_uploaddate', '_wgst', 
                         '_wgstHistory' ]
 
+        rows = [ [ getattr( entry, x ) for x in REF_ATTRS if hasattr( entry, x ) ]
+            for entry in tqdm( entries, desc='Saving' ) ]
+
         OUT_NAME = datetime.now().strftime("%m-%d-%y@%H-%M-%S")
         for directory, path in DIRS.items():
             if not os.path.isdir( directory ):
@@ -268,11 +286,17 @@ class Database(object):
             header = [ x[1:].upper() for x in REF_ATTRS ]
 
             if directory != 'clustering_validation':
-                WriteOut( path_out, header, REF_ATTRS )
+                WriteRows( path_out, header, rows )
+
+            elif getattr( self, '_binaryout', False ):
+                SaveProfiles( os.path.splitext( path_out )[0]+'.store',
+                    [ x[1:].lower() for x in REF_ATTRS ], rows,
+                    [ entry._allelecalls for entry in entries ], self._codebook )
+
             else:
-                newHeader = header+['ALLELECALLS']
-                newREFS = REF_ATTRS+['_allelecalls']
-                WriteOut( path_out, newHeader, newREFS )
+                # One column per locus, the same as the calls
+                WriteProfiles( path_out, header+list( self._codebook.Loci() ), rows,
+                    [ entry._allelecalls for entry in entries ], self._codebook )
 
     def SetSelf( self, kwargs ):
         for attr, val in kwargs.items():
@@ -295,19 +319,55 @@ class Database(object):
             raise ValueError('Invalid View Mode')
 
 class DatabaseEntry(object):
-
-    def __init__(self, kwargs):
-
+    """
+    One isolate, kept small: the fields every pipeline uses are slots and
+    the allele calls are a read only row of the profile matrix of the
+    file the entry came from. Every other column of the export stays in
+    that file's metadata table, entry._<column> looks it up by row, None
+    when it's empty. Fields set that don't have a slot go in _fields.
+    """
+
+    __slots__ = ( '_key', '_id', '_uploaddate', '_allelecalls', '_qc', '_wgst',
+        '_wgstHistory', '_table', '_row', '_fields' )
+
+    def __init__(self, kwargs, table=None, row=None):
+
+        self._table = table
+        self._row = row
+        self._fields = None
+        self._id = None
         self.SetSelf(kwargs)
         self._wgst = None
         self._wgstHistory = []
 
     def SetSelf( self, kwargs ):
         for attr, val in kwargs.items():
-            if attr.startswith('_'):
+            if not attr.startswith('_'):
+                attr = '_'+attr
+
+            try:
                 setattr( self, attr, val )
-            else:
-                setattr( self, '_'+attr, val )
+
+            except AttributeError:
+                if self._fields is None:
+                    self._fields = {}
+
+                self._fields[ attr ] = val
+
+    def __getattr__(self, attr):
+        # Only gets here when it's not a slot that's been set
+        if attr.startswith('__') or not attr.startswith('_') or \
+            attr in DatabaseEntry.__slots__:
+
+            raise AttributeError( attr )
+
+        if self._fields is not None and attr in self._fields:
+            return self._fields[ attr ]
+
+        if self._table is not None and attr[1:] in self._table:
+            return self._table[ attr[1:] ][ self._row ] or None
+
+        raise AttributeError( attr )
 
 if __name__ == '__main__':
 
@@ -1,50 +1,126 @@
 import os
 import sys
 import warnings
+import numpy as np
 from collections import defaultdict
 
 class DistMatrix(object):
+    """
+    Distances between entries that are added one at a time, each with
+    its distances to every entry added before it.
 
-    def __init__(self):
+    The lower triangle is kept row after row in one flat float buffer,
+    (1,0), (2,0), (2,1), (3,0)... so row k starts at k*(k-1)/2 no matter
+    how big the buffer is. The buffer doubles when it fills up and the
+    rows already in it are copied over as is.
+    """
+
+    def __init__(self, capacity=1024):
         self._entry_to_index = {}
-        self._distances = []
+        self._entries = []
+        self._distances = np.zeros(self._offset(capacity), dtype=float)
+
+    @staticmethod
+    def _offset(index):
+        return index * (index - 1) // 2
 
     def add(self, entry, dists):
+        """
+        :param dists: distances to every entry already in the matrix,
+            in the order they were added
+        """
 
         if entry in self._entry_to_index:
             warnings.warn( 'Tried to add distances for an'
                 'entry already present in the matrix', RuntimeWarning )
             return
 
-        self._distances.append(dists)
-        self._entry_to_index[entry] = len(self._distances)-1
+        index = len(self._entries)
 
+        if len(dists) != index:
+            raise ValueError('Expected {} distances for {}, got {}'.format(
+                index, entry, len(dists)))
 
-    def __getitem__(self, tup):
+        start = self._offset(index)
 
-        if len(tup) != 2:
-            raise RuntimeError('Tried to access too many'
-                ' distances: {}'.format(', '.join(tup)))
+        if start + index > len(self._distances):
+            grown = np.zeros(max(2 * len(self._distances), start + index),
+                dtype=float)
+            grown[:start] = self._distances[:start]
+            self._distances = grown
+
+        self._distances[start:start+index] = dists
+        self._entries.append(entry)
+        self._entry_to_index[entry] = index
 
-        for entry in tup:
+    def _indices(self, entries):
+        indices = []
+
+        for entry in entries:
             if entry not in self._entry_to_index:
                 raise RuntimeError('Missing key: {}'.format(
                     entry))
 
-        index_zero = self._entry_to_index[tup[0]]
-        index_one = self._entry_to_index[tup[1]]
+            indices.append(self._entry_to_index[entry])
+
+        return np.asarray(indices, dtype=np.int64)
+
+    def row(self, entry):
+        """
+        Distances from entry to every entry, in the order they were
+        added, 0. for itself
+        """
+        index = self._indices([entry])[0]
+        n = len(self._entries)
+
+        row = np.zeros(n, dtype=float)
+
+        # Its own row has everything before it, the later rows
+        # each have one distance to it
+        start = self._offset(index)
+        row[:index] = self._distances[start:start+index]
+
+        later = np.arange(index + 1, n)
+        row[index+1:] = self._distances[self._offset(later) + index]
+
+        return row
+
+    def submatrix(self, entries_a, entries_b):
+        """
+        :return: len(entries_a) x len(entries_b) array of distances
+        """
+        a = self._indices(entries_a)[:, None]
+        b = self._indices(entries_b)[None, :]
+
+        high = np.maximum(a, b)
+        low = np.minimum(a, b)
+        same = high == low
+
+        # Any valid position will do on the diagonal, it's zeroed after
+        block = self._distances[np.where(same, 0, self._offset(high) + low)]
+        block[same] = 0.
+
+        return block
+
+    def __getitem__(self, tup):
+
+        if len(tup) != 2:
+            raise RuntimeError('Tried to access too many'
+                ' distances: {}'.format(', '.join(tup)))
+
+        index_zero, index_one = self._indices(tup).tolist()
 
         if index_zero == index_one:
-            if tup[0] == tup[1]:
-                return 0.
-            else:
-                raise RuntimeError('Unrecoverable error'
-                    ' two different isolates have the same'
-                    ' index in distance_matrix')
+            return 0.
 
         elif index_zero < index_one:
-            return self._distances[index_one][index_zero]
+            return float(self._distances[self._offset(index_one) + index_zero])
 
         else:
-            return self._distances[index_zero][index_one]
+            return float(self._distances[self._offset(index_zero) + index_one])
+
+    def __len__(self):
+        return len(self._entries)
 
+    def __contains__(self, entry):
+        return entry in self._entry_to_index
@@ -0,0 +1,242 @@
+###########################################################
+# Joins and filters over exports, on the key column
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import csv
+from operator import itemgetter
+
+from tqdm import *
+
+from .loader import Records
+
+__all__ = [ 'Export', 'Row', 'JoinColumns', 'JoinRows', 'Join' ]
+
+JOINS = ( 'left', 'inner' )
+
+#============================= EXPORTS ====================================#
+class Row(object):
+    """
+    A row of an export the way the where predicates see it. Columns are
+    looked up by name in the row as it was read, nothing is copied.
+    """
+
+    __slots__ = ( '_export', '_values' )
+
+    def __init__(self, export, values):
+        self._export = export
+        self._values = values
+
+    def __getitem__(self, name):
+        return self._values[ self._export._columns[ name.lower() ] ]
+
+    def get(self, name, default=None):
+        i = self._export._columns.get( name.lower() )
+
+        if i is None or i >= len( self._values ):
+            return default
+
+        return self._values[i]
+
+    def Starting(self, prefix):
+        """
+        :return: the values of every column that starts with prefix
+        """
+        return [ self._values[i] for i in self._export.Starting( prefix ) ]
+
+class Export(object):
+    """
+    An export read a row at a time, only the selected columns of the
+    rows that pass where are ever kept. Column names are matched
+    without case, the first of a repeated column wins.
+
+    :param columns: the columns to take, a list of names or a dict that
+        renames them, { name in the export: name in the output }. None
+        takes every column under the name it has in the export
+    :param where: predicate on a Row, rows it's False for are skipped
+    :param convert: { output name: function } applied to the values of
+        that column
+    :param key: the column the rows are joined on
+    """
+
+    def __init__(self, path, columns=None, where=None, convert=None, key='key',
+        encoding='cp1252'):
+
+        self._path = path
+        self._where = where
+        self._encoding = encoding
+        self._prefixes = {}
+
+        with open( path, 'r', encoding=encoding ) as f:
+            self._header = next( csv.reader( f ) )
+
+        self._columns = { h.lower(): i for i, h in reversed( list( enumerate( self._header ) ) ) }
+
+        if key.lower() not in self._columns:
+            raise ValueError( 'Missing field: {} in {}'.format( key, path ) )
+
+        self._key = self._columns[ key.lower() ]
+
+        if columns is None:
+            columns = self._header
+
+        if not isinstance( columns, dict ):
+            columns = { name: name for name in columns }
+
+        missing = [ name for name in columns if name.lower() not in self._columns ]
+
+        if missing:
+            raise ValueError( 'Missing fields: {} in {}'.format( ', '.join( missing ), path ) )
+
+        self._names = list( columns.values() )
+        self._indices = [ self._columns[ name.lower() ] for name in columns ]
+
+        convert = { name.lower(): func for name, func in ( convert or {} ).items() }
+        self._convert = [ ( i, convert[ name.lower() ] ) for i, name in enumerate( self._names )
+            if name.lower() in convert ]
+
+    def Names(self):
+        return self._names
+
+    def Starting(self, prefix):
+        prefix = prefix.lower()
+
+        if prefix not in self._prefixes:
+            self._prefixes[ prefix ] = [ i for h, i in self._columns.items()
+                if h.startswith( prefix ) ]
+
+        return self._prefixes[ prefix ]
+
+    def Rows(self, desc=None):
+        """
+        Streams the export once
+
+        :return: generator of ( key, values ), values a tuple of the
+            selected columns in order
+        """
+        if len( self._indices ) > 1:
+            getter = itemgetter( *self._indices )
+
+        # itemgetter of one index doesn't give a tuple
+        else:
+            getter = lambda row: tuple( row[i] for i in self._indices )
+
+        last = max( self._indices + [ self._key ] )
+
+        with open( self._path, 'r', encoding=self._encoding ) as f:
+            reader = csv.reader( f )
+            next( reader )
+
+            for row in tqdm( Records( reader, self._header[0].lower() ), desc=desc or self._path ):
+
+                if len( row ) <= last:
+                    raise ValueError( 'Row for {} is missing fields in {}'.format(
+                        row[0], self._path ) )
+
+                if self._where is not None and not self._where( Row( self, row ) ):
+                    continue
+
+                values = getter( row )
+
+                if self._convert:
+                    values = list( values )
+
+                    for i, func in self._convert:
+                        values[i] = func( values[i] )
+
+                    values = tuple( values )
+
+                yield row[ self._key ], values
+
+    def Index(self):
+        """
+        The selected columns by key, the last row of a key wins
+
+        :return: { key: values }
+        """
+        return dict( self.Rows() )
+
+#============================== JOINS =====================================#
+def JoinColumns(base, others):
+    """
+    Columns of the joined table: the base's then any new ones of the
+    others, in order. A column an other export shares with the base or
+    an earlier one replaces its values wherever the key is found.
+
+    :return: ( names, [ positions of each other's columns ] )
+    """
+    names = list( base.Names() )
+    placed = { name.lower(): i for i, name in enumerate( names ) }
+    positions = []
+
+    for other in others:
+        places = []
+
+        for name in other.Names():
+            if name.lower() not in placed:
+                placed[ name.lower() ] = len( names )
+                names.append( name )
+
+            places.append( placed[ name.lower() ] )
+
+        positions.append( places )
+
+    return names, positions
+
+def JoinRows(base, others=(), how='left'):
+    """
+    Joins the others onto base on the key. The others are each read
+    once into a hashed index of only their selected columns, base is
+    streamed past them so it's never held in memory.
+
+    :param how: 'left' keeps every row of base, columns of an export
+        that doesn't have the key are left as they are, '' if new.
+        'inner' keeps only the rows every other export has
+    :return: generator of the joined rows, lists in the order of
+        JoinColumns
+    """
+    if how not in JOINS:
+        raise ValueError( 'Invalid join: {}, use one of {}'.format( how, ', '.join( JOINS ) ) )
+
+    names, positions = JoinColumns( base, others )
+    indexes = [ other.Index() for other in others ]
+    fill = [ '' ] * ( len( names ) - len( base.Names() ) )
+
+    for key, values in base.Rows():
+        row = list( values ) + fill
+
+        for index, places in zip( indexes, positions ):
+            found = index.get( key )
+
+            if found is None:
+                if how == 'inner':
+                    break
+
+                continue
+
+            for place, value in zip( places, found ):
+                row[ place ] = value
+
+        else:
+            yield row
+
+def Join(path, base, others=(), how='left'):
+    """
+    JoinRows written to path as it goes, with a header
+
+    :return: number of rows written
+    """
+    names, _ = JoinColumns( base, others )
+    total = 0
+
+    with open( path, 'w', newline='' ) as f:
+        writer = csv.writer( f )
+        writer.writerow( names )
+
+        for row in JoinRows( base, others, how ):
+            writer.writerow( row )
+            total += 1
+
+    return total
@@ -18,6 +18,9 @@ import random
 import re
 import numpy as np
 
+from .matrix import CondensedMatrix
+from .neighbors import NeighborList
+
 REQUEST_GET_NEXT = '__request_next__'
 RESPONSE_DATA = '__response_data__'
 RESPONSE_DONE = '__response_done__'
@@ -127,21 +130,22 @@ def DataConsumer( pipe ):
 	class Database(Database):
 
 		def AddEntry(self, **kwargs):
-			entry = DatabaseEntry(kwargs)
-			self._entries[ entry._key ] = entry
-			return entry
+			return self.Register( DatabaseEntry(kwargs) )
 
 		def LoadDistanceData(self):
 
 			self._len = len( Main.distance_matrix )
 
-			for k, v in Main.distance_matrix.items():
+			# Same ids as the matrix, an entry's id is its row
+			self._registry = Main.distance_matrix.Registry()
+
+			# The matrix is mapped read only, every entry
+			# just looks up its own row in it
+			for k in Main.distance_matrix.Keys():
 				
 				newEntry = self.AddEntry( key=k )
-				
-				assert len( v ) == self._len - 1
 
-				newEntry.AddDistanceData( v )
+				newEntry.AddDistanceData( Main.distance_matrix )
 
 			print('Pid: {} has loaded distance matrix at {}'.format( os.getpid(), datetime.now() ))
 		
@@ -155,66 +159,21 @@ def DataConsumer( pipe ):
 			addingSet = [ addingSet[i:i+30] for i in range(0, len(addingSet), 30) ]
 			return (( startingSet, addingSet ))
 
-		def ExtractData(self, filetype, header, reader ):
-			refHeader = ( 'key', 'uploaddate' )
-
-			REUPLOADDATE_1 = re.compile( r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})' )
-			REUPLOADDATE_2 = re.compile( r'([0-9]{4})/([0-9]{1,2})/([0-9]{1,2})' )
-			REUPLOADDATE_3 = re.compile( r'([0-9]{1,2})-([0-9]{1,2})-([0-9]{4})' )
-			REUPLOADDATE_4 = re.compile( r'([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})' )
-			REUPLOADDATE_5 = re.compile( r'([0-9]{4})' )
+		def ExtractData(self, filetype, store ):
 
-			REUPLOADDATE = {
-								REUPLOADDATE_1: '%m/%d/%Y',
-								REUPLOADDATE_2: '%Y/%m/%d',
-								REUPLOADDATE_3: '%m-%d-%Y',
-								REUPLOADDATE_4: '%Y-%m-%d'
-								}
+			if 'uploaddate' not in store.Header():
+				raise ValueError('Missing field: uploaddate')
 
+			# The store has the dates parsed already
 			count = 0
-			for row in reader:
+			for key, upload in zip( store.Keys(), store.UploadDates() ):
 
-				if row[0] == 'key':
-					continue
-
-				entry = self.GetEntry( row[0] )
+				entry = self.GetEntry( key )
 
 				if entry is None:
 					continue
 
-				for h, fld in zip(header, row):
-
-					if h not in refHeader:
-						continue
-
-					elif h == 'uploaddate':
-
-						h = '_' + h
-
-						for matchObj in REUPLOADDATE.keys():
-							matched = matchObj.match( fld )
-
-							if matched:
-								upload = datetime.strptime(
-									fld,
-									REUPLOADDATE[matchObj] ).date()
-
-								break
-
-						if matched is None:
-
-							if REUPLOADDATE_5.match( fld ):
-								upload = datetime.strptime(
-									fld,
-									"%Y" ).date()
-							else:
-								upload = datetime.strptime(
-									'1/1/2000',
-									'%m/%d/%Y' ).date()
-
-						setattr(entry, h, upload)
-
-						break
+				setattr(entry, '_uploaddate', upload)
 
 				count +=1
 
@@ -241,33 +200,39 @@ def DataConsumer( pipe ):
 	#====================== DATABASE ENTRY OBJECT ===========================#
 	class DatabaseEntry(DatabaseEntry):
 
+		__slots__ = ( '_distances', )
+
 		def AddDistanceData(self, data):
-			assert isinstance(data, dict)
+			assert isinstance(data, (CondensedMatrix, NeighborList))
+			assert self._id == data.Index( self._key )
 			self._distances = data
 		
 		
 		def Distance(self, other):
-			if isinstance(other, str):
-				dist = self._distances.get(other, None)
-				
-				if dist == None:
-					raise ValueError( 'Distance Accession Error: {}-{}'.format(self._key, other ) )
-				else:
-					return dist
+			if isinstance(other, type(self) ):
+				other = other._key
 
-			elif isinstance(other, type(self) ):
-				dist = self._distances.get(other._key, None)
-				
-				if dist == None:
-					raise ValueError( 'Distance Accession Error: {}-{}'.format(self._key, other.Key() ) )
-				else:
-					return dist
-
-			else:
+			elif not isinstance(other, str):
 				raise TypeError( 'Invalid object for dist accession: {}'.format( repr( other ) ) )
 
+			try:
+				return self._distances.Distance( self._key, other )
+
+			except KeyError:
+				raise ValueError( 'Distance Accession Error: {}-{}'.format(self._key, other ) )
+
+		def Id(self):
+			return self._id
+
+		def Distances(self, ids, bound=None):
+			"""
+			Distances to a list of isolate ids at once, as an array.
+			Neighbor lists only have the pairs up to bound.
+			"""
+			return self._distances.IdDistances( self._id, ids, bound )
+
 		def GetDistances(self):
-			return self._distances
+			return self._distances.RowData( self._key )
 
 		@property
 		def Wgst(self):
@@ -410,13 +375,19 @@ def DataConsumer( pipe ):
 			self._thresholds = thresholds
 			self._entryBase = database
 
+			# What the distances are compared against, see Cutoffs
+			self._cutoffs = Main.distance_matrix.Cutoffs( thresholds )
+
 		def DoValidation(self):
 
 			# Initialize our constants
 			self._tree = Tree( len( self._thresholds ) )
 			self._wgstHistory = WgstHistory( self._thresholds )
 			self._startingSet, addingSet = self._entryBase.CreateSubset()
+
+			# Isolate ids, the tree is kept by id too
 			self._namedEntries = []
+			self._named = self._entryBase.Registry().Mask()
 
 			# Create starting and adding sets return the updated Names object to track history
 			print('Pid: {} is initializing clusters at: {}'.format( 
@@ -446,35 +417,33 @@ def DataConsumer( pipe ):
 			#for each entry, calculate the name 
 			for entry in selection:
 					
-				if entry._key in self._namedEntries:
+				if self._named[ entry._id ]:
 					continue
 				
-				dists = []
-				for i in range(len(self._namedEntries)):
-					dist = entry.Distance(self._namedEntries[i])
-
-					if dist <= self._thresholds[0]:
-						dists.append((dist,i))
+				distances = entry.Distances( self._namedEntries, bound = self._cutoffs[0] )
+				dists = [ ( float( distances[i] ), int( i ) ) for i in
+					np.flatnonzero( distances <= self._cutoffs[0] ) ]
 				# dists = [ entry.Distance( e ) for e in self._namedEntries ]
 				
 				#calculate the name of the entry
-				CalcName( self._namedEntries, self._tree, entry._key, dists, self._thresholds )
+				CalcName( self._namedEntries, self._tree, entry._id, dists, self._cutoffs )
 				
 				#keep track of the data
-				if self._tree.HasName( entry._key ):
-					self._namedEntries.append( entry._key )
-					nameFrequencies[ self._tree.GetStrName( entry._key ) ] = nameFrequencies.get( self._tree.GetStrName( entry._key ), 0) + 1
+				if self._tree.HasName( entry._id ):
+					self._namedEntries.append( entry._id )
+					self._named[ entry._id ] = True
+					nameFrequencies[ self._tree.GetStrName( entry._id ) ] = nameFrequencies.get( self._tree.GetStrName( entry._id ), 0) + 1
 
 			if iteration == 0:
 				for entry in self._namedEntries:
-					self._entryBase.GetEntry( entry ).Wgst = \
+					self._entryBase.GetEntryById( entry ).Wgst = \
 						self._tree.GetStrName( entry )
 
 			for entry in self._namedEntries:
-				dbEntry = self._entryBase.GetEntry( entry )
+				dbEntry = self._entryBase.GetEntryById( entry )
 
 				oldName = dbEntry.Wgst
-				newName = self._tree.GetStrName( dbEntry._key )
+				newName = self._tree.GetStrName( entry )
 
 				if oldName == newName:
 					continue
@@ -585,8 +554,9 @@ def Main(args):
 	numConsumers = args['cores'] - 3
 
 	# Assign the distance_matrix to the current namespace, children
-	# will inherit it
-	Main.distance_matrix = args['matrix']
+	# will inherit it. It's kept in shared memory so every child
+	# reads the same copy
+	Main.distance_matrix = args['matrix'].Shared()
 
 	# Communication for the children
 	pipes = [ Pipe( duplex=True ) for x in range( numConsumers ) ]
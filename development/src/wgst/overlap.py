@@ -10,34 +10,24 @@ import os
 import sys
 import json
 import csv
-import itertools
 import numpy as np
 from tqdm import *
-
-#======================== DISTANCE FUNCTION ===============================#
-def GetDistance(p1, p2):
-    # Find the loci that are present in both samples
-    common = np.multiply(p1>0, p2>0)
-
-    # Count the total number of loci that are present for both
-    nCommon = np.sum(common)
-
-    # For where they both have a presence, see where they are the same 
-    nSame = np.sum(p1[common]==p2[common])
-
-    # If they have anything in common, find out how much
-    if nCommon:
-      return 100.0 * (float(nCommon) - float(nSame)) / float(nCommon)
-    
-    # This shouldn't happen too often
-    else:
-      return 100.0
+from .distance import TILE_SIZE
+from .matrix import GetCondensedMatrix, UpdateCondensedMatrix, CondensedMatrix, \
+    ConvertJsonMatrix, CACHE_DTYPE
+from .cache import SettingsKey, DataKey, ArtifactPath, LatestArtifact, \
+    RemoveArtifact, Touch, Evict, MAX_CACHE_BYTES
+from .neighbors import NeighborList, GetNeighborList, UpdateNeighborList
+from .codebook import AlleleCodebook
+from .store import ProfileStore
+from .qc import PresenceFractions
 
 class Database(object):
 
-    def __init__(self, fields_path, minpresence, scheme, viewsPath):
+    def __init__(self, fields_path, minpresence, scheme, viewsPath, cores=1):
         self._entries = {}
         self._fieldsPath = fields_path
+        self._cores = cores
         self._minPres = minpresence
         self._scheme = scheme
         self._viewsPath = viewsPath
@@ -61,87 +51,78 @@ class Database(object):
 
     def LoadCalls(self):
 
-        with open( self._fieldsPath, 'r', encoding='cp1252') as f:
-            reader = csv.reader( f )
-            header = tuple( map(str.lower, next( reader ) ) )
-
-            loci = 0
-            for fld in header:
-                if fld.lower().startswith('lmo'):
-                    loci += 1
+        # Parsed once into a binary store next to the export
+        store = ProfileStore.Open( self._fieldsPath, 'lmo', cores=self._cores )
 
-            if loci < 1747:
-                raise ValueError("Only found {} loci, "
-                    "make sure we're not missing anything".format( 
-                    str( loci) ) )
+        loci = len( store.Loci() )
 
-            # Load the data from the file
-            for row in tqdm( reader, desc='Loading data for matrix calc'):
-                
-                fldsAndData = { h:f for h,f in zip( header, row ) }
+        if loci < 1747:
+            raise ValueError("Only found {} loci, "
+                "make sure we're not missing anything".format( 
+                str( loci) ) )
 
-                """
-                Make sure not to have empty keys in your files, but this
-                should have you covered
-                """
-                if len( fldsAndData['key'] ) > 0:
-                    key = fldsAndData['key']
-                else:
-                    continue
+        # Only distances come out of here, so the codes
+        # don't need to outlive the run
+        codebook = AlleleCodebook( ActiveLoci( store, self._scheme, self._views ) )
 
-                if self._scheme == 'whole':
-                    alleleCalls = []
-                    for i, fld in enumerate( header ):
-                        if fld.startswith('lmo'):
-                            alleleCalls.append( row[i] )
+        profiles = store.Profiles( codebook )
 
-                    alleleCalls = np.asarray( alleleCalls, dtype=int )
-                    alleleCalls.flags.writeable = False
+        # Calc the % present
+        present = PresenceFractions( profiles )
 
-                else:
-                    activeLoci = self.GetView( self._scheme )
-                    calls = {}
-                    for i, fld in enumerate( header ):
-                        if fld.startswith('lmo'):
-                            calls[fld] = row[i]
+        for i, key in enumerate( store.Keys() ):
 
-                    alleleCalls = np.asarray( [ calls[locus.lower()] for locus in activeLoci ], dtype=int )
-                    alleleCalls.flags.writeable = False
+            """
+            Make sure not to have empty keys in your files, but this
+            should have you covered
+            """
+            if len( key ) == 0 or present[i] < self._minPres:
+                continue
 
-                # Check how many allele calls are present
-                present = sum( alleleCalls > 0)
-
-                # Calc the % present
-                if present / len( alleleCalls ) < self._minPres: continue
-
-                alleleCalls.flags.writeable = False
-
-                self.AddEntry( key, alleleCalls )
+            self.AddEntry( key, profiles[i] )
 
         print('Total isolates: {}'.format( len( self._entries ) ) )
     
     def LoadViews(self):
-        self._views = {}
+        self._views = ReadViews( self._viewsPath )
+
+def ReadViews(viewsPath):
+    with open( viewsPath, 'r') as f:
+        data = json.load(f)
+
+    return { view: tuple( data[ view ] ) for view in data }
 
-        with open( self._viewsPath, 'r') as f:
-            data = json.load(f)
+def ActiveLoci(store, scheme, views):
+    """
+    The columns of the matrix, every locus of the export for the whole
+    scheme else the ones of the view
+    """
+    if scheme == 'whole':
+        return store.Loci()
 
-        for view in data:
-            self._views[ view ] = tuple( data[ view ] )
+    if not views.get( scheme ):
+        raise ValueError('Invalid View Mode')
+
+    return [ locus.lower() for locus in views[ scheme ] ]
 
 class DbaseEntry(object):
 
+    __slots__ = ( '_key', '_alleleCalls', '_distances' )
+
     def __init__(self, key, alleleCalls):
 
         self._key = key
         self._alleleCalls = alleleCalls
-        self._distances = {}
+        self._distances = None
 
     def AddDistance(self, other, dist):
+        if self._distances is None:
+            self._distances = {}
+
         self._distances[ other ] = dist
 
     def GetDistances(self):
-        return self._distances
+        return self._distances or {}
 
     def Key(self):
         return self._key
@@ -154,54 +135,188 @@ def Main(args):
 
     # This is where we will put the distance matrix
     DIR_PATH = os.path.join( args['outdir'], 'dist_data' )
-    FILE_PATH = os.path.join(DIR_PATH, \
-        'distance_matrix_{}_qcd.json').format( args['scheme'] )
+
+    if not os.path.isdir( DIR_PATH ):
+        os.mkdir( DIR_PATH )
+
+    # The cached files are keyed on everything they're computed from,
+    # so a new export, view or QC setting never loads a stale one and
+    # an unchanged one is picked up again without asking. The store
+    # already hashed the export, it's only read again when it changed
+    store = ProfileStore.Open( args['fields_path'], 'lmo', cores = args.get( 'cores' ) or 1 )
+    settingsKey = SettingsKey( ActiveLoci( store, args['scheme'],
+        ReadViews( args['views_path'] ) ), args['minPres'] )
+    dataKey = DataKey( store )
+
+    FILE_PATH = ArtifactPath( DIR_PATH, 'distance_matrix_{}'.format( args['scheme'].lower() ),
+        settingsKey, dataKey, '.npy' )
+
+    # With a radius only the neighbors within it are kept, no matrix
+    NEIGHBORS_PATH = ArtifactPath( DIR_PATH, 'neighbors_{}'.format( args['scheme'].lower() ),
+        settingsKey, dataKey, '.npz' )
+
+    # From before the cache was keyed, only ever extended with --du
+    LEGACY_PATH = os.path.join(DIR_PATH, \
+        'distance_matrix_{}_qcd.npy').format( args['scheme'] )
+    JSON_PATH = os.path.splitext( LEGACY_PATH )[0] + '.json'
     
     if args['recalculate']:
-        if os.path.isfile( FILE_PATH ):
-            print( 'Deleting old matrix' )
-            os.remove( FILE_PATH )
-
-    # If the matrix exists for the passed scheme, let's load it
-    if os.path.isfile( FILE_PATH ):
+        for path in ( FILE_PATH, NEIGHBORS_PATH, LEGACY_PATH, JSON_PATH ):
+            if os.path.isfile( path ):
+                print( 'Deleting old matrix' )
+                RemoveArtifact( path )
+
+    distances = BuildDistances( args, DIR_PATH, settingsKey, FILE_PATH,
+        NEIGHBORS_PATH, LEGACY_PATH, JSON_PATH )
+
+    # Make room once the new files are written, least recently used
+    # goes first. Only the keyed files are ever evicted, the matrix
+    # from before the cache was keyed stays around for --du
+    for path in Evict( DIR_PATH, args.get( 'cachesize' ) or MAX_CACHE_BYTES,
+        keep = ( FILE_PATH, NEIGHBORS_PATH, LEGACY_PATH, JSON_PATH ) ):
+        print( 'Evicted {}'.format( path ) )
+
+    return distances
+
+def BuildDistances(args, DIR_PATH, settingsKey, FILE_PATH, NEIGHBORS_PATH,
+    LEGACY_PATH, JSON_PATH):
+    """
+    The matrix, or the neighbor lists with a radius, out of the cache
+    when it has them for these inputs, else extended or computed and
+    written to it
+    """
+    radius = args.get( 'radius' )
+
+    # Same inputs, same matrix, so it's used as is
+    if radius is None and os.path.isfile( FILE_PATH ):
         print( 'Loading distance matrix...' )
-        with open( FILE_PATH, 'r') as f:
-            distance_data = json.load(f)
+        Touch( FILE_PATH )
 
         # ET Phone Home
-        return distance_data
+        return CondensedMatrix.Load( FILE_PATH )
 
-    elif not os.path.isdir( DIR_PATH ):
-        os.mkdir( DIR_PATH )
+    # Neighbor lists do for any radius up to the one they were built with
+    if radius is not None and os.path.isfile( NEIGHBORS_PATH ):
+        print( 'Loading neighbor lists...' )
+        neighbors = NeighborList.Load( NEIGHBORS_PATH )
+
+        if neighbors.Radius() >= radius:
+            Touch( NEIGHBORS_PATH )
+            return neighbors
+
+    # To catch up with a new export, start from the last matrix with
+    # the same settings, or the one from before the cache was keyed
+    matrix = None
+
+    if radius is None and args.get( 'update' ):
+        base = LatestArtifact( DIR_PATH, 'distance_matrix_{}'.format( args['scheme'].lower() ),
+            settingsKey, '.npy' )
+
+        # Convert a json matrix once, it's streamed a row at a time
+        # so it can be bigger than memory
+        if base is None and not os.path.isfile( LEGACY_PATH ) and \
+            os.path.isfile( JSON_PATH ):
+
+            with tqdm( desc = 'Converting json distance matrix' ) as progress:
+                ConvertJsonMatrix( JSON_PATH, LEGACY_PATH, progress = progress.update )
+
+        if base is None and os.path.isfile( LEGACY_PATH ):
+            base = LEGACY_PATH
+
+        if base is not None:
+            print( 'Loading distance matrix to extend: {}'.format( base ) )
+            matrix = CondensedMatrix.Load( base )
+
+    # Same for neighbor lists, as long as they go out far enough
+    previous = None
+
+    if radius is not None and args.get( 'update' ):
+        base = LatestArtifact( DIR_PATH, 'neighbors_{}'.format( args['scheme'].lower() ),
+            settingsKey, '.npz' )
+
+        if base is not None:
+            print( 'Loading neighbor lists to extend: {}'.format( base ) )
+            previous = NeighborList.Load( base )
+
+            if previous.Radius() < radius:
+                previous = None
 
     # Initialize the database
     dbase = Database(
         args['fields_path'],
         args['minPres'],
         args['scheme'],
-        args['views_path']
+        args['views_path'],
+        cores = args.get( 'cores' ) or 1
         )
 
-    # Calculate the matrix
-    for entry, other in tqdm( itertools.combinations( 
-        dbase.GetEntries().values(), 2), desc = 'Creating Matrix' ):
+    entries = list( dbase.GetEntries().values() )
+    keys = [ entry.Key() for entry in entries ]
+    profiles = np.asarray( [ entry.Calls() for entry in entries ] )
+    nPairs = len( keys ) * ( len( keys ) - 1 ) // 2
+
+    # With more than one core the tiles are split across a process pool
+    cores = args.get( 'cores' ) or 1
+    tilesize = args.get( 'tilesize', TILE_SIZE )
+
+    # Every pair still gets computed, but only the close ones are kept.
+    # The profiles go along for anything past the radius
+    if radius is not None and previous is not None:
+        nNew = sum( key not in previous for key in keys )
+
+        nPairs = nNew * ( len( keys ) - nNew ) + nNew * ( nNew - 1 ) // 2
+
+        with tqdm( total = nPairs, desc = 'Extending Neighbors' ) as progress:
+            neighbors, added, removed = UpdateNeighborList( previous, keys, profiles,
+                radius, tilesize = tilesize, cores = cores, progress = progress.update )
+
+        print( 'Added {} isolates, removed {}'.format( len( added ), len( removed ) ) )
+
+        neighbors.Save( NEIGHBORS_PATH )
+
+        return neighbors
+
+    if radius is not None:
+        with tqdm( total = nPairs, desc = 'Finding Neighbors' ) as progress:
+            neighbors = GetNeighborList( keys, profiles, radius,
+                tilesize = tilesize, cores = cores, progress = progress.update )
+
+        neighbors.Save( NEIGHBORS_PATH )
+
+        return neighbors
+
+    # Only the pairs with a new isolate need computing, the ones
+    # that are gone or failed QC are just dropped
+    if matrix is not None:
+        nNew = sum( key not in matrix for key in keys )
+
+        nPairs = nNew * ( len( keys ) - nNew ) + nNew * ( nNew - 1 ) // 2
+
+        with tqdm( total = nPairs, desc = 'Extending Matrix' ) as progress:
+            matrix, added, removed = UpdateCondensedMatrix( matrix, keys, profiles,
+                FILE_PATH, tilesize = tilesize, cores = cores,
+                progress = progress.update )
+
+        print( 'Added {} isolates, removed {}'.format( len( added ), len( removed ) ) )
 
-        dist = GetDistance( entry.Calls(), other.Calls() )
-        entry.AddDistance( other.Key(), dist )
-        other.AddDistance( entry.Key(), dist )
+        return matrix
 
-    # Here we will store the matrix -> { Key: {Other Keys: %Similiarity} }...
-    distance_data = {}
+    # Calculate the matrix a tile at a time, straight into the cache
+    # file. Written next to it first so a run that dies halfway
+    # doesn't leave a broken cache behind
+    tmpPath = FILE_PATH + '.tmp'
+    condensed = np.lib.format.open_memmap( tmpPath, mode='w+',
+        dtype=CACHE_DTYPE, shape=( nPairs, ) )
 
-    # Build the matrix for shipment
-    for entry in tqdm( dbase.GetEntries().values(), desc='Organizing matrix' ):
-        distance_data[ entry.Key() ] = entry.GetDistances()
+    with tqdm( total = nPairs, desc = 'Creating Matrix' ) as progress:
+        GetCondensedMatrix( profiles, tilesize = tilesize, cores = cores,
+            progress = progress.update, out = condensed, path = tmpPath )
 
-    # Save the matrix for future use
-    print( 'Dumping matrix...this might take a while' )
-    with open( FILE_PATH, 'w' ) as f:
+    condensed.flush()
+    del condensed
 
-        json.dump(distance_data, f)
+    os.replace( tmpPath, FILE_PATH )
+    CondensedMatrix.SaveKeys( FILE_PATH, keys )
 
     # I'm coming home
-    return distance_data
\ No newline at end of file
+    return CondensedMatrix.Load( FILE_PATH )
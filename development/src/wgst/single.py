@@ -19,20 +19,11 @@ import random
 import numpy as np
 
 from wgst.database import Database
+from wgst.distance import GetDistances, ProfileStack
+from wgst.neighbors import GetNeighborList
 from .tree import *
 from tqdm import *
 
-# ======================== DISTANCE FUNCTION ================================#
-def GetDistance(p1, p2):
-    
-    common = np.multiply(p1>0, p2>0)
-    nCommon = np.sum(common)
-    nSame = np.sum(p1[common]==p2[common])
-    if nCommon:
-        return 100.0 * (float(nCommon) - float(nSame)) / float(nCommon) #nCommon-nSame
-    else:
-        return 100.0
-
 # =========================== DATABASE OBJECT ===============================#
 class Database(Database):
 
@@ -237,6 +228,7 @@ class Calculator(object):
         self._scheme = args['scheme']
         self._minPres = args['minPres']
         self._outdir = args['outdir']
+        self._radius = args.get( 'radius' )
 
         self._entryBase = Database( 
             self._organism,
@@ -244,7 +236,8 @@ class Calculator(object):
             args['fields_path'],
             self._outdir,
             locisize=args['locisize'],
-            schemespath=args['views_path']
+            schemespath=args['views_path'],
+            binaryout=args.get( 'binaryout', False )
         )
 
         self._entryBase.LoadCalls()
@@ -263,7 +256,31 @@ class Calculator(object):
             os.mkdir(self._dumpdir)
 
 
+        # The tree and everything else in here go by isolate id, the
+        # keys only come back out through the entries
+        registry = self._entryBase.Registry()
         namedEntries = []
+        self._named = registry.Mask()
+
+        # By id, the starting set holds entries and not keys
+        self._seed = registry.Mask( [ entry._id for entry in self._startingSet ] )
+
+        # Allele calls of the named entries, row i belongs to namedEntries[i]
+        self._namedProfiles = ProfileStack()
+
+        # With a radius every close pair is found up front, a tile at
+        # a time, and naming only looks them up by row. Entries that
+        # failed QC aren't in there, so ids are mapped to rows.
+        self._neighbors = None
+        self._namedIds = []
+
+        if self._radius is not None:
+            entries = self._startingSet + [ entry for chunk in addingSet for entry in chunk ]
+            self._neighbors = GetNeighborList( [ entry._key for entry in entries ],
+                np.asarray( [ entry._allelecalls for entry in entries ] ), self._radius )
+
+            self._neighborRows = np.full( len( registry ), -1, dtype=np.int64 )
+            self._neighborRows[ [ entry._id for entry in entries ] ] = np.arange( len( entries ) )
 
         self.DoCalc( self._startingSet, self._tree, namedEntries, 'Initializing' )
 
@@ -295,35 +312,48 @@ class Calculator(object):
             if not qcStatus:
                 continue
                 
-            if entry._key in namedEntries:
+            if self._named[ entry._id ]:
                 continue
                 
             # calculate the distance between the unnamed sample and all the named samples
-            dists = [ GetDistance( 
-                entry._allelecalls, 
-                self._entryBase.GetEntry( e )._allelecalls ) for e in namedEntries ]
+            # only the ones within the biggest threshold matter for naming
+            if self._neighbors is not None:
+                dists = self._neighbors.IdDistances( self._neighborRows[ entry._id ],
+                    self._namedIds, bound = self._thresholds[0] ).tolist()
+
+            else:
+                dists = GetDistances( entry._allelecalls,
+                    self._namedProfiles.Array(),
+                    self._namedProfiles.Presence(),
+                    bound = self._thresholds[0] ).tolist()
             
             # calculate the name of the entry
-            CalcName( namedEntries, tree, entry._key, dists, self._thresholds )
+            CalcName( namedEntries, tree, entry._id, dists, self._thresholds )
             
             #keep track of the data
-            if tree.HasName( entry._key ) and entry._key not in namedEntries:
-                namedEntries.append( entry._key )
-                name = '.'.join(map(str, tree.GetPart(entry._key, -1)))
+            if tree.HasName( entry._id ) and not self._named[ entry._id ]:
+                namedEntries.append( entry._id )
+                self._named[ entry._id ] = True
+
+                if self._neighbors is not None:
+                    self._namedIds.append( self._neighborRows[ entry._id ] )
+                else:
+                    self._namedProfiles.Append( entry._allelecalls )
+                name = '.'.join(map(str, tree.GetPart(entry._id, -1)))
                 nameFrequencies[ name ] = nameFrequencies.get( name, 0 ) + 1
                 # nameFrequencies[ tree.GetStrName( entry._key ) ] = nameFrequencies.get( tree.GetStrName( entry._key ), 0) + 1
 
 
         if iteration == 0:
             for entry in namedEntries:
-                self._entryBase.GetEntry( entry )._wgst = tree.GetStrName( entry  )
-                self._entryBase.GetEntry( entry )._wgstHistory.append( tree.GetStrName( entry ) )
+                self._entryBase.GetEntryById( entry )._wgst = tree.GetStrName( entry  )
+                self._entryBase.GetEntryById( entry )._wgstHistory.append( tree.GetStrName( entry ) )
 
         for entry in namedEntries:
-            dbEntry = self._entryBase.GetEntry( entry  )
+            dbEntry = self._entryBase.GetEntryById( entry  )
 
             oldName = dbEntry._wgst
-            newName = tree.GetStrName( dbEntry._key )
+            newName = tree.GetStrName( entry )
 
             if oldName:
                 partial_name = '.'.join( oldName.split('.')[:-1] )
@@ -333,7 +363,7 @@ class Calculator(object):
                 
             if iteration > 0 and oldName and nameFrequencies[partial_name] > 1:
                 ob = bool( dbEntry._outbreak )
-                self._wgstHistory.TrackChanges( oldName, newName, iteration, ob = ob, seed = entry in self._startingSet )
+                self._wgstHistory.TrackChanges( oldName, newName, iteration, ob = ob, seed = bool( self._seed[ entry ] ) )
 
             dbEntry._wgst = newName
             dbEntry._wgstHistory.append( newName )
@@ -23,6 +23,7 @@ import random
 import numpy as np
 
 from wgst.database import Database
+from wgst.distance import GetDistances, ProfileStack
 from wgst.distance_matrix import DistMatrix
 
 from .tree import *
@@ -30,17 +31,6 @@ from .cost import *
 
 from tqdm import *
 
-# ======================== DISTANCE FUNCTION ================================#
-def GetDistance(p1, p2):
-    
-    common = np.multiply(p1>0, p2>0)
-    nCommon = np.sum(common)
-    nSame = np.sum(p1[common]==p2[common])
-    if nCommon:
-        return 100.0 * (float(nCommon) - float(nSame)) / float(nCommon) #nCommon-nSame
-    else:
-        return 100.0
-
 # =========================== DATABASE OBJECT ===============================#
 class Database(Database):
 
@@ -348,7 +338,8 @@ class Calculator(object):
             args['fields_path'],
             self._outdir,
             locisize=args['locisize'],
-            schemespath=args['views_path']
+            schemespath=args['views_path'],
+            binaryout=args.get( 'binaryout', False )
         )
 
         self._entryBase.LoadCalls()
@@ -362,7 +353,17 @@ class Calculator(object):
         # Create starting and adding sets return the updated Names object to track history
         self._startingSet, addingSet = self._entryBase.CreateSubset()
 
+        # The tree, the distance matrix and everything else in here go
+        # by isolate id, the keys only come back out through the entries
+        registry = self._entryBase.Registry()
         namedEntries = []
+        self._named = registry.Mask()
+
+        # By id, the starting set holds entries and not keys
+        self._seed = registry.Mask( [ entry._id for entry in self._startingSet ] )
+
+        # Allele calls of the named entries, row i belongs to namedEntries[i]
+        self._namedProfiles = ProfileStack()
 
         self.DoCalc( self._startingSet, self._tree, namedEntries, 'Initializing' )
 
@@ -392,54 +393,49 @@ class Calculator(object):
             if not qcStatus:
                 continue
                 
-            if entry._key in namedEntries:
+            if self._named[ entry._id ]:
                 continue
             
-            # This is for the naming logic
-            dists = []
-
-            # Add the information for the distance_matrix
-            dm_list = []
-            
             #calculate the distance between the unnamed sample and all the named samples
-            for i in range(len(namedEntries)):
-                dist = GetDistance( entry._allelecalls,
-                    self._entryBase.GetEntry(namedEntries[i])._allelecalls )
+            dm_list = GetDistances( entry._allelecalls,
+                self._namedProfiles.Array(),
+                self._namedProfiles.Presence() ).tolist()
 
-                if dist <= self._thresholds[0]:
-                    dists.append((dist, i))
-
-                dm_list.append(dist)
+            # This is for the naming logic
+            dists = [ (dist, i) for i, dist in enumerate( dm_list ) \
+                if dist <= self._thresholds[0] ]
 
-            self._distancematrix.add(entry._key, dm_list)
+            self._distancematrix.add(entry._id, dm_list)
             
             #calculate the name of the entry
-            CalcName( namedEntries, tree, entry._key, dists, self._thresholds,
+            CalcName( namedEntries, tree, entry._id, dists, self._thresholds,
                 self._distancematrix)
             
             #keep track of the data
-            if tree.HasName( entry._key ) and entry._key not in namedEntries:
-                namedEntries.append( entry._key )
-                nameFrequencies[ tree.GetStrName( entry._key ) ] = nameFrequencies.get( tree.GetStrName( entry._key ), 0) + 1
+            if tree.HasName( entry._id ) and not self._named[ entry._id ]:
+                namedEntries.append( entry._id )
+                self._named[ entry._id ] = True
+                self._namedProfiles.Append( entry._allelecalls )
+                nameFrequencies[ tree.GetStrName( entry._id ) ] = nameFrequencies.get( tree.GetStrName( entry._id ), 0) + 1
 
 
         if iteration == 0:
             for entry in namedEntries:
-                self._entryBase.GetEntry( entry )._wgst = tree.GetStrName( entry  )
+                self._entryBase.GetEntryById( entry )._wgst = tree.GetStrName( entry  )
 
         for entry in namedEntries:
-            dbEntry = self._entryBase.GetEntry( entry  )
+            dbEntry = self._entryBase.GetEntryById( entry  )
 
             oldName = dbEntry._wgst
 
-            newName = tree.GetStrName( dbEntry._key )
+            newName = tree.GetStrName( entry )
 
             if oldName == newName:
                 continue
                 
             if iteration > 0 and oldName and nameFrequencies[oldName] > 1:
                 ob = bool( dbEntry._outbreak )
-                self._wgstHistory.TrackChanges( oldName, newName, iteration, ob = ob, seed = entry in self._startingSet )
+                self._wgstHistory.TrackChanges( oldName, newName, iteration, ob = ob, seed = bool( self._seed[ entry ] ) )
 
             dbEntry._wgst = newName
             dbEntry._wgstHistory.append( newName )
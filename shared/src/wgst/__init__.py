@@ -0,0 +1,7 @@
+"""
+
+Modules shared by the stable and development wgst packages, which add
+this directory to their package path. Importable on its own as wgst
+for the tests
+
+"""
@@ -0,0 +1,159 @@
+###########################################################
+# Content addressed cache for distance matrices
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import re
+import json
+import hashlib
+from collections import defaultdict
+
+__all__ = [ 'SettingsKey', 'DataKey', 'ArtifactPath', 'LatestArtifact',
+    'RemoveArtifact', 'Touch', 'Evict', 'MAX_CACHE_BYTES' ]
+
+# Bump this when the layout of the cached files changes, every
+# artifact from before gets a different key
+CACHE_VERSION = 1
+
+# Default bound on a cache directory
+MAX_CACHE_BYTES = 50 * 2**30
+
+# Stem of a file named by ArtifactPath, anything else in the directory
+# isn't the cache's to remove
+ARTIFACT_STEM = re.compile( r'_[0-9a-f]{12}_[0-9a-f]{16}$' )
+
+#=============================== KEYS =====================================#
+def SettingsKey(loci, minPres):
+    """
+    Hash of everything besides the allele calls that decides what ends
+    up in a matrix: the loci compared and the QC setting. Every entry
+    point keys its matrices with this, whichever way it picks the loci,
+    so they pick up each other's.
+
+    :param loci: the columns of the matrix, case and order don't matter
+    """
+    digest = hashlib.sha256()
+    digest.update( json.dumps( [ CACHE_VERSION, sorted( set( locus.lower()
+        for locus in loci ) ), float( minPres ) ] ).encode() )
+
+    return digest.hexdigest()
+
+def DataKey(*stores):
+    """
+    Hash of the contents of the allele call exports the profile stores
+    came from. A store hashes its export once when it's imported, so
+    a cache hit doesn't read the export again. The paths don't matter
+    so the key is the same on every machine.
+    """
+    digest = hashlib.sha256()
+
+    for store in stores:
+        digest.update( store.Digest().encode() + b'\0' )
+
+    return digest.hexdigest()
+
+#============================= ARTIFACTS ==================================#
+def ArtifactPath(directory, name, settingsKey, dataKey, ext):
+    return os.path.join( directory, '{}_{}_{}{}'.format( name, settingsKey[:12],
+        dataKey[:16], ext ) )
+
+def _Stem(path):
+    """
+    The path every file of an artifact starts with, e.g. the .npy
+    and the _keys.json of a matrix
+    """
+    stem = os.path.splitext( path )[0]
+
+    if stem.endswith( '_keys' ):
+        stem = stem[ :-len( '_keys' ) ]
+
+    return stem
+
+def _Files(directory):
+    """
+    :return: { stem: [ paths ] } for every artifact in directory. Files
+        that are still being written are left out.
+    """
+    groups = defaultdict( list )
+
+    for name in os.listdir( directory ):
+        path = os.path.join( directory, name )
+
+        if name.endswith( '.tmp' ) or not os.path.isfile( path ):
+            continue
+
+        groups[ _Stem( path ) ].append( path )
+
+    return groups
+
+def LatestArtifact(directory, name, settingsKey, ext):
+    """
+    Most recently used artifact with the same settings, whatever data
+    it was computed from
+    """
+    if not os.path.isdir( directory ):
+        return None
+
+    prefix = os.path.join( directory, '{}_{}_'.format( name, settingsKey[:12] ) )
+    paths = [ path for paths in _Files( directory ).values() for path in paths
+        if path.startswith( prefix ) and path.endswith( ext ) ]
+
+    return max( paths, key=os.path.getmtime ) if paths else None
+
+def RemoveArtifact(path):
+    stem = _Stem( path )
+
+    for other in _Files( os.path.dirname( path ) ).get( stem, [] ):
+        os.remove( other )
+
+def Touch(path):
+    """
+    Marks an artifact as used, for Evict
+    """
+    os.utime( path, None )
+
+def Evict(directory, maxBytes=MAX_CACHE_BYTES, keep=()):
+    """
+    Removes the least recently used artifacts until directory fits in
+    maxBytes. Artifacts in keep are never removed, so they can go over.
+    Only files named by ArtifactPath are counted or removed, others
+    like the matrices from before the cache was keyed are left alone.
+
+    :return: list of the removed paths
+    """
+    if not os.path.isdir( directory ):
+        return []
+
+    keep = set( _Stem( path ) for path in keep )
+    usage = []
+    total = 0
+
+    for stem, paths in _Files( directory ).items():
+        if not ARTIFACT_STEM.search( stem ):
+            continue
+
+        size = sum( os.path.getsize( path ) for path in paths )
+        total += size
+
+        usage.append( ( max( os.path.getmtime( path ) for path in paths ), stem,
+            size, paths ) )
+
+    removed = []
+
+    for _, stem, size, paths in sorted( usage ):
+        if total <= maxBytes:
+            break
+
+        if stem in keep:
+            continue
+
+        for path in paths:
+            os.remove( path )
+            removed.append( path )
+
+        total -= size
+
+    return removed
@@ -0,0 +1,181 @@
+###########################################################
+# Per locus allele codebook
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import json
+import numpy as np
+
+__all__ = [ 'AlleleCodebook', 'CODE_DTYPE' ]
+
+# Every locus has at most a few thousand alleles, so the codes
+# fit in 16 bits. 0 is kept for a missing call
+CODE_DTYPE = np.uint16
+
+#========================= ALLELE CODEBOOK ================================#
+class AlleleCodebook(object):
+    """
+    Remaps the allele ids of every locus to small integers, 1, 2, 3...
+    in the order they were first seen. Two calls at the same locus get
+    the same code only if they are the same allele, so the distances
+    on codes are the same as the distances on allele ids.
+
+    New alleles are appended to the end of their locus, so codes that
+    were handed out never change and the codebook can be saved and
+    extended on the next run.
+    """
+
+    def __init__(self, loci):
+        self._loci = list( loci )
+
+        # code - 1 -> allele id, and back
+        self._alleles = [ [] for _ in self._loci ]
+        self._codes = [ {} for _ in self._loci ]
+
+    @classmethod
+    def Load(cls, path, loci):
+        """
+        Codebook for the given loci, in the given order. Loci saved
+        at path keep their codes, anything else starts out empty.
+        """
+        codebook = cls( loci )
+
+        if not os.path.exists( path ):
+            return codebook
+
+        with open( path, 'r' ) as f:
+            data = json.load( f )
+
+        saved = dict( zip( data['loci'], data['alleles'] ) )
+
+        for i, locus in enumerate( codebook._loci ):
+            for allele in saved.get( locus, [] ):
+                codebook._Add( i, allele )
+
+        return codebook
+
+    def Project(self, loci):
+        """
+        Codebook for a subset of the loci with the same codes, for
+        calls that were projected onto another view
+        """
+        index = { locus: i for i, locus in enumerate( self._loci ) }
+        codebook = AlleleCodebook( loci )
+
+        for i, locus in enumerate( codebook._loci ):
+            codebook._alleles[i] = list( self._alleles[ index[ locus ] ] )
+            codebook._codes[i] = dict( self._codes[ index[ locus ] ] )
+
+        return codebook
+
+    def Save(self, path):
+        with open( path, 'w' ) as f:
+            json.dump( { 'loci': self._loci, 'alleles': self._alleles }, f )
+
+    def Encode(self, calls):
+        """
+        Allele ids for one isolate to codes, 0 stays 0
+
+        :param calls: allele ids in the same order as the loci
+        :return: array of CODE_DTYPE
+        """
+        codes = []
+
+        for i, allele in enumerate( np.asarray( calls ).tolist() ):
+
+            if allele <= 0:
+                codes.append( 0 )
+                continue
+
+            code = self._codes[i].get( allele )
+
+            if code is None:
+                code = self._Add( i, allele )
+
+            codes.append( code )
+
+        return np.asarray( codes, dtype=CODE_DTYPE )
+
+    def EncodeArray(self, profiles):
+        """
+        Encode for a whole (N x loci) array at once, a locus at a time.
+        Only the distinct alleles of each locus are looked up.
+        """
+        profiles = np.asarray( profiles )
+        codes = np.zeros( profiles.shape, dtype=CODE_DTYPE )
+
+        for i in range( profiles.shape[1] ):
+            alleles, inverse = np.unique( profiles[:, i], return_inverse=True )
+
+            lookup = np.zeros( len( alleles ), dtype=CODE_DTYPE )
+            for j, allele in enumerate( alleles.tolist() ):
+                if allele > 0:
+                    lookup[j] = self._codes[i].get( allele ) or self._Add( i, allele )
+
+            codes[:, i] = lookup[ inverse.ravel() ]
+
+        return codes
+
+    def Translate(self, other):
+        """
+        Lookup tables from the codes of other, a codebook with at least
+        the same loci, to the codes here. Alleles that aren't here yet
+        are added.
+
+        :return: list with one int array per locus here,
+            table[ code in other ] -> code here, 0 stays 0
+        """
+        index = { locus: i for i, locus in enumerate( other._loci ) }
+        tables = []
+
+        for i, locus in enumerate( self._loci ):
+            alleles = other._alleles[ index[ locus ] ]
+            table = np.zeros( len( alleles ) + 1, dtype=CODE_DTYPE )
+
+            for j, allele in enumerate( alleles, 1 ):
+                table[j] = self._codes[i].get( allele ) or self._Add( i, allele )
+
+            tables.append( table )
+
+        return tables
+
+    def Decode(self, codes):
+        """
+        Codes back to the allele ids, 0 stays 0
+        """
+        return np.asarray( [ self._alleles[i][ code-1 ] if code else 0
+            for i, code in enumerate( np.asarray( codes ).tolist() ) ],
+            dtype=int )
+
+    def DecodeArray(self, codes):
+        """
+        Decode for a whole N x loci array of codes at once, every
+        locus gets a stretch of one flat table and the codes index it
+        """
+        tables = [ [ 0 ] + alleles for alleles in self._alleles ]
+        offsets = np.cumsum( [ 0 ] + [ len( table ) for table in tables[:-1] ] )
+        flat = np.concatenate( tables ).astype( int ) if tables else np.zeros( 0, dtype=int )
+
+        return flat[ np.asarray( codes ) + offsets ]
+
+    def Loci(self):
+        return self._loci
+
+    def _Add(self, i, allele):
+        allele = int( allele )
+        code = len( self._alleles[i] ) + 1
+
+        if code > np.iinfo( CODE_DTYPE ).max:
+            raise ValueError( 'Too many alleles for locus: {}'.format(
+                self._loci[i] ) )
+
+        self._alleles[i].append( allele )
+        self._codes[i][ allele ] = code
+
+        return code
+
+    def __len__(self):
+        return len( self._loci )
@@ -0,0 +1,494 @@
+###########################################################
+# Allelic distance functions, everything that compares
+# allele calls should come through here
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import numpy as np
+
+__all__ = [ 'GetDistance', 'GetDistances', 'GetBoundedDistances', 'GetDistanceTiles',
+    'GetDistanceMatrix', 'GetDistanceData', 'UpdateDistanceData', 'GetCrossDistances',
+    'GetHamming', 'GetHammings', 'PercentDistance', 'PackPresence', 'PopCount',
+    'ProfileStack', 'BEYOND_BOUND' ]
+
+# How many profiles we compare against at once, keeps the
+# temporary boolean masks at a few megabytes
+BLOCK_SIZE = 4096
+
+# Rows/columns per tile for the all-pairs builders. A tile needs
+# TILE_SIZE * TILE_SIZE * loci bytes of scratch space, ~29MB for the
+# 1748 core loci
+TILE_SIZE = 128
+
+# Loci scanned between checks in the bounded distances. Far away pairs
+# are usually out after the first two blocks
+LOCI_BLOCK = 128
+
+# Returned by the bounded distances for pairs that are known to be
+# further apart than the bound. Fails every <= threshold comparison
+BEYOND_BOUND = float( 'inf' )
+
+# Set bits in every possible byte, used to count shared loci when
+# numpy doesn't have bitwise_count
+_BYTE_POPCOUNT = np.array( [ bin(i).count('1') for i in range(256) ],
+    dtype=np.uint8 )
+
+#======================== DISTANCE FUNCTION ===============================#
+def GetDistance(p1, p2):
+    # Find the loci that are present in both samples
+    common = np.multiply(p1>0, p2>0)
+
+    # Count the total number of loci that are present for both
+    nCommon = np.sum(common)
+
+    # For where they both have a presence, see where they are the same
+    nSame = np.sum(p1[common]==p2[common])
+
+    # If they have anything in common, find out how much
+    if nCommon:
+      return 100.0 * (float(nCommon) - float(nSame)) / float(nCommon)
+
+    # This shouldn't happen too often
+    else:
+      return 100.0
+
+def GetHamming(p1, p2):
+    """
+    Number of loci where the calls differ. Unlike GetDistance a
+    missing call is treated like any other allele.
+    """
+    return int( np.sum( np.asarray( p1 ) != np.asarray( p2 ) ) )
+
+#===================== ONE VS ALL DISTANCE FUNCTION =======================#
+def GetDistances(p, profiles, presence=None, blocksize=BLOCK_SIZE, bound=None):
+    """
+    Same as GetDistance, but for one profile against every row
+    of an (N x loci) array of profiles.
+
+    :param p: allele calls for the query isolate
+    :param profiles: 2D array, one row of allele calls per isolate
+    :param presence: optional PackPresence( profiles ), when given the
+        shared loci are counted from the bitsets
+    :param blocksize: number of rows to compare at once
+    :param bound: optional largest distance of interest, see
+        GetBoundedDistances
+    :return: array of N distances, in the same order as the rows
+    """
+    if bound is not None:
+        return GetBoundedDistances( p, profiles, bound, presence, blocksize )
+
+    p = np.asarray( p )
+    nProfiles = len( profiles )
+    dists = np.empty( nProfiles, dtype=float )
+
+    if not nProfiles:
+        return dists
+
+    present = p > 0
+
+    if presence is not None:
+        pBits = PackPresence( p )[0]
+
+    for start in range( 0, nProfiles, blocksize ):
+        block = profiles[ start:start+blocksize ]
+
+        # Loci present in both
+        if presence is None:
+            nCommon = np.sum( np.logical_and( block > 0, present ), axis=1 )
+        else:
+            nCommon = PopCount( presence[ start:start+blocksize ] & pBits )
+
+        # Equal to a called query allele means it is called in both
+        nSame = np.sum( np.logical_and( block == p, present ), axis=1 )
+
+        dists[ start:start+blocksize ] = PercentDistance( nCommon, nSame )
+
+    return dists
+
+def GetBoundedDistances(p, profiles, bound, presence=None,
+    blocksize=BLOCK_SIZE, lociblock=LOCI_BLOCK):
+    """
+    GetDistances for when only the distances up to some bound matter,
+    like the largest naming threshold.
+
+    The shared loci are counted up front, which fixes the number of
+    mismatches a pair can have and still be within the bound. The loci
+    are then scanned a block at a time and a pair is dropped as soon as
+    it has more mismatches than that, the rest of its loci are never
+    looked at.
+
+    :param bound: largest distance of interest
+    :param lociblock: loci to scan between checks
+    :return: array of N distances, exact for the pairs within the bound
+        and BEYOND_BOUND for the others
+    """
+    p = np.asarray( p )
+    nProfiles = len( profiles )
+    dists = np.full( nProfiles, BEYOND_BOUND )
+
+    if not nProfiles:
+        return dists
+
+    present = p > 0
+    pBits = PackPresence( p )[0]
+
+    for start in range( 0, nProfiles, blocksize ):
+        block = profiles[ start:start+blocksize ]
+
+        if presence is None:
+            nCommon = PopCount( PackPresence( block ) & pBits )
+        else:
+            nCommon = PopCount( presence[ start:start+blocksize ] & pBits )
+
+        # Nothing in common is 100 no matter what
+        if 100.0 <= bound:
+            dists[ start + np.flatnonzero( nCommon == 0 ) ] = 100.0
+
+        nMismatch = np.zeros( len( block ), dtype=int )
+        alive = np.flatnonzero( nCommon > 0 )
+
+        for lociStart in range( 0, len( p ), lociblock ):
+            if not len( alive ):
+                break
+
+            loci = slice( lociStart, lociStart+lociblock )
+
+            # No need to gather rows while none have been dropped
+            if len( alive ) == len( block ):
+                calls = block[ :, loci ]
+            else:
+                calls = block[ alive, loci ]
+
+            # Called in both, but not the same
+            differ = calls != p[ loci ]
+            differ &= calls > 0
+            differ &= present[ loci ]
+            nMismatch[ alive ] += np.sum( differ, axis=1 )
+
+            # Mismatches only go up, so past the bound now means past
+            # it for good. Same arithmetic as PercentDistance
+            within = 100.0 * nMismatch[ alive ] / nCommon[ alive ] <= bound
+            alive = alive[ within ]
+
+        dists[ start + alive ] = PercentDistance( nCommon[ alive ],
+            nCommon[ alive ] - nMismatch[ alive ] )
+
+    return dists
+
+def GetHammings(p, profiles, blocksize=BLOCK_SIZE):
+    """
+    GetHamming for one profile against every row of profiles
+    """
+    p = np.asarray( p )
+    hammings = np.empty( len( profiles ), dtype=int )
+
+    for start in range( 0, len( profiles ), blocksize ):
+        hammings[ start:start+blocksize ] = np.sum(
+            profiles[ start:start+blocksize ] != p, axis=1 )
+
+    return hammings
+
+def PercentDistance(nCommon, nSame):
+    """
+    Vectorized tail of GetDistance, turns shared/same locus counts
+    into percent distances. Nothing shared means 100.
+    """
+    dists = np.full( np.shape( nCommon ), 100.0 )
+    shared = nCommon > 0
+
+    nCommon = nCommon[ shared ].astype( float )
+    nSame = nSame[ shared ].astype( float )
+
+    # Same order of operations as GetDistance so the results are identical
+    dists[ shared ] = 100.0 * ( nCommon - nSame ) / nCommon
+
+    return dists
+
+#======================= ALL PAIRS DISTANCE FUNCTIONS =====================#
+def GetTileCounts(rows, cols, rowBits, colBits):
+    """
+    Shared and same locus counts for every pairing of a block of
+    rows with a block of columns.
+
+    :param rowBits: PackPresence( rows )
+    :param colBits: PackPresence( cols )
+    :return: (nCommon, nSame), both len(rows) x len(cols)
+    """
+    nCommon = PopCount( rowBits[ :, np.newaxis, : ] & colBits[ np.newaxis, :, : ] )
+
+    # Equal to a called row allele means it is called in both
+    same = rows[ :, np.newaxis, : ] == cols[ np.newaxis, :, : ]
+    same &= ( rows > 0 )[ :, np.newaxis, : ]
+    nSame = np.sum( same, axis=2 )
+
+    return nCommon, nSame
+
+def GetDistanceTiles(profiles, tilesize=TILE_SIZE, presence=None):
+    """
+    Walks the upper triangle of the all-pairs distance matrix one
+    tile at a time, row block by row block. Only one tile is held
+    in memory at once.
+
+    :param profiles: 2D array, one row of allele calls per isolate
+    :param tilesize: rows and columns per tile
+    :param presence: PackPresence( profiles ), packed here if not given
+    :return: generator of (rowStart, colStart, tile), colStart >= rowStart
+    """
+    nProfiles = len( profiles )
+
+    if presence is None:
+        presence = PackPresence( profiles )
+
+    for rowStart in range( 0, nProfiles, tilesize ):
+        rows = profiles[ rowStart:rowStart+tilesize ]
+        rowBits = presence[ rowStart:rowStart+tilesize ]
+
+        for colStart in range( rowStart, nProfiles, tilesize ):
+            cols = profiles[ colStart:colStart+tilesize ]
+            colBits = presence[ colStart:colStart+tilesize ]
+
+            nCommon, nSame = GetTileCounts( rows, cols, rowBits, colBits )
+
+            yield rowStart, colStart, PercentDistance( nCommon, nSame )
+
+def GetDistanceMatrix(profiles, tilesize=TILE_SIZE):
+    """
+    Full, symmetric N x N distance matrix built from tiles
+    """
+    nProfiles = len( profiles )
+    matrix = np.zeros( ( nProfiles, nProfiles ), dtype=float )
+
+    for rowStart, colStart, tile in GetDistanceTiles( profiles, tilesize ):
+        nRows, nCols = tile.shape
+        matrix[ rowStart:rowStart+nRows, colStart:colStart+nCols ] = tile
+        matrix[ colStart:colStart+nCols, rowStart:rowStart+nRows ] = tile.T
+
+    np.fill_diagonal( matrix, 0. )
+
+    return matrix
+
+def GetCrossDistances(rows, cols, tilesize=TILE_SIZE, hamming=False):
+    """
+    Every row against every column, for two different sets of profiles
+
+    :param rows: 2D array, one row of allele calls per isolate
+    :param cols: 2D array, same loci as rows
+    :param hamming: GetHamming counts instead of percent distances
+    :return: len(rows) x len(cols) array
+    """
+    rows = np.asarray( rows )
+    cols = np.asarray( cols )
+    matrix = np.zeros( ( len( rows ), len( cols ) ), dtype=int if hamming else float )
+
+    if not hamming:
+        rowPresence = PackPresence( rows )
+        colPresence = PackPresence( cols )
+
+    for rowStart in range( 0, len( rows ), tilesize ):
+        rowTile = rows[ rowStart:rowStart+tilesize ]
+
+        for colStart in range( 0, len( cols ), tilesize ):
+            colTile = cols[ colStart:colStart+tilesize ]
+
+            if hamming:
+                tile = np.sum( rowTile[ :, np.newaxis, : ] != colTile[ np.newaxis, :, : ],
+                    axis=2 )
+            else:
+                tile = PercentDistance( *GetTileCounts( rowTile, colTile,
+                    rowPresence[ rowStart:rowStart+tilesize ],
+                    colPresence[ colStart:colStart+tilesize ] ) )
+
+            matrix[ rowStart:rowStart+len( rowTile ),
+                colStart:colStart+len( colTile ) ] = tile
+
+    return matrix
+
+def GetDistanceData(keys, profiles, tilesize=TILE_SIZE, progress=None):
+    """
+    Distance matrix in the cached json layout: { Key: {Other Keys: dist} }.
+    Every inner dict holds the other keys in the order they appear in
+    keys, same as filling it pair by pair from itertools.combinations.
+
+    :param keys: keys in the same order as the rows of profiles
+    :param progress: optional callable, called with the number of pairs
+        finished after every tile
+    """
+    distance_data = { key: {} for key in keys }
+    rowData = [ distance_data[ key ] for key in keys ]
+
+    # Tiles come row block by row block, left to right, so every row
+    # receives its columns in ascending order
+    for rowStart, colStart, tile in GetDistanceTiles( profiles, tilesize ):
+        nRows, nCols = tile.shape
+        rowKeys = keys[ rowStart:rowStart+nRows ]
+        colKeys = keys[ colStart:colStart+nCols ]
+        tile = tile.tolist()
+
+        if rowStart == colStart:
+            for i in range( nRows ):
+                for j in range( i+1, nCols ):
+                    rowData[ rowStart+i ][ colKeys[j] ] = tile[i][j]
+                    rowData[ colStart+j ][ rowKeys[i] ] = tile[i][j]
+
+            pairs = nRows * ( nRows - 1 ) // 2
+
+        else:
+            for i in range( nRows ):
+                rowData[ rowStart+i ].update( zip( colKeys, tile[i] ) )
+
+            for j, column in enumerate( zip( *tile ) ):
+                rowData[ colStart+j ].update( zip( rowKeys, column ) )
+
+            pairs = nRows * nCols
+
+        if progress is not None:
+            progress( pairs )
+
+    return distance_data
+
+def UpdateDistanceData(distance_data, keys, profiles, tilesize=TILE_SIZE,
+    progress=None):
+    """
+    Brings a cached { Key: {Other Keys: dist} } matrix up to date with
+    the current set of isolates, in place. Isolates that are gone are
+    dropped, only the pairs with a new isolate are computed: new vs
+    old, then new vs new.
+
+    :param keys: current keys in the same order as the rows of profiles
+    :param progress: optional callable, called with the number of pairs
+        finished as they are computed
+    :return: (added, removed) keys
+    """
+    current = set( keys )
+    removed = [ key for key in distance_data if key not in current ]
+    old = [ i for i, key in enumerate( keys ) if key in distance_data ]
+    new = [ i for i, key in enumerate( keys ) if key not in distance_data ]
+
+    # Nothing to compute for these, just forget them
+    for key in removed:
+        del distance_data[ key ]
+
+    if removed:
+        gone = set( removed )
+        for row in distance_data.values():
+            for key in gone.intersection( row ):
+                del row[ key ]
+
+    oldKeys = [ keys[i] for i in old ]
+    newKeys = [ keys[i] for i in new ]
+    oldProfiles = profiles[ old ]
+    newProfiles = profiles[ new ]
+
+    # New vs old, a block of new isolates at a time
+    for start in range( 0, len( new ), tilesize ):
+        block = GetCrossDistances( newProfiles[ start:start+tilesize ],
+            oldProfiles, tilesize ).tolist()
+
+        for key, row in zip( newKeys[ start:start+tilesize ], block ):
+            distance_data[ key ] = dict( zip( oldKeys, row ) )
+
+        for j, column in enumerate( zip( *block ) ):
+            distance_data[ oldKeys[j] ].update(
+                zip( newKeys[ start:start+tilesize ], column ) )
+
+        if progress is not None:
+            progress( len( block ) * len( old ) )
+
+    # New vs new, same as building a small matrix from scratch
+    for key, row in GetDistanceData( newKeys, newProfiles, tilesize,
+        progress ).items():
+
+        distance_data[ key ].update( row )
+
+    return newKeys, removed
+
+#========================= PRESENCE BITSETS ===============================#
+def PackPresence(profiles, blocksize=BLOCK_SIZE):
+    """
+    Packs which loci have a call into 64 bit words, one row of words
+    per profile. The 1748 core loci fit in 28 words.
+
+    :param profiles: 1D or 2D array of allele calls
+    :return: N x words array of uint64
+    """
+    profiles = np.atleast_2d( profiles )
+    nProfiles, nLoci = profiles.shape
+
+    # Loci per word, rounded up
+    nWords = ( nLoci + 63 ) // 64
+    packed = np.zeros( ( nProfiles, nWords*8 ), dtype=np.uint8 )
+
+    for start in range( 0, nProfiles, blocksize ):
+        bits = np.packbits( profiles[ start:start+blocksize ] > 0, axis=1 )
+        packed[ start:start+blocksize, :bits.shape[1] ] = bits
+
+    return packed.view( np.uint64 )
+
+def PopCount(words):
+    """
+    Number of set bits along the last axis of an array of uint64 words
+    """
+    if hasattr( np, 'bitwise_count' ):
+        return np.sum( np.bitwise_count( words ), axis=-1, dtype=int )
+
+    words = np.ascontiguousarray( words )
+    return np.sum( _BYTE_POPCOUNT[ words.view( np.uint8 ) ], axis=-1, dtype=int )
+
+#========================= PROFILE STACK ==================================#
+class ProfileStack(object):
+    """
+    Growable (N x loci) array of allele calls. Rows are kept in the
+    order they were appended so they line up with a list of keys.
+    The presence bitset of every row is packed once, on append.
+    Without a dtype the stack takes the dtype of the first row, so
+    allele codes stay 16 bit.
+    """
+
+    def __init__(self, capacity=1024, dtype=None):
+        self._array = None
+        self._presence = None
+        self._size = 0
+        self._capacity = capacity
+        self._dtype = dtype
+
+    def Append(self, calls):
+
+        if self._array is None:
+            if self._dtype is None:
+                self._dtype = np.asarray( calls ).dtype
+
+            self._array = np.zeros( ( self._capacity, len( calls ) ),
+                dtype=self._dtype )
+            self._presence = np.zeros( ( self._capacity,
+                PackPresence( calls ).shape[1] ), dtype=np.uint64 )
+
+        # Out of room, double it
+        elif self._size == len( self._array ):
+            self._array = self._Grow( self._array )
+            self._presence = self._Grow( self._presence )
+
+        self._array[ self._size ] = calls
+        self._presence[ self._size ] = PackPresence( calls )[0]
+        self._size += 1
+
+    def Array(self):
+        if self._array is None:
+            return np.zeros( ( 0, 0 ), dtype=self._dtype or int )
+
+        return self._array[ :self._size ]
+
+    def Presence(self):
+        if self._presence is None:
+            return np.zeros( ( 0, 0 ), dtype=np.uint64 )
+
+        return self._presence[ :self._size ]
+
+    def _Grow(self, array):
+        grown = np.zeros( ( 2*len( array ), array.shape[1] ), dtype=array.dtype )
+        grown[ :self._size ] = array[ :self._size ]
+        return grown
+
+    def __len__(self):
+        return self._size
@@ -0,0 +1,73 @@
+###########################################################
+# Bulk writers for the database outputs
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import csv
+
+import numpy as np
+
+from .codebook import CODE_DTYPE
+from .loader import CHUNK_ROWS
+from .store import ProfileStore
+
+__all__ = [ 'WriteRows', 'WriteProfiles', 'SaveProfiles' ]
+
+#============================= WRITERS ====================================#
+def WriteRows(path, header, rows):
+    """
+    All the rows in one go, header is skipped if it's None
+    """
+    with open( path, 'w', newline='' ) as f:
+        writer = csv.writer( f )
+
+        if header is not None:
+            writer.writerow( header )
+
+        writer.writerows( rows )
+
+def WriteProfiles(path, header, names, profiles, codebook, chunksize=CHUNK_ROWS):
+    """
+    The name columns of every isolate followed by its allele calls.
+    The calls are decoded a chunk of isolates at a time with one
+    gather, and each chunk is handed to the writer at once.
+
+    :param names: list of rows, the name columns of each isolate
+    :param profiles: N x loci codes of codebook, or a list of rows of
+        them, e.g. the calls of the entries
+    """
+    with open( path, 'w', newline='' ) as f:
+        writer = csv.writer( f )
+
+        if header is not None:
+            writer.writerow( header )
+
+        for start in range( 0, len( names ), chunksize ):
+            block = codebook.DecodeArray( np.asarray( profiles[ start:start+chunksize ] ) )
+
+            writer.writerows( name + calls for name, calls in zip(
+                names[ start:start+chunksize ], block.tolist() ) )
+
+def SaveProfiles(path, columns, names, profiles, codebook, prefix=''):
+    """
+    Same as WriteProfiles, but saved as a profile store directory at
+    path, ProfileStore.Load reads it back. The codes are saved as they
+    are along with the codebook, nothing is decoded.
+
+    :param columns: what the name columns are called, key among them
+    """
+    metadata = { column: [ '' if name[i] is None else str( name[i] ) for name in names ]
+        for i, column in enumerate( columns ) }
+
+    if len( names ):
+        codes = np.asarray( profiles ) if isinstance( profiles, np.ndarray ) \
+            else np.stack( profiles )
+    else:
+        codes = np.zeros( ( 0, len( codebook ) ), dtype=CODE_DTYPE )
+
+    store = ProfileStore( path, list( columns ) + list( codebook.Loci() ),
+        codebook.Loci(), metadata, codes, codebook )
+
+    store.Save( None, prefix )
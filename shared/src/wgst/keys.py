@@ -0,0 +1,87 @@
+###########################################################
+# Dense integer ids for isolate keys
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import json
+
+import numpy as np
+
+__all__ = [ 'KeyRegistry', 'ID_DTYPE' ]
+
+ID_DTYPE = np.int32
+
+#============================ KEY REGISTRY ================================#
+class KeyRegistry(object):
+    """
+    Hands out ids 0, 1, 2... to isolate keys in the order they're first
+    seen and never takes them back, so anything kept per isolate can be
+    a list or an array indexed by id. The keys themselves are only
+    needed when reading or writing files.
+    """
+
+    def __init__(self, keys=()):
+        self._keys = []
+        self._ids = {}
+
+        for key in keys:
+            self.Intern( key )
+
+    @classmethod
+    def Load(cls, path):
+        with open( path, 'r' ) as f:
+            return cls( json.load( f ) )
+
+    def Save(self, path):
+        with open( path, 'w' ) as f:
+            json.dump( self._keys, f )
+
+    def Intern(self, key):
+        """
+        :return: id of key, a new one if it hasn't been seen
+        """
+        i = self._ids.get( key )
+
+        if i is None:
+            i = len( self._keys )
+            self._ids[ key ] = i
+            self._keys.append( key )
+
+        return i
+
+    def Id(self, key):
+        return self._ids[ key ]
+
+    def Ids(self, keys):
+        return np.asarray( [ self._ids[ key ] for key in keys ], dtype=ID_DTYPE )
+
+    def Key(self, i):
+        return self._keys[ i ]
+
+    def Keys(self, ids=None):
+        """
+        :return: the keys of ids, every key in id order if ids is None
+        """
+        if ids is None:
+            return self._keys
+
+        return [ self._keys[i] for i in np.asarray( ids ).tolist() ]
+
+    def Mask(self, ids=()):
+        """
+        :return: bool array over every id, True at ids
+        """
+        mask = np.zeros( len( self._keys ), dtype=bool )
+        mask[ np.asarray( ids, dtype=np.int64 ) ] = True
+        return mask
+
+    def __len__(self):
+        return len( self._keys )
+
+    def __contains__(self, key):
+        return key in self._ids
+
+    def __iter__(self):
+        return iter( self._keys )
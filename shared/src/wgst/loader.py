@@ -0,0 +1,357 @@
+###########################################################
+# Columnar loader for allele call exports
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import io
+import re
+import csv
+import mmap
+from operator import itemgetter
+from itertools import islice
+from multiprocessing import Pool
+from datetime import datetime, date
+from functools import lru_cache
+
+import numpy as np
+from tqdm import *
+
+from .matrix import SharedArray
+
+__all__ = [ 'ReadColumns', 'ReadFileColumns', 'SplitRecords', 'Records', 'ViewColumns',
+    'ProjectView', 'ParseUploadDate', 'ParseUploadDates', 'FromOrdinals', 'CHUNK_ROWS',
+    'CALL_DTYPE' ]
+
+# Rows parsed at a time, the string block for a chunk of ~3000
+# loci stays around 100 MB
+CHUNK_ROWS = 2048
+
+# Bytes of an export one worker parses at a time
+RANGE_BYTES = 1 << 26
+
+# Allele ids as they come out of the exports
+CALL_DTYPE = np.int32
+
+# Calls that mean the locus wasn't called
+MISSING = ( '', '?' )
+
+_WORKER = {}
+
+# These are used to extract date, if you're seeing issues with
+# dates not being extracted properly, please make sure they're
+# at least in the below formats. The first one that matches wins,
+# a lone year is the last resort.
+REUPLOADDATE = [
+                    ( r'[0-9]{1,2}/[0-9]{1,2}/[0-9]{4}', '%m/%d/%Y' ),
+                    ( r'[0-9]{4}/[0-9]{1,2}/[0-9]{1,2}', '%Y/%m/%d' ),
+                    ( r'[0-9]{1,2}-[0-9]{1,2}-[0-9]{4}', '%m-%d-%Y' ),
+                    ( r'[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}', '%Y-%m-%d' ),
+                    ( r'[0-9]{4}',                       '%Y' )
+                    ]
+
+# All of them in one pattern, the group that matched is the format
+REUPLOADDATE_ANY = re.compile( '|'.join( '({})'.format( pattern )
+    for pattern, _ in REUPLOADDATE ) )
+
+# When nothing matches
+DEFAULT_UPLOADDATE = datetime( 2000, 1, 1 ).date()
+
+#============================ UPLOAD DATES ================================#
+@lru_cache( maxsize=None )
+def ParseUploadDate(fld):
+    """
+    Upload date out of an export field, DEFAULT_UPLOADDATE if it isn't
+    in any of the REUPLOADDATE formats. Exports only have a handful of
+    distinct dates, each one is only parsed the first time it's seen.
+    """
+    matched = REUPLOADDATE_ANY.match( fld )
+
+    if matched is None:
+        return DEFAULT_UPLOADDATE
+
+    return datetime.strptime( fld, REUPLOADDATE[ matched.lastindex - 1 ][1] ).date()
+
+def ParseUploadDates(flds):
+    """
+    ParseUploadDate for a whole column, each distinct value once
+
+    :return: int64 array of date ordinals, date.fromordinal gives the
+        dates back
+    """
+    values, inverse = np.unique( np.asarray( flds, dtype=str ), return_inverse=True )
+    ordinals = np.asarray( [ ParseUploadDate( fld ).toordinal() for fld in values.tolist() ],
+        dtype=np.int64 )
+
+    return ordinals[ inverse.ravel() ] if len( values ) else np.zeros( 0, dtype=np.int64 )
+
+def FromOrdinals(ordinals):
+    """
+    Dates back from ParseUploadDates, each distinct one built once
+    """
+    values, inverse = np.unique( np.asarray( ordinals, dtype=np.int64 ), return_inverse=True )
+    dates = [ date.fromordinal( ordinal ) for ordinal in values.tolist() ]
+
+    return [ dates[i] for i in inverse.ravel().tolist() ]
+
+#=============================== VIEWS ====================================#
+def ViewColumns(columns, loci):
+    """
+    Resolves the loci of a view to where they sit in columns, once for
+    a whole file or matrix, so picking the view out is a single gather
+
+    :param columns: column names, a header or the loci of a loaded matrix
+    :param loci: loci of the view, in the order they should come out in
+    :return: int array of column numbers
+    """
+    index = { column: i for i, column in enumerate( columns ) }
+    missing = [ locus for locus in loci if locus not in index ]
+
+    if missing:
+        raise ValueError( 'Missing loci: {}'.format( ', '.join( missing[:10] ) ) )
+
+    return np.asarray( [ index[ locus ] for locus in loci ], dtype=np.int64 )
+
+def ProjectView(profiles, columns, loci):
+    """
+    The calls of loci out of a matrix that was loaded with columns,
+    e.g. core out of whole, without going back to the file
+    """
+    return np.take( profiles, ViewColumns( columns, loci ), axis=1 )
+
+#============================= BULK LOADER ================================#
+def ReadColumns(reader, lociColumns, metaColumns, chunksize=CHUNK_ROWS, desc=None):
+    """
+    Reads the rest of an export in one pass. The allele calls go
+    straight into one 2D integer array a chunk of rows at a time, every
+    other column of interest is kept as a list of strings. '' and '?'
+    are missing calls, 0.
+
+    The array starts out with room for a chunk and doubles when it
+    fills up, the rows are never touched one at a time.
+
+    :param reader: csv reader, past the header
+    :param lociColumns: column numbers of the allele calls, in the order
+        the columns of the array should be in, see ViewColumns
+    :param metaColumns: { name: column number } of the other columns
+    :param desc: tqdm description, no progress bar if None
+    :return: (N x len(lociColumns) CALL_DTYPE array, { name: list of N strings })
+    """
+    nLoci = len( lociColumns )
+    calls = np.zeros( ( chunksize, nLoci ), dtype=CALL_DTYPE )
+    metadata = { name: [] for name in metaColumns }
+    nRows = 0
+
+    # One C level call per row instead of a loop over the columns
+    getLoci = itemgetter( *lociColumns ) if nLoci > 1 else \
+        ( lambda row: ( row[ lociColumns[0] ], ) if nLoci else () )
+    getMeta = [ ( metadata[ name ], column ) for name, column in metaColumns.items() ]
+
+    progress = tqdm( desc=desc, unit='rows' ) if desc is not None else None
+
+    while True:
+        rows = list( islice( reader, chunksize ) )
+
+        if not rows:
+            break
+
+        try:
+            block = np.array( [ getLoci( row ) for row in rows ], dtype=str )
+
+            for values, column in getMeta:
+                values.extend( row[ column ] for row in rows )
+
+        except IndexError:
+            short = next( row for row in rows if len( row ) <= max( lociColumns +
+                list( metaColumns.values() ) ) )
+            raise ValueError( 'Row is missing columns: {}'.format( short[:1] ) ) from None
+
+        block = block.reshape( len( rows ), nLoci )
+
+        for missing in MISSING:
+            block[ block == missing ] = '0'
+
+        if nRows + len( rows ) > len( calls ):
+            grown = np.zeros( ( max( 2 * len( calls ), nRows + len( rows ) ), nLoci ),
+                dtype=CALL_DTYPE )
+            grown[ :nRows ] = calls[ :nRows ]
+            calls = grown
+
+        try:
+            calls[ nRows:nRows+len( rows ) ] = block.astype( CALL_DTYPE )
+
+        except ( ValueError, OverflowError ):
+            for row, values in zip( rows, block ):
+                try:
+                    values.astype( CALL_DTYPE )
+                except ( ValueError, OverflowError ):
+                    raise ValueError( 'Invalid allele call in row: {}'.format(
+                        row[:1] ) ) from None
+            raise
+
+        nRows += len( rows )
+
+        if progress is not None:
+            progress.update( len( rows ) )
+
+    if progress is not None:
+        progress.close()
+
+    return calls[ :nRows ], metadata
+
+#========================== PARALLEL INGESTION ============================#
+def Records(reader, skipFirst=None):
+    """
+    Rows of reader without the blank lines, and without the rows whose
+    first field is skipFirst, e.g. headers repeated by concatenating
+    exports
+    """
+    return ( row for row in reader if row and ( skipFirst is None or
+        row[0].lower() != skipFirst ) )
+
+def SplitRecords(path, rangeBytes=RANGE_BYTES):
+    """
+    Splits an export past its header into byte ranges of about
+    rangeBytes that start and end on record boundaries. Quotes inside a
+    field are doubled, so a newline ends a record exactly when the
+    number of quotes before it is even.
+
+    :return: list of (start, end, lines), lines is the most records the
+        range can hold
+    """
+    size = os.path.getsize( path )
+
+    if size == 0:
+        return []
+
+    with open( path, 'rb' ) as f, mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) as mm:
+
+        def Boundary(pos, inside):
+            # Line by line until a newline outside quotes
+            while pos < size:
+                newline = mm.find( b'\n', pos )
+                end = size if newline < 0 else newline + 1
+                inside ^= mm[ pos:end ].count( b'"' ) % 2 == 1
+                pos = end
+
+                if not inside:
+                    break
+
+            return pos
+
+        start = Boundary( 0, False )
+        ranges = []
+
+        while start < size:
+            target = min( start + rangeBytes, size )
+            block = mm[ start:target ]
+            end = Boundary( target, block.count( b'"' ) % 2 == 1 )
+
+            ranges.append( ( start, end, block.count( b'\n' ) +
+                mm[ target:end ].count( b'\n' ) + 1 ) )
+            start = end
+
+    return ranges
+
+def _InitWorker(buffer, shape, path, encoding, lociColumns, metaColumns, skipFirst,
+    chunksize):
+    # Wrap the shared buffer, nothing gets copied
+    _WORKER['calls'] = np.frombuffer( buffer, dtype=CALL_DTYPE,
+        count=int( np.prod( shape ) ) ).reshape( shape )
+
+    _WORKER['path'] = path
+    _WORKER['encoding'] = encoding
+    _WORKER['lociColumns'] = lociColumns
+    _WORKER['metaColumns'] = metaColumns
+    _WORKER['skipFirst'] = skipFirst
+    _WORKER['chunksize'] = chunksize
+
+def _ReadRange(job):
+    """
+    Parses one byte range and writes its calls into the shared array,
+    starting at offset
+
+    :return: (number of rows, metadata of the rows)
+    """
+    start, end, offset = job
+
+    with open( _WORKER['path'], 'rb' ) as f:
+        f.seek( start )
+        text = f.read( end - start ).decode( _WORKER['encoding'] )
+
+    # Newlines inside fields come out the same as reading the file
+    # in text mode with one process
+    reader = csv.reader( io.StringIO( text, newline=None ) )
+
+    calls, metadata = ReadColumns( Records( reader, _WORKER['skipFirst'] ),
+        _WORKER['lociColumns'], _WORKER['metaColumns'], _WORKER['chunksize'] )
+
+    _WORKER['calls'][ offset:offset+len( calls ) ] = calls
+
+    return len( calls ), metadata
+
+def ReadFileColumns(path, lociColumns, metaColumns, cores=1, encoding='cp1252',
+    skipFirst=None, chunksize=CHUNK_ROWS, rangeBytes=RANGE_BYTES, desc=None):
+    """
+    ReadColumns for the records of a whole export, past its header.
+
+    With more than one core the export is split with SplitRecords and a
+    pool of workers parses the ranges straight into one array in shared
+    memory. Each range gets room for as many rows as it has lines, the
+    gaps left by blank or skipped lines are closed up as the ranges come
+    back in file order. The rows come out in the same order as reading
+    the file from the top, duplicates and all.
+
+    :param skipFirst: see Records
+    :return: same as ReadColumns
+    """
+    ranges = SplitRecords( path, rangeBytes ) if cores is not None and cores > 1 else []
+
+    if len( ranges ) < 2:
+        with open( path, 'r', encoding=encoding ) as f:
+            reader = csv.reader( f )
+            next( reader, None )
+
+            return ReadColumns( Records( reader, skipFirst ), lociColumns, metaColumns,
+                chunksize, desc )
+
+    offsets = np.cumsum( [ 0 ] + [ lines for _, _, lines in ranges ] ).tolist()
+    shape = ( offsets[-1], len( lociColumns ) )
+    buffer, calls = SharedArray( shape, CALL_DTYPE )
+
+    metadata = { name: [] for name in metaColumns }
+    nRows = 0
+
+    progress = tqdm( desc=desc, unit='rows' ) if desc is not None else None
+
+    pool = Pool( min( cores, len( ranges ) ), initializer=_InitWorker,
+        initargs=( buffer, shape, path, encoding, list( lociColumns ), metaColumns,
+            skipFirst, chunksize ) )
+
+    try:
+        jobs = [ ( start, end, offset ) for ( start, end, _ ), offset in zip( ranges, offsets ) ]
+
+        # imap keeps the ranges in file order, every range after this
+        # one writes past where this one is moved to
+        for offset, ( n, part ) in zip( offsets, pool.imap( _ReadRange, jobs ) ):
+            if offset != nRows:
+                calls[ nRows:nRows+n ] = calls[ offset:offset+n ]
+
+            for name, values in part.items():
+                metadata[ name ].extend( values )
+
+            nRows += n
+
+            if progress is not None:
+                progress.update( n )
+
+    finally:
+        pool.close()
+        pool.join()
+
+        if progress is not None:
+            progress.close()
+
+    return calls[ :nRows ], metadata
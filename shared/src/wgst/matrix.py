@@ -0,0 +1,670 @@
+###########################################################
+# Condensed distance matrix functions
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import json
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+from .keys import KeyRegistry
+from .distance import GetTileCounts, GetCrossDistances, PercentDistance, \
+    PackPresence, TILE_SIZE
+
+__all__ = [ 'CondensedSize', 'CondensedOffset', 'CondensedRow', 'CondensedToData',
+    'CondensedMatrix', 'GetCondensedMatrix', 'UpdateCondensedMatrix', 'SharedArray',
+    'RowBlockPool', 'WorkerArray', 'IterJsonRows', 'ConvertJsonMatrix', 'CACHE_DTYPE' ]
+
+# Distances in the cache files, half the size of float64 and
+# still ~7 significant digits
+CACHE_DTYPE = np.float32
+
+# Shared buffers for the matrix workers, set up once per worker
+_WORKER = {}
+
+#========================= CONDENSED INDEXING =============================#
+# The condensed matrix is the upper triangle, row by row:
+# (0,1) (0,2) ... (0,n-1) (1,2) ... (n-2,n-1)
+
+def CondensedSize(n):
+    return n * ( n - 1 ) // 2
+
+def CondensedOffset(n, i):
+    """
+    Position of the pair (i, i+1), row i runs for the next n-i-1 values
+    """
+    return i * n - i * ( i + 1 ) // 2
+
+def CondensedRow(condensed, n, i):
+    """
+    All n distances for isolate i, 0. for itself
+    """
+    row = np.zeros( n, dtype=condensed.dtype )
+
+    # Pairs (j, i) for j < i sit in earlier rows
+    j = np.arange( i )
+    row[ :i ] = condensed[ j * n - j * ( j + 1 ) // 2 + i - j - 1 ]
+
+    # Pairs (i, j) for j > i are one contiguous run
+    start = CondensedOffset( n, i )
+    row[ i+1: ] = condensed[ start:start+n-i-1 ]
+
+    return row
+
+def CondensedToData(keys, condensed):
+    """
+    Condensed matrix to the cached json layout: { Key: {Other Keys: dist} },
+    other keys in the same order as keys
+    """
+    n = len( keys )
+    distance_data = {}
+
+    for i, key in enumerate( keys ):
+        row = CondensedRow( condensed, n, i ).tolist()
+        del row[ i ]
+        distance_data[ key ] = dict( zip( keys[:i] + keys[i+1:], row ) )
+
+    return distance_data
+
+#=========================== SHARED MEMORY ================================#
+def SharedArray(shape, dtype):
+    """
+    Numpy array over shared memory. Hand the buffer to child processes,
+    they can wrap it again with np.frombuffer without copying anything.
+
+    :return: (buffer, array)
+    """
+    dtype = np.dtype( dtype )
+    nBytes = int( np.prod( shape ) ) * dtype.itemsize
+
+    # RawArray won't take a size of 0
+    buffer = RawArray( 'b', max( nBytes, 1 ) )
+    array = np.frombuffer( buffer, dtype=dtype, count=int( np.prod( shape ) ) )
+
+    return buffer, array.reshape( shape )
+
+#======================== MATRIX CONSTRUCTION =============================#
+def _InitWorker(buffers, specs, nProfiles, tilesize, output=None):
+    # Wrap the shared buffers, nothing gets copied
+    for name, buffer in buffers.items():
+        shape, dtype = specs[ name ]
+        _WORKER[ name ] = np.frombuffer( buffer, dtype=dtype,
+            count=int( np.prod( shape ) ) ).reshape( shape )
+
+    # Or map the file the matrix goes in and write to it directly
+    if output is not None:
+        path, start, size = output
+        _WORKER['condensed'] = np.load( path, mmap_mode='r+' )[ start:start+size ]
+
+    _WORKER['n'] = nProfiles
+    _WORKER['tilesize'] = tilesize
+
+def RowBlockPool(profiles, presence, tilesize, cores, shared=(), output=None):
+    """
+    Process pool for work split into blocks of rows. The profiles and
+    their presence bitsets, plus any ( name, shape, dtype ) in shared,
+    are put in shared memory once and every worker wraps them, see
+    WorkerArray.
+
+    :param output: ( path, start, size ), the stretch of a .npy file
+        every worker maps as 'condensed'
+    :return: ( pool, { name: the shared array } )
+    """
+    buffers = {}
+    specs = {}
+    arrays = {}
+
+    for name, shape, dtype in [ ( 'profiles', profiles.shape, profiles.dtype ),
+        ( 'presence', presence.shape, presence.dtype ) ] + list( shared ):
+
+        buffers[ name ], arrays[ name ] = SharedArray( shape, dtype )
+        specs[ name ] = ( shape, dtype )
+
+    arrays['profiles'][:] = profiles
+    arrays['presence'][:] = presence
+
+    pool = Pool( cores, initializer=_InitWorker,
+        initargs=( buffers, specs, len( profiles ), tilesize, output ) )
+
+    return pool, arrays
+
+def WorkerArray(name):
+    """
+    An array RowBlockPool set up in this worker
+    """
+    return _WORKER[ name ]
+
+def _FillRowBlock(rowStart):
+    """
+    Computes every tile right of the diagonal for one block of rows
+    and writes them straight into the shared condensed matrix.
+
+    :return: number of pairs written
+    """
+    return FillRowBlock( _WORKER['profiles'], _WORKER['presence'],
+        _WORKER['condensed'], rowStart, _WORKER['tilesize'] )
+
+def FillRowBlock(profiles, presence, condensed, rowStart, tilesize):
+    n = len( profiles )
+    rows = profiles[ rowStart:rowStart+tilesize ]
+    rowBits = presence[ rowStart:rowStart+tilesize ]
+    pairs = 0
+
+    for colStart in range( rowStart, n, tilesize ):
+        cols = profiles[ colStart:colStart+tilesize ]
+        colBits = presence[ colStart:colStart+tilesize ]
+
+        nCommon, nSame = GetTileCounts( rows, cols, rowBits, colBits )
+        tile = PercentDistance( nCommon, nSame )
+        colEnd = colStart + len( cols )
+
+        for r in range( len( rows ) ):
+            i = rowStart + r
+
+            # Only the pairs right of the diagonal
+            first = max( colStart, i+1 )
+            if first >= colEnd:
+                continue
+
+            start = CondensedOffset( n, i ) + first - i - 1
+            condensed[ start:start+colEnd-first ] = tile[ r, first-colStart: ]
+            pairs += colEnd - first
+
+    return pairs
+
+def GetCondensedMatrix(profiles, tilesize=TILE_SIZE, cores=1, progress=None,
+    out=None, path=None, start=0):
+    """
+    All-pairs distance matrix in condensed form.
+
+    With more than one core the profiles and their presence bitsets are
+    put in shared memory once, and a pool of workers takes one block of
+    rows at a time, writing the distances directly into a shared output
+    buffer, or into the file out maps when its path is given, so the
+    matrix is never held in memory. Only the pair counts go back
+    through the pool.
+
+    :param profiles: 2D array, one row of allele calls per isolate
+    :param tilesize: rows and columns per tile
+    :param cores: number of worker processes
+    :param progress: optional callable, called with the number of pairs
+        finished after every row block
+    :param out: optional 1D array to fill, e.g. a memmap of the cache file
+    :param path: the .npy file out is a memmap of, the workers map it
+        themselves
+    :param start: position of out in that file
+    :return: 1D array of n*(n-1)/2 distances
+    """
+    profiles = np.asarray( profiles )
+    n = len( profiles )
+    rowStarts = list( range( 0, n, tilesize ) )
+    presence = PackPresence( profiles )
+
+    if cores is None or cores < 2 or len( rowStarts ) < 2:
+        if out is None:
+            condensed = np.zeros( CondensedSize( n ), dtype=float )
+        else:
+            condensed = out
+
+        for rowStart in rowStarts:
+            pairs = FillRowBlock( profiles, presence, condensed,
+                rowStart, tilesize )
+
+            if progress is not None:
+                progress( pairs )
+
+        return condensed
+
+    # Without a file to write to, the matrix itself is shared
+    shared = []
+    output = None
+
+    if out is not None and path is not None:
+        output = ( path, start, CondensedSize( n ) )
+
+    else:
+        shared.append( ( 'condensed', ( CondensedSize( n ), ),
+            np.dtype( float ) if out is None else out.dtype ) )
+
+    pool, arrays = RowBlockPool( profiles, presence, tilesize, cores, shared, output )
+
+    try:
+        # The first row blocks have the most tiles, hand them out first
+        for pairs in pool.imap_unordered( _FillRowBlock, rowStarts ):
+            if progress is not None:
+                progress( pairs )
+
+    finally:
+        pool.close()
+        pool.join()
+
+    if output is not None:
+        return out
+
+    if out is not None:
+        out[:] = arrays['condensed']
+        return out
+
+    return arrays['condensed']
+
+def UpdateCondensedMatrix(matrix, keys, profiles, path, tilesize=TILE_SIZE,
+    cores=1, progress=None):
+    """
+    Condensed counterpart of UpdateDistanceData. Writes a new cache
+    file at path with the isolates of matrix that are still in keys,
+    in the same order, followed by the new ones. Only the pairs with a
+    new isolate are computed, the rest are copied over.
+
+    :param matrix: CondensedMatrix of the cached distances
+    :param keys: current keys in the same order as the rows of profiles
+    :return: (CondensedMatrix of the new file, added keys, removed keys)
+    """
+    rows = { key: i for i, key in enumerate( keys ) }
+
+    kept = [ key for key in matrix.Keys() if key in rows ]
+    added = [ key for key in keys if key not in matrix ]
+    removed = [ key for key in matrix.Keys() if key not in rows ]
+
+    nOld = len( matrix )
+    nKept = len( kept )
+    n = nKept + len( added )
+
+    old = matrix.Condensed()
+    oldIndices = np.asarray( [ matrix.Index( key ) for key in kept ], dtype=np.int64 )
+    keptProfiles = profiles[ [ rows[ key ] for key in kept ] ]
+    addedProfiles = profiles[ [ rows[ key ] for key in added ] ]
+
+    # Written next to the old file and swapped in at the end,
+    # the old one is still mapped until then
+    tmpPath = path + '.tmp'
+    condensed = np.lib.format.open_memmap( tmpPath, mode='w+',
+        dtype=CACHE_DTYPE, shape=( CondensedSize( n ), ) )
+
+    for r in range( nKept ):
+        start = CondensedOffset( n, r )
+        i = oldIndices[ r ]
+
+        # Kept vs kept, straight from the old file
+        j = oldIndices[ r+1: ]
+        condensed[ start:start+len( j ) ] = old[ CondensedOffset( nOld, i ) + j - i - 1 ]
+
+    # Kept vs added, the added isolates sit at the end of every kept row
+    for rowStart in range( 0, nKept, tilesize ):
+        block = GetCrossDistances( keptProfiles[ rowStart:rowStart+tilesize ],
+            addedProfiles, tilesize )
+
+        for r, distances in enumerate( block, rowStart ):
+            start = CondensedOffset( n, r ) + nKept - r - 1
+            condensed[ start:start+len( added ) ] = distances
+
+        if progress is not None:
+            progress( len( block ) * len( added ) )
+
+    # Added vs added is the tail of the new matrix, same layout as
+    # a matrix of just the added isolates
+    tail = CondensedOffset( n, nKept )
+    GetCondensedMatrix( addedProfiles, tilesize, cores, progress,
+        out=condensed[ tail: ], path=tmpPath, start=tail )
+
+    condensed.flush()
+    del condensed, old
+
+    os.replace( tmpPath, path )
+    CondensedMatrix.SaveKeys( path, kept + added )
+
+    return CondensedMatrix.Load( path ), added, removed
+
+#========================== JSON CONVERSION ===============================#
+# Characters of the json file read at a time
+CHUNK_SIZE = 1 << 24
+
+def IterJsonRows(path, chunksize=CHUNK_SIZE):
+    """
+    Streams the rows of a json distance matrix, { Key: {Other Keys: dist} },
+    a row at a time. Only the row being parsed and a chunk of the file
+    are ever in memory, never the whole document.
+
+    :return: generator of (key, [ (other key, dist), ... ])
+    """
+    decoder = json.JSONDecoder( object_pairs_hook=list )
+    whitespace = json.decoder.WHITESPACE
+
+    with open( path, 'r' ) as f:
+
+        # consumed counts the characters already dropped from the buffer
+        state = { 'buffer': '', 'eof': False, 'consumed': 0 }
+
+        def More():
+            chunk = f.read( chunksize )
+            state['eof'] = not chunk
+            state['buffer'] += chunk
+
+            return not state['eof']
+
+        def Parse(pos, parse):
+            # Keeps reading until the value at pos is all there. A
+            # value that's cut off fails at the end of the buffer,
+            # anything failing well before it is broken
+            while True:
+                try:
+                    return parse( state['buffer'], pos )
+                except json.JSONDecodeError as e:
+                    if len( state['buffer'] ) - e.pos > chunksize or not More():
+                        raise ValueError( 'Invalid json distance matrix: {} at '
+                            'character {}'.format( path, state['consumed'] + pos ) ) from None
+
+        def Token(pos):
+            # Next character that isn't whitespace
+            while True:
+                pos = whitespace.match( state['buffer'], pos ).end()
+                if pos < len( state['buffer'] ) or not More():
+                    return pos, state['buffer'][ pos:pos+1 ]
+
+        pos, token = Token( 0 )
+        if token != '{':
+            raise ValueError( 'Invalid json distance matrix: {}'.format( path ) )
+
+        pos, token = Token( pos + 1 )
+
+        while token != '}':
+
+            if token != '"':
+                raise ValueError( 'Invalid json distance matrix: {} at '
+                    'character {}'.format( path, state['consumed'] + pos ) )
+
+            key, pos = Parse( pos + 1, json.decoder.scanstring )
+
+            pos, token = Token( pos )
+            if token != ':':
+                raise ValueError( 'Invalid json distance matrix: {} at '
+                    'character {}'.format( path, state['consumed'] + pos ) )
+
+            pos, _ = Token( pos + 1 )
+            row, pos = Parse( pos, decoder.raw_decode )
+
+            if not isinstance( row, list ):
+                raise ValueError( 'Invalid json distance matrix: {}, row {} '
+                    'is not an object'.format( path, key ) )
+
+            yield key, row
+
+            # Drop what's been parsed so the buffer stays a chunk or so
+            state['buffer'] = state['buffer'][ pos: ]
+            state['consumed'] += pos
+
+            pos, token = Token( 0 )
+            if token == ',':
+                pos, token = Token( pos + 1 )
+
+def ConvertJsonMatrix(jsonPath, path, tolerance=1e-6, chunksize=CHUNK_SIZE,
+    progress=None):
+    """
+    Converts a json cache from before the binary one, without loading
+    the whole thing, and checks it on the way. Every isolate needs a
+    row with every other isolate in it once, and both directions of a
+    pair need the same distance.
+
+    The keys are taken from the first row, so that is the only row held
+    in memory. Everything else goes straight into the memmap.
+
+    :param tolerance: largest difference allowed between d[a,b] and d[b,a]
+    :param progress: optional callable, called with 1 after every row
+    :return: CondensedMatrix of the new file
+    """
+    rows = IterJsonRows( jsonPath, chunksize )
+
+    try:
+        first, firstRow = next( rows )
+    except StopIteration:
+        first, firstRow = None, []
+
+    keys = ( [ first ] if first is not None else [] ) + [ key for key, _ in firstRow ]
+    index = { key: i for i, key in enumerate( keys ) }
+    n = len( keys )
+
+    if len( index ) != n:
+        raise ValueError( 'Duplicate keys in the first row of {}'.format( jsonPath ) )
+
+    tmpPath = path + '.tmp'
+    condensed = np.lib.format.open_memmap( tmpPath, mode='w+',
+        dtype=CACHE_DTYPE, shape=( CondensedSize( n ), ) )
+
+    # Pairs that haven't been seen yet
+    condensed[:] = np.nan
+
+    # Which row each isolate was last seen in, so repeats in a row
+    # show up, and which isolates have had their own row
+    lastSeen = np.full( n, -1, dtype=np.int64 )
+    hasRow = np.zeros( n, dtype=bool )
+
+    def AddRow(key, row):
+        if key not in index:
+            raise ValueError( 'Row for {} is not in the first row of {}'.format(
+                key, jsonPath ) )
+
+        i = index[ key ]
+
+        if hasRow[i]:
+            raise ValueError( 'Two rows for {} in {}'.format( key, jsonPath ) )
+
+        hasRow[i] = True
+
+        try:
+            ids = np.asarray( [ index[ other ] for other, _ in row ], dtype=np.int64 )
+        except KeyError as e:
+            raise ValueError( 'Row for {} has an unknown key: {}'.format(
+                key, e.args[0] ) ) from None
+
+        distances = np.asarray( [ dist for _, dist in row ], dtype=float )
+
+        if len( ids ) != n - 1 or np.any( ids == i ) or np.any( lastSeen[ ids ] == i ):
+            raise ValueError( 'Row for {} does not have every other isolate '
+                'exactly once'.format( key ) )
+
+        lastSeen[ ids ] = i
+
+        lo = np.minimum( ids, i )
+        hi = np.maximum( ids, i )
+        offsets = CondensedOffset( n, lo ) + hi - lo - 1
+
+        # The first direction of a pair fills it in, the second is checked
+        # against it
+        current = condensed[ offsets ].astype( float )
+        seen = ~np.isnan( current )
+
+        bad = np.abs( current[ seen ] - distances[ seen ].astype( CACHE_DTYPE ) ) > tolerance
+        if np.any( bad ):
+            j = ids[ seen ][ np.argmax( bad ) ]
+            raise ValueError( 'Distance matrix is not symmetric: {}-{}'.format(
+                key, keys[j] ) )
+
+        condensed[ offsets[ ~seen ] ] = distances[ ~seen ]
+
+        if progress is not None:
+            progress( 1 )
+
+    try:
+        if first is not None:
+            AddRow( first, firstRow )
+            del firstRow
+
+        for key, row in rows:
+            AddRow( key, row )
+
+        if not np.all( hasRow ):
+            missing = keys[ int( np.argmin( hasRow ) ) ]
+            raise ValueError( 'No row for {} in {}'.format( missing, jsonPath ) )
+
+        condensed.flush()
+        del condensed
+
+    except Exception:
+        del condensed
+        os.remove( tmpPath )
+        raise
+
+    os.replace( tmpPath, path )
+    CondensedMatrix.SaveKeys( path, keys )
+
+    return CondensedMatrix.Load( path )
+
+#========================= CONDENSED MATRIX ===============================#
+class CondensedMatrix(object):
+    """
+    Keyed access to a condensed distance matrix. The cache is a .npy
+    file of CACHE_DTYPE distances that gets memory mapped read only, so
+    loading it costs nothing and forked children share the same pages.
+    The keys are kept next to it in a json file, in row order.
+    """
+
+    def __init__(self, keys, condensed):
+        self._registry = keys if isinstance( keys, KeyRegistry ) else KeyRegistry( keys )
+        self._keys = self._registry.Keys()
+        self._condensed = condensed
+
+        if len( self._condensed ) != CondensedSize( len( self._keys ) ):
+            raise RuntimeError( 'Distance matrix does not match its keys: {} '
+                'distances for {} keys'.format( len( self._condensed ),
+                    len( self._keys ) ) )
+
+    @staticmethod
+    def KeysPath(path):
+        return os.path.splitext( path )[0] + '_keys.json'
+
+    @staticmethod
+    def SaveKeys(path, keys):
+        with open( CondensedMatrix.KeysPath( path ), 'w' ) as f:
+            json.dump( keys, f )
+
+    @classmethod
+    def Load(cls, path):
+        with open( cls.KeysPath( path ), 'r' ) as f:
+            keys = json.load( f )
+
+        return cls( keys, np.load( path, mmap_mode='r' ) )
+
+    @classmethod
+    def FromData(cls, distance_data):
+        """
+        From the json layout: { Key: {Other Keys: dist} }
+        """
+        keys = list( distance_data )
+        condensed = np.zeros( CondensedSize( len( keys ) ), dtype=CACHE_DTYPE )
+
+        for i, key in enumerate( keys ):
+            row = distance_data[ key ]
+            start = CondensedOffset( len( keys ), i )
+            condensed[ start:start+len( keys )-i-1 ] = [ row[ other ] for other in keys[i+1:] ]
+
+        return cls( keys, condensed )
+
+    def Save(self, path):
+        np.save( path, np.asarray( self._condensed, dtype=CACHE_DTYPE ) )
+        CondensedMatrix.SaveKeys( path, self._keys )
+
+    def Keys(self):
+        return self._keys
+
+    def Registry(self):
+        return self._registry
+
+    def Index(self, key):
+        return self._registry.Id( key )
+
+    def Condensed(self):
+        return self._condensed
+
+    def Distance(self, key, other):
+        i = self._registry.Id( key )
+        j = self._registry.Id( other )
+
+        if i == j:
+            return 0.
+
+        if i > j:
+            i, j = j, i
+
+        return float( self._condensed[ CondensedOffset( len( self._keys ), i ) + j - i - 1 ] )
+
+    def Cutoffs(self, thresholds):
+        """
+        The thresholds as the stored distances compare against them.
+        A cached distance is float32, so one that is exactly on a
+        threshold, like 3 mismatches in 1500 loci at 0.2, only stays on
+        it when the threshold goes through float32 too.
+        """
+        cast = self._condensed.dtype.type
+
+        return [ float( cast( threshold ) ) for threshold in thresholds ]
+
+    def Row(self, key):
+        """
+        Distances from key to every key, in key order, as float64.
+        Compare them against Cutoffs, not the thresholds.
+        """
+        return CondensedRow( self._condensed, len( self._keys ),
+            self._registry.Id( key ) ).astype( float )
+
+    def Distances(self, key, others, bound=None):
+        return self.IdDistances( self._registry.Id( key ), self.Indices( others ) )
+
+    def Indices(self, keys):
+        """
+        Integer isolate ids for keys, the row numbers in the matrix
+        """
+        return self._registry.Ids( keys )
+
+    def IdDistances(self, i, ids, bound=None):
+        """
+        Distances from isolate id i to the isolate ids in ids. Only
+        those pairs are read, not the whole row.
+
+        :param bound: every pair is stored, so it makes no difference
+            here. Same arguments as NeighborList.IdDistances
+        :return: float64 array in the same order as ids
+        """
+        ids = np.asarray( ids, dtype=np.int64 )
+        lo = np.minimum( ids, i )
+        hi = np.maximum( ids, i )
+        itself = ids == i
+
+        # Any valid offset will do for i itself, it's zeroed after
+        offsets = np.where( itself, 0,
+            CondensedOffset( len( self._keys ), lo ) + hi - lo - 1 )
+
+        distances = self._condensed[ offsets ].astype( float )
+        distances[ itself ] = 0.
+
+        return distances
+
+    def Shared(self):
+        """
+        The same matrix with the distances in shared memory, so the
+        forked workers all read one copy. A mapped cache file is
+        already shared through the page cache, so it is returned as is.
+        """
+        if isinstance( self._condensed, np.memmap ):
+            return self
+
+        _, condensed = SharedArray( self._condensed.shape, self._condensed.dtype )
+        condensed[:] = self._condensed
+
+        return CondensedMatrix( self._registry, condensed )
+
+    def RowData(self, key):
+        row = self.Row( key ).tolist()
+        i = self._registry.Id( key )
+        del row[ i ]
+
+        return dict( zip( self._keys[:i] + self._keys[i+1:], row ) )
+
+    def __len__(self):
+        return len( self._keys )
+
+    def __contains__(self, key):
+        return key in self._registry
@@ -0,0 +1,406 @@
+###########################################################
+# Sparse neighbor lists
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import json
+
+import numpy as np
+
+from .distance import GetCrossDistances, GetBoundedDistances, GetDistance, \
+    GetTileCounts, PercentDistance, PackPresence, BEYOND_BOUND, TILE_SIZE
+from .matrix import SharedArray, RowBlockPool, WorkerArray
+from .keys import KeyRegistry
+
+__all__ = [ 'NeighborList', 'GetNeighborList', 'GetNeighborPairs', 'UpdateNeighborList' ]
+
+#========================== NEIGHBOR LISTS ================================#
+def NeighborRowBlock(profiles, presence, rowStart, tilesize, radius):
+    """
+    Every pair within radius between one block of rows and the rows
+    after them, a tile at a time like FillRowBlock
+
+    :return: ( rows, cols, distances ) of the pairs, rows < cols
+    """
+    n = len( profiles )
+    rows = profiles[ rowStart:rowStart+tilesize ]
+    rowBits = presence[ rowStart:rowStart+tilesize ]
+    pairs = ( [], [], [] )
+
+    for colStart in range( rowStart, n, tilesize ):
+        tile = PercentDistance( *GetTileCounts( rows,
+            profiles[ colStart:colStart+tilesize ], rowBits,
+            presence[ colStart:colStart+tilesize ] ) )
+
+        r, c = np.nonzero( tile <= radius )
+
+        # Only the upper triangle, the rest is in earlier blocks
+        upper = c + colStart > r + rowStart
+        r = r[ upper ]
+        c = c[ upper ]
+
+        pairs[0].append( r + rowStart )
+        pairs[1].append( c + colStart )
+        pairs[2].append( tile[ r, c ] )
+
+    return tuple( np.concatenate( part ) for part in pairs )
+
+def _NeighborRowBlock(args):
+    rowStart, tilesize, radius = args
+    return NeighborRowBlock( WorkerArray( 'profiles' ), WorkerArray( 'presence' ),
+        rowStart, tilesize, radius )
+
+def _BlockPairs(rowStart, nRows, n):
+    # Pairs a block of rows is compared for, right of the diagonal
+    return nRows * ( n - rowStart ) - nRows * ( nRows + 1 ) // 2
+
+def GetNeighborPairs(profiles, radius, tilesize=TILE_SIZE, cores=1, progress=None):
+    """
+    Every pair within radius, without ever holding the whole matrix.
+    The pairs are computed a block of rows at a time against the rest
+    of the rows after them, same pairs as GetCondensedMatrix, and with
+    more than one core the blocks go to the same kind of pool. Only
+    the pairs within radius come back from the workers.
+
+    :return: ( rows, cols, distances ) of the pairs, rows < cols
+    """
+    profiles = np.asarray( profiles )
+    n = len( profiles )
+    rowStarts = list( range( 0, n, tilesize ) )
+    presence = PackPresence( profiles )
+    pairs = []
+
+    if cores is None or cores < 2 or len( rowStarts ) < 2:
+        for rowStart in rowStarts:
+            pairs.append( NeighborRowBlock( profiles, presence, rowStart,
+                tilesize, radius ) )
+
+            if progress is not None:
+                progress( _BlockPairs( rowStart, min( tilesize, n - rowStart ), n ) )
+
+    else:
+        pool, _ = RowBlockPool( profiles, presence, tilesize, cores )
+
+        try:
+            for rowStart, block in zip( rowStarts, pool.imap( _NeighborRowBlock,
+                [ ( rowStart, tilesize, radius ) for rowStart in rowStarts ] ) ):
+
+                pairs.append( block )
+
+                if progress is not None:
+                    progress( _BlockPairs( rowStart, min( tilesize, n - rowStart ), n ) )
+
+        finally:
+            pool.close()
+            pool.join()
+
+    if not pairs:
+        return np.zeros( 0, dtype=np.int64 ), np.zeros( 0, dtype=np.int64 ), np.zeros( 0 )
+
+    return tuple( np.concatenate( part ) for part in zip( *pairs ) )
+
+def PairsToLists(n, rows, cols, distances):
+    """
+    Pairs with rows < cols to the CSR layout of NeighborList, both
+    directions, sorted by row then column
+
+    :return: ( indptr, indices, distances )
+    """
+    rows, cols = np.concatenate( ( rows, cols ) ), np.concatenate( ( cols, rows ) )
+    distances = np.concatenate( ( distances, distances ) )
+
+    order = np.lexsort( ( cols, rows ) )
+    indptr = np.zeros( n + 1, dtype=np.int64 )
+    np.cumsum( np.bincount( rows, minlength=n ), out=indptr[1:] )
+
+    return indptr, cols[ order ], distances[ order ]
+
+def GetNeighborList(keys, profiles, radius, tilesize=TILE_SIZE, cores=1, progress=None):
+    """
+    :param keys: keys in the same order as the rows of profiles
+    :param profiles: 2D array, one row of allele calls per isolate
+    :param radius: largest distance to keep
+    :param cores: number of worker processes
+    :param progress: optional callable, called with the number of pairs
+        finished after every row block
+    :return: NeighborList of GetNeighborPairs, with the profiles attached
+    """
+    profiles = np.asarray( profiles )
+    rows, cols, distances = GetNeighborPairs( profiles, radius, tilesize, cores, progress )
+
+    return NeighborList( keys, *PairsToLists( len( profiles ), rows, cols, distances ),
+        radius = radius, profiles = profiles )
+
+def UpdateNeighborList(neighbors, keys, profiles, radius, tilesize=TILE_SIZE, cores=1,
+    progress=None):
+    """
+    Neighbor list counterpart of UpdateCondensedMatrix. The isolates of
+    neighbors that are still in keys keep their order and their pairs,
+    the new ones go after them. Only the pairs with a new isolate are
+    computed.
+
+    :param neighbors: NeighborList to extend, built out to at least radius
+    :param keys: current keys in the same order as the rows of profiles
+    :return: ( NeighborList, added keys, removed keys )
+    """
+    if neighbors.Radius() < radius:
+        raise ValueError( 'Neighbor lists only go out to {}, can not extend '
+            'them to {}'.format( neighbors.Radius(), radius ) )
+
+    profiles = np.asarray( profiles )
+    rows = { key: i for i, key in enumerate( keys ) }
+
+    kept = [ key for key in neighbors.Keys() if key in rows ]
+    added = [ key for key in keys if key not in neighbors ]
+    removed = [ key for key in neighbors.Keys() if key not in rows ]
+
+    nKept = len( kept )
+    n = nKept + len( added )
+
+    keptProfiles = profiles[ [ rows[ key ] for key in kept ] ]
+    addedProfiles = profiles[ [ rows[ key ] for key in added ] ]
+
+    # Kept vs kept, the old ids renumbered and the ones that are gone
+    # dropped
+    renumber = np.full( len( neighbors ), -1, dtype=np.int64 )
+    renumber[ neighbors.Indices( kept ) ] = np.arange( nKept )
+
+    oldRows, oldCols, oldDistances = neighbors.Pairs()
+    r, c = renumber[ oldRows ], renumber[ oldCols ]
+    keep = ( r >= 0 ) & ( c >= 0 ) & ( oldDistances <= radius )
+    r, c = np.minimum( r[ keep ], c[ keep ] ), np.maximum( r[ keep ], c[ keep ] )
+    pairs = [ ( r, c, oldDistances[ keep ] ) ]
+
+    # Kept vs added
+    for rowStart in range( 0, nKept, tilesize ):
+        block = GetCrossDistances( keptProfiles[ rowStart:rowStart+tilesize ],
+            addedProfiles, tilesize )
+
+        r, c = np.nonzero( block <= radius )
+        pairs.append( ( r + rowStart, c + nKept, block[ r, c ] ) )
+
+        if progress is not None:
+            progress( len( block ) * len( added ) )
+
+    # Added vs added, same as a list of just the added isolates
+    r, c, distances = GetNeighborPairs( addedProfiles, radius, tilesize, cores, progress )
+    pairs.append( ( r + nKept, c + nKept, distances ) )
+
+    rows, cols, distances = ( np.concatenate( part ) for part in zip( *pairs ) )
+
+    updated = NeighborList( kept + added, *PairsToLists( n, rows, cols, distances ),
+        radius = radius, profiles = np.concatenate( ( keptProfiles, addedProfiles ) ) )
+
+    return updated, added, removed
+
+class NeighborList(object):
+    """
+    For every isolate only the neighbors within radius, in CSR layout:
+    the neighbors of isolate i are indices[ indptr[i]:indptr[i+1] ],
+    sorted, and their distances sit at the same positions in distances.
+
+    Naming only ever looks at pairs within the largest threshold, so as
+    long as that is within radius this gives the same names as the full
+    matrix. Pairs past radius come back as BEYOND_BOUND, unless the
+    profiles are attached, then anything asked for past radius is
+    computed exactly.
+
+    Same lookups as CondensedMatrix, so either can be handed to the
+    naming pipelines.
+    """
+
+    def __init__(self, keys, indptr, indices, distances, radius, profiles=None):
+        self._registry = keys if isinstance( keys, KeyRegistry ) else KeyRegistry( keys )
+        self._keys = self._registry.Keys()
+        self._indptr = indptr
+        self._indices = indices
+        self._distances = distances
+        self._radius = float( radius )
+        self._profiles = profiles
+        self._presence = None
+
+        if len( self._indptr ) != len( self._keys ) + 1:
+            raise RuntimeError( 'Neighbor lists do not match their keys: {} '
+                'rows for {} keys'.format( len( self._indptr ) - 1, len( self._keys ) ) )
+
+    @staticmethod
+    def KeysPath(path):
+        return os.path.splitext( path )[0] + '_keys.json'
+
+    @classmethod
+    def Load(cls, path):
+        with open( cls.KeysPath( path ), 'r' ) as f:
+            keys = json.load( f )
+
+        with np.load( path ) as data:
+            profiles = data['profiles'] if 'profiles' in data else None
+
+            return cls( keys, data['indptr'], data['indices'], data['distances'],
+                data['radius'], profiles )
+
+    def Save(self, path):
+        arrays = {
+            'indptr':       self._indptr,
+            'indices':      self._indices,
+            'distances':    self._distances,
+            'radius':       np.float64( self._radius )
+        }
+
+        if self._profiles is not None:
+            arrays['profiles'] = self._profiles
+
+        # Through a file handle so numpy doesn't tack on another .npz
+        with open( path, 'wb' ) as f:
+            np.savez( f, **arrays )
+
+        with open( self.KeysPath( path ), 'w' ) as f:
+            json.dump( self._keys, f )
+
+    def Keys(self):
+        return self._keys
+
+    def Registry(self):
+        return self._registry
+
+    def Index(self, key):
+        return self._registry.Id( key )
+
+    def Indices(self, keys):
+        return self._registry.Ids( keys )
+
+    def Radius(self):
+        return self._radius
+
+    def Cutoffs(self, thresholds):
+        """
+        Same as CondensedMatrix.Cutoffs. The distances here are float64,
+        so the thresholds stay as they are.
+        """
+        return list( thresholds )
+
+    def AttachProfiles(self, profiles):
+        """
+        Profiles in key order, for the pairs past radius
+        """
+        self._profiles = np.asarray( profiles )
+        self._presence = None
+
+    def IdNeighbors(self, i):
+        """
+        :return: (isolate ids, distances) of the neighbors of isolate id i
+        """
+        start, end = self._indptr[i], self._indptr[i+1]
+        return self._indices[ start:end ], self._distances[ start:end ]
+
+    def Pairs(self):
+        """
+        :return: ( rows, cols, distances ) of every pair once, rows < cols
+        """
+        rows = np.repeat( np.arange( len( self._keys ) ), np.diff( self._indptr ) )
+        upper = self._indices > rows
+
+        return rows[ upper ], self._indices[ upper ], self._distances[ upper ]
+
+    def Neighbors(self, key):
+        """
+        :return: { Other Key: dist } for the neighbors of key
+        """
+        ids, distances = self.IdNeighbors( self._registry.Id( key ) )
+        return { self._keys[j]: d for j, d in zip( ids.tolist(), distances.tolist() ) }
+
+    def Distance(self, key, other):
+        i = self._registry.Id( key )
+        j = self._registry.Id( other )
+
+        if i == j:
+            return 0.
+
+        ids, distances = self.IdNeighbors( i )
+        k = np.searchsorted( ids, j )
+
+        if k < len( ids ) and ids[k] == j:
+            return float( distances[k] )
+
+        if self._profiles is None:
+            return BEYOND_BOUND
+
+        return GetDistance( self._profiles[i], self._profiles[j] )
+
+    def IdDistances(self, i, ids, bound=None):
+        """
+        Distances from isolate id i to the isolate ids in ids
+
+        :param bound: largest distance of interest, radius by default.
+            Past radius the distances are computed, which needs the
+            profiles.
+        :return: float64 array in the same order as ids, BEYOND_BOUND
+            for pairs past the bound
+        """
+        ids = np.asarray( ids, dtype=np.int64 )
+
+        if bound is not None and bound > self._radius:
+            return self._Compute( i, ids, bound )
+
+        distances = np.full( len( ids ), BEYOND_BOUND )
+
+        # The neighbors are sorted, each id is looked up in them
+        neighbors, neighborDistances = self.IdNeighbors( i )
+
+        if len( neighbors ):
+            k = np.minimum( np.searchsorted( neighbors, ids ), len( neighbors ) - 1 )
+            found = neighbors[k] == ids
+            distances[ found ] = neighborDistances[ k[ found ] ]
+
+        distances[ ids == i ] = 0.
+
+        if bound is not None:
+            distances[ distances > bound ] = BEYOND_BOUND
+
+        return distances
+
+    def Distances(self, key, others, bound=None):
+        return self.IdDistances( self._registry.Id( key ), self.Indices( others ), bound )
+
+    def _Compute(self, i, ids, bound):
+        if self._profiles is None:
+            raise ValueError( 'Neighbor lists only go out to {}, need the '
+                'profiles for distances up to {}'.format( self._radius, bound ) )
+
+        if self._presence is None:
+            self._presence = PackPresence( self._profiles )
+
+        return GetBoundedDistances( self._profiles[i], self._profiles[ ids ], bound,
+            self._presence[ ids ] )
+
+    def RowData(self, key):
+        return self.Neighbors( key )
+
+    def Shared(self):
+        """
+        The same lists with the arrays in shared memory, so the forked
+        workers all read one copy
+        """
+        arrays = []
+
+        for array in ( self._indptr, self._indices, self._distances, self._profiles ):
+            if array is None:
+                arrays.append( None )
+                continue
+
+            _, shared = SharedArray( array.shape, array.dtype )
+            shared[:] = array
+            arrays.append( shared )
+
+        indptr, indices, distances, profiles = arrays
+
+        return NeighborList( self._registry, indptr, indices, distances, self._radius,
+            profiles )
+
+    def __len__(self):
+        return len( self._keys )
+
+    def __contains__(self, key):
+        return key in self._registry
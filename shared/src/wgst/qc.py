@@ -0,0 +1,59 @@
+###########################################################
+# Presence QC over whole profile matrices
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import numpy as np
+
+from .loader import CHUNK_ROWS
+
+__all__ = [ 'PresenceFractions', 'QCSweep' ]
+
+#================================ QC ======================================#
+def PresenceFractions(profiles, chunksize=CHUNK_ROWS):
+    """
+    Fraction of the loci that were called, for every isolate at once.
+    One count over the matrix, a chunk of rows at a time so memory
+    mapped profiles are only paged through once.
+
+    :param profiles: 2D array of allele calls or codes, or a list of
+        rows of the same length, e.g. the calls of the entries
+    :return: float array, one fraction per row
+    """
+    n = len( profiles )
+    counts = np.zeros( n, dtype=np.int64 )
+    nLoci = None
+
+    for start in range( 0, n, chunksize ):
+        block = np.asarray( profiles[ start:start+chunksize ] )
+        counts[ start:start+len( block ) ] = np.count_nonzero( block, axis=1 )
+        nLoci = block.shape[1]
+
+    if nLoci is None:
+        return np.zeros( 0 )
+
+    return counts / nLoci
+
+def QCSweep(fractions, minPresences, scale=1.):
+    """
+    Every cut-off at once from the same fractions, they're sorted once
+    and each cut-off is a binary search.
+
+    :param fractions: from PresenceFractions
+    :param minPresences: cut-offs, an isolate fails one if
+        scale * fraction < cut-off
+    :param scale: 100. for cut-offs in percent
+    :return: { cut-off: int array of the failing rows, in row order }
+    """
+    fractions = np.asarray( fractions, dtype=float )
+
+    if scale != 1.:
+        fractions = scale * fractions
+
+    order = np.argsort( fractions, kind='stable' )
+    ranked = fractions[ order ]
+
+    return { minPres: np.sort( order[ :np.searchsorted( ranked, minPres, side='left' ) ] )
+        for minPres in minPresences }
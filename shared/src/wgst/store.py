@@ -0,0 +1,287 @@
+###########################################################
+# Binary profile store for allele call exports
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import csv
+import json
+import shutil
+import hashlib
+import warnings
+
+import numpy as np
+
+from .codebook import AlleleCodebook, CODE_DTYPE
+from .loader import ReadFileColumns, ViewColumns, ParseUploadDates, FromOrdinals, \
+    CHUNK_ROWS
+
+__all__ = [ 'ProfileStore' ]
+
+# Bump this when the layout of the store changes, older stores are
+# imported again
+STORE_VERSION = 2
+
+# Bytes hashed at a time
+HASH_BLOCK = 1 << 20
+
+class ProfileStore(object):
+    """
+    An export parsed once and kept in a directory next to it:
+
+        codes.npy       every allele call as a per locus code, N x loci
+        codebook.json   the codes back to allele ids
+        uploaddate.npy  parsed upload dates as ordinals, if there are any
+        index.json      header, loci, and every other column as strings
+
+    The codes are memory mapped, so opening a store only reads the
+    index. The store remembers the size and modification time of the
+    export it came from and Open imports it again once those change.
+    It also keeps a hash of the export's contents from when it was
+    imported, so keying on the data doesn't read the export again.
+    """
+
+    def __init__(self, path, header, loci, metadata, codes, codebook, dates=None,
+        digest=None):
+        self._path = path
+        self._header = tuple( header )
+        self._loci = list( loci )
+        self._metadata = metadata
+        self._codes = codes
+        self._codebook = codebook
+        self._dates = dates
+        self._digest = digest
+
+        if len( self._codes ) != len( self._metadata['key'] ):
+            raise RuntimeError( 'Profile store does not match its keys: {} '
+                'rows for {} keys'.format( len( self._codes ), len( self._metadata['key'] ) ) )
+
+    @staticmethod
+    def StorePath(fieldsPath):
+        return fieldsPath + '.store'
+
+    @staticmethod
+    def _Source(fieldsPath):
+        stat = os.stat( fieldsPath )
+        return { 'size': stat.st_size, 'mtime': stat.st_mtime_ns }
+
+    @staticmethod
+    def _Digest(fieldsPath):
+        digest = hashlib.sha256()
+
+        with open( fieldsPath, 'rb' ) as f:
+            for block in iter( lambda: f.read( HASH_BLOCK ), b'' ):
+                digest.update( block )
+
+        return digest.hexdigest()
+
+    @classmethod
+    def Open(cls, fieldsPath, prefix, encoding='cp1252', cores=1):
+        """
+        Store for the export at fieldsPath, imported if there isn't one
+        yet or the export changed since
+
+        :param prefix: the loci are the columns that start with it
+        :param cores: number of processes to parse the export with
+        """
+        path = cls.StorePath( fieldsPath )
+
+        try:
+            with open( os.path.join( path, 'index.json' ), 'r' ) as f:
+                index = json.load( f )
+
+        except ( OSError, ValueError ):
+            index = None
+
+        if index is not None and index['version'] == STORE_VERSION and \
+            index['prefix'] == prefix and index['source'] == cls._Source( fieldsPath ):
+
+            return cls.Load( path, index )
+
+        return cls.Import( fieldsPath, prefix, encoding, cores )
+
+    @classmethod
+    def Import(cls, fieldsPath, prefix, encoding='cp1252', cores=1, chunksize=CHUNK_ROWS):
+        """
+        Parses the export and saves the store next to it. If the store
+        can't be written the parsed store is still returned.
+        """
+        source = cls._Source( fieldsPath )
+        digest = cls._Digest( fieldsPath )
+
+        with open( fieldsPath, 'r', encoding=encoding ) as f:
+            reader = csv.reader( f )
+            header = tuple( map( str.lower, next( reader ) ) )
+
+            if 'key' not in header:
+                raise ValueError( 'Missing field: key' )
+
+        loci = [ h for h in header if h.startswith( prefix ) ]
+
+        # The first of a repeated column wins
+        metaColumns = { h: i for i, h in reversed( list( enumerate( header ) ) )
+            if not h.startswith( prefix ) }
+
+        # Headers repeated by concatenating exports are skipped
+        calls, metadata = ReadFileColumns( fieldsPath, ViewColumns( header, loci ),
+            metaColumns, cores, encoding, header[0], chunksize, desc='Importing {}'.format(
+                os.path.basename( fieldsPath ) ) )
+
+        codebook = AlleleCodebook( loci )
+        codes = codebook.EncodeArray( calls )
+        codes.flags.writeable = False
+        del calls
+
+        dates = None
+        if 'uploaddate' in metadata:
+            dates = ParseUploadDates( metadata['uploaddate'] )
+
+        store = cls( cls.StorePath( fieldsPath ), header, loci, metadata, codes,
+            codebook, dates, digest )
+
+        try:
+            store.Save( source, prefix )
+
+        except OSError as e:
+            warnings.warn( 'Could not save the profile store for {}: {}'.format(
+                fieldsPath, e ), RuntimeWarning )
+
+        return store
+
+    @classmethod
+    def Load(cls, path, index=None):
+        if index is None:
+            with open( os.path.join( path, 'index.json' ), 'r' ) as f:
+                index = json.load( f )
+
+        codes = np.load( os.path.join( path, 'codes.npy' ), mmap_mode='r' )
+        codebook = AlleleCodebook.Load( os.path.join( path, 'codebook.json' ),
+            index['loci'] )
+
+        datesPath = os.path.join( path, 'uploaddate.npy' )
+        dates = np.load( datesPath, mmap_mode='r' ) if os.path.exists( datesPath ) else None
+
+        return cls( path, index['header'], index['loci'], index['metadata'], codes,
+            codebook, dates, index['digest'] )
+
+    def Save(self, source, prefix):
+        """
+        Written to a temporary directory first, a store that's there
+        is always complete. The workers of a run can all end up
+        importing the same export, whichever is last wins.
+        """
+        tmp = '{}.{}.tmp'.format( self._path, os.getpid() )
+
+        if os.path.isdir( tmp ):
+            shutil.rmtree( tmp )
+
+        os.mkdir( tmp )
+
+        np.save( os.path.join( tmp, 'codes.npy' ), self._codes )
+        self._codebook.Save( os.path.join( tmp, 'codebook.json' ) )
+
+        if self._dates is not None:
+            np.save( os.path.join( tmp, 'uploaddate.npy' ), self._dates )
+
+        with open( os.path.join( tmp, 'index.json' ), 'w' ) as f:
+            json.dump( {
+                'version':  STORE_VERSION,
+                'source':   source,
+                'digest':   self._digest,
+                'prefix':   prefix,
+                'header':   self._header,
+                'loci':     self._loci,
+                'metadata': self._metadata
+                }, f )
+
+        if os.path.isdir( self._path ):
+            shutil.rmtree( self._path, ignore_errors=True )
+
+        try:
+            os.replace( tmp, self._path )
+
+        # Another one got there in between
+        except OSError:
+            shutil.rmtree( tmp, ignore_errors=True )
+
+    def Header(self):
+        return self._header
+
+    def Digest(self):
+        """
+        :return: sha256 of the export the store was imported from, None
+            for a store that was saved from profiles
+        """
+        return self._digest
+
+    def Loci(self):
+        return self._loci
+
+    def Codebook(self):
+        """
+        :return: the codebook of the store's own codes, Profiles with it
+            is the memory mapped array
+        """
+        return self._codebook
+
+    def Keys(self):
+        return self._metadata['key']
+
+    def Metadata(self, name):
+        """
+        :return: the column as a list of strings, in row order
+        """
+        return self._metadata[ name ]
+
+    def MetadataNames(self):
+        return list( self._metadata )
+
+    def UploadDates(self):
+        """
+        :return: list of dates in row order, None if the export has no
+            upload dates
+        """
+        if self._dates is None:
+            return None
+
+        return FromOrdinals( self._dates )
+
+    def Profiles(self, codebook, chunksize=CHUNK_ROWS):
+        """
+        Calls of the loci of codebook, in its order and with its codes.
+        Alleles codebook hasn't seen yet are added to it.
+
+        When codebook has every locus in the same order with the same
+        codes, the usual case once it's been saved from a store, this is
+        the memory mapped array itself. Otherwise the rows are gathered
+        and recoded a chunk at a time.
+
+        :return: read only N x loci array of CODE_DTYPE
+        """
+        columns = ViewColumns( self._loci, codebook.Loci() )
+        tables = codebook.Translate( self._codebook )
+
+        if len( columns ) == len( self._loci ) and \
+            np.array_equal( columns, np.arange( len( columns ) ) ) and \
+            all( np.array_equal( table, np.arange( len( table ) ) ) for table in tables ):
+
+            return self._codes
+
+        # One flat table, each column looks up in its own stretch of it
+        offsets = np.cumsum( [ 0 ] + [ len( table ) for table in tables[:-1] ] )
+        flat = np.concatenate( tables ) if tables else np.zeros( 0, dtype=CODE_DTYPE )
+
+        profiles = np.zeros( ( len( self._codes ), len( columns ) ), dtype=CODE_DTYPE )
+
+        for start in range( 0, len( self._codes ), chunksize ):
+            block = self._codes[ start:start+chunksize ][ :, columns ]
+            profiles[ start:start+chunksize ] = flat[ block + offsets ]
+
+        profiles.flags.writeable = False
+
+        return profiles
+
+    def __len__(self):
+        return len( self._codes )
@@ -0,0 +1,109 @@
+###########################################################
+# Checks the cache keys, and that Evict removes the least
+# recently used artifacts and nothing else
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import os
+import hashlib
+
+from .cache import ArtifactPath, Evict, SettingsKey, DataKey
+from .store import ProfileStore
+
+def MakeArtifact(directory, name, dataKey, size, mtime):
+    """
+    A matrix artifact, the .npy and its _keys.json
+    """
+    path = ArtifactPath( str( directory ), name, SettingsKey( [ 'lmo0001' ], 0.3 ),
+        dataKey, '.npy' )
+
+    for filePath, nBytes in ( ( path, size ), ( path[ :-4 ] + '_keys.json', 10 ) ):
+        with open( filePath, 'wb' ) as f:
+            f.write( b'0' * nBytes )
+
+        os.utime( filePath, ( mtime, mtime ) )
+
+    return path
+
+def WriteExport(path, rows):
+    with open( path, 'w' ) as f:
+        f.write( 'Key,lmo0001,lmo0002\n' )
+
+        for row in rows:
+            f.write( ','.join( row ) + '\n' )
+
+def Names(directory):
+    return sorted( os.listdir( str( directory ) ) )
+
+def test_settings_key():
+    key = SettingsKey( [ 'lmo0001', 'lmo0002' ], 0.3 )
+
+    # The loci are compared as a set, however the view spells them
+    assert SettingsKey( [ 'LMO0002', 'lmo0001' ], 0.3 ) == key
+
+    assert SettingsKey( [ 'lmo0001' ], 0.3 ) != key
+    assert SettingsKey( [ 'lmo0001', 'lmo0002' ], 0.5 ) != key
+
+def test_data_key_reuses_store_hash(tmp_path, monkeypatch):
+    path = str( tmp_path / 'calls.csv' )
+    WriteExport( path, [ ( 'a', '1', '2' ), ( 'b', '1', '' ) ] )
+
+    with open( path, 'rb' ) as f:
+        digest = hashlib.sha256( f.read() ).hexdigest()
+
+    store = ProfileStore.Open( path, 'lmo' )
+    assert store.Digest() == digest
+
+    key = DataKey( store )
+
+    # An unchanged export isn't read again for its key
+    def Fail(fieldsPath):
+        raise AssertionError( 'hashed {} again'.format( fieldsPath ) )
+
+    monkeypatch.setattr( ProfileStore, '_Digest', staticmethod( Fail ) )
+    assert DataKey( ProfileStore.Open( path, 'lmo' ) ) == key
+
+    # A changed one is
+    monkeypatch.undo()
+    WriteExport( path, [ ( 'a', '1', '2' ), ( 'b', '1', '3' ) ] )
+    assert DataKey( ProfileStore.Open( path, 'lmo' ) ) != key
+
+def test_evict_least_recently_used(tmp_path):
+    old = MakeArtifact( tmp_path, 'matrix_core', '1' * 64, 100, 1000 )
+    middle = MakeArtifact( tmp_path, 'matrix_core', '2' * 64, 100, 2000 )
+    new = MakeArtifact( tmp_path, 'matrix_core', '3' * 64, 100, 3000 )
+
+    # Everything fits
+    assert Evict( str( tmp_path ), maxBytes=330 ) == []
+
+    # Only the oldest has to go, along with its keys
+    removed = Evict( str( tmp_path ), maxBytes=250 )
+    assert sorted( removed ) == sorted( [ old, old[ :-4 ] + '_keys.json' ] )
+    assert os.path.exists( middle ) and os.path.exists( new )
+
+def test_evict_keep(tmp_path):
+    old = MakeArtifact( tmp_path, 'matrix_core', '1' * 64, 100, 1000 )
+    new = MakeArtifact( tmp_path, 'matrix_core', '2' * 64, 100, 2000 )
+
+    # Kept artifacts stay even when that leaves the directory too big
+    Evict( str( tmp_path ), maxBytes=0, keep=( old, ) )
+    assert os.path.exists( old ) and not os.path.exists( new )
+
+def test_evict_leaves_other_files(tmp_path):
+    artifact = MakeArtifact( tmp_path, 'matrix_core', '1' * 64, 100, 1000 )
+    others = [ 'qcd_core_matrix.npy', 'qcd_core_matrix_keys.json', 'notes.txt',
+        'matrix_core.npy.tmp' ]
+
+    for name in others:
+        ( tmp_path / name ).write_bytes( b'0' * 1000 )
+        os.utime( str( tmp_path / name ), ( 1, 1 ) )
+
+    removed = Evict( str( tmp_path ), maxBytes=0 )
+    assert sorted( removed ) == sorted( [ artifact, artifact[ :-4 ] + '_keys.json' ] )
+
+    assert Names( tmp_path ) == sorted( others )
+
+def test_evict_missing_directory(tmp_path):
+    assert Evict( str( tmp_path / 'missing' ) ) == []
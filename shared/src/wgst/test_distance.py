@@ -0,0 +1,107 @@
+###########################################################
+# Checks the vectorized distance functions against the
+# one pair at a time GetDistance
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import numpy as np
+import pytest
+
+from .distance import GetDistance, GetDistances, GetBoundedDistances, \
+    PercentDistance, PackPresence, PopCount, ProfileStack, BEYOND_BOUND
+
+def RandomProfiles(rng, n, nLoci, missing=0.1, alleles=4):
+    """
+    Few alleles per locus so the pairs are close enough to matter
+    """
+    profiles = rng.integers( 1, alleles+1, size=( n, nLoci ) )
+    profiles[ rng.random( ( n, nLoci ) ) < missing ] = 0
+
+    return profiles
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng( 0 )
+
+@pytest.mark.parametrize( 'nLoci', [ 1, 63, 64, 65, 300 ] )
+def test_get_distances(rng, nLoci):
+    profiles = RandomProfiles( rng, 50, nLoci )
+    presence = PackPresence( profiles )
+
+    for p in profiles[:5]:
+        expected = [ GetDistance( p, other ) for other in profiles ]
+
+        assert GetDistances( p, profiles ).tolist() == expected
+        assert GetDistances( p, profiles, blocksize=7 ).tolist() == expected
+        assert GetDistances( p, profiles, presence, blocksize=7 ).tolist() == expected
+
+def test_get_distances_nothing_shared():
+    profiles = np.array( [ [ 1, 0, 0 ], [ 0, 2, 3 ], [ 0, 0, 0 ] ] )
+
+    assert GetDistances( profiles[0], profiles ).tolist() == [ 0., 100., 100. ]
+
+@pytest.mark.parametrize( 'bound', [ 0., 10., 25., 100. ] )
+def test_get_bounded_distances(rng, bound):
+    profiles = RandomProfiles( rng, 80, 300, missing=0.3 )
+    profiles[1] = profiles[0]
+
+    # Nothing in common with the first row
+    profiles[2] = np.where( profiles[0] > 0, 0, 1 )
+
+    presence = PackPresence( profiles )
+
+    for p in profiles[:5]:
+        expected = np.array( [ GetDistance( p, other ) for other in profiles ] )
+        within = expected <= bound
+
+        for bounded in ( GetBoundedDistances( p, profiles, bound ),
+            GetBoundedDistances( p, profiles, bound, presence, blocksize=9, lociblock=16 ),
+            GetDistances( p, profiles, presence, bound=bound ) ):
+
+            assert bounded[ within ].tolist() == expected[ within ].tolist()
+            assert np.all( bounded[ ~within ] == BEYOND_BOUND )
+
+def test_percent_distance_keeps_shape():
+    nCommon = np.array( [ [ 4, 0 ], [ 1500, 3 ] ] )
+    nSame = np.array( [ [ 3, 0 ], [ 1497, 3 ] ] )
+
+    assert PercentDistance( nCommon, nSame ).tolist() == [ [ 25., 100. ], [ 0.2, 0. ] ]
+
+@pytest.mark.parametrize( 'nLoci', [ 1, 8, 64, 100, 1748 ] )
+def test_pack_presence(rng, nLoci):
+    profiles = RandomProfiles( rng, 20, nLoci, missing=0.5 )
+    packed = PackPresence( profiles, blocksize=3 )
+
+    assert packed.dtype == np.uint64
+    assert packed.shape == ( 20, ( nLoci + 63 ) // 64 )
+
+    # Locus k is bit 7 - k % 8 of byte k // 8
+    bits = np.unpackbits( packed.view( np.uint8 ), axis=1 )[ :, :nLoci ]
+    assert np.array_equal( bits, profiles > 0 )
+
+    assert PopCount( packed ).tolist() == np.count_nonzero( profiles, axis=1 ).tolist()
+
+def test_pop_count_without_bitwise_count(rng, monkeypatch):
+    words = rng.integers( 0, 2**63, size=( 10, 5 ), dtype=np.uint64 )
+    expected = [ sum( bin( int( w ) ).count( '1' ) for w in row ) for row in words ]
+
+    monkeypatch.delattr( np, 'bitwise_count', raising=False )
+    assert PopCount( words ).tolist() == expected
+    assert PopCount( words[ :, ::2 ] ).tolist() == [
+        sum( bin( int( w ) ).count( '1' ) for w in row ) for row in words[ :, ::2 ] ]
+
+def test_profile_stack(rng):
+    profiles = RandomProfiles( rng, 10, 70 ).astype( np.uint16 )
+    stack = ProfileStack( capacity=3 )
+
+    assert len( stack.Array() ) == 0
+
+    for p in profiles:
+        stack.Append( p )
+
+    assert len( stack ) == 10
+    assert stack.Array().dtype == np.uint16
+    assert np.array_equal( stack.Array(), profiles )
+    assert np.array_equal( stack.Presence(), PackPresence( profiles ) )
@@ -0,0 +1,85 @@
+###########################################################
+# Checks that the byte ranges of SplitRecords, and the
+# parallel ReadFileColumns, read back the same records as
+# the csv module
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import io
+import csv
+import random
+
+import numpy as np
+import pytest
+
+from .loader import SplitRecords, ReadFileColumns
+
+def WriteExport(path, nRows, seed=0):
+    """
+    Export with fields that have quotes, commas and newlines in them,
+    so record boundaries and line boundaries don't line up
+    """
+    random.seed( seed )
+    pieces = [ 'a', 'b,c', '"', '""', '\n', '\r\n', 'x"\ny', ' ' ]
+
+    with open( path, 'w', newline='' ) as f:
+        writer = csv.writer( f )
+        writer.writerow( [ 'Key', 'Comment', 'lmo0001', 'lmo0002' ] )
+
+        for i in range( nRows ):
+            comment = ''.join( random.choice( pieces ) for _ in range( random.randint( 0, 6 ) ) )
+            writer.writerow( [ 'PNUSAL{:06d}'.format( i ), comment,
+                random.randint( 0, 9 ), random.randint( 0, 9 ) ] )
+
+@pytest.mark.parametrize( 'rangeBytes', [ 1, 17, 100, 1 << 26 ] )
+def test_split_records(tmp_path, rangeBytes):
+    path = str( tmp_path / 'calls.csv' )
+    WriteExport( path, 200 )
+
+    with open( path, 'rb' ) as f:
+        data = f.read()
+
+    def Parse(raw):
+        return list( csv.reader( io.StringIO( raw.decode(), newline='' ) ) )
+
+    expected = Parse( data )
+    ranges = SplitRecords( path, rangeBytes )
+
+    # Back to back from the end of the header to the end of the file
+    assert ranges[0][0] == len( data.split( b'\n', 1 )[0] ) + 1
+    assert ranges[-1][1] == len( data )
+    assert all( a[1] == b[0] for a, b in zip( ranges, ranges[1:] ) )
+
+    records = []
+    for start, end, lines in ranges:
+        chunk = Parse( data[ start:end ] )
+
+        assert len( chunk ) <= lines
+        records += chunk
+
+    assert records == expected[1:]
+
+def test_split_records_empty(tmp_path):
+    path = tmp_path / 'calls.csv'
+    path.write_bytes( b'' )
+
+    assert SplitRecords( str( path ) ) == []
+
+@pytest.mark.parametrize( 'cores', [ 1, 3 ] )
+def test_read_file_columns(tmp_path, cores):
+    path = str( tmp_path / 'calls.csv' )
+    WriteExport( path, 300 )
+
+    # Read in text mode, the way the pipelines always have
+    with open( path, 'r' ) as f:
+        expected = list( csv.reader( f ) )[1:]
+
+    calls, metadata = ReadFileColumns( path, [ 3, 2 ], { 'key': 0, 'comment': 1 },
+        cores=cores, chunksize=16, rangeBytes=500 )
+
+    # In file order, with the loci in the order they were asked for
+    assert np.array_equal( calls, [ [ int( row[3] ), int( row[2] ) ] for row in expected ] )
+    assert metadata['key'] == [ row[0] for row in expected ]
+    assert metadata['comment'] == [ row[1] for row in expected ]
@@ -0,0 +1,117 @@
+###########################################################
+# Checks the condensed matrix indexing and the json
+# matrix conversion against plain pair loops
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import json
+
+import numpy as np
+import pytest
+
+from .distance import GetDistance
+from .matrix import CondensedSize, CondensedOffset, CondensedRow, \
+    GetCondensedMatrix, CondensedMatrix, ConvertJsonMatrix, CACHE_DTYPE
+
+def Pairs(n):
+    return [ ( i, j ) for i in range( n ) for j in range( i+1, n ) ]
+
+@pytest.mark.parametrize( 'n', [ 0, 1, 2, 7, 40 ] )
+def test_condensed_offset(n):
+    pairs = Pairs( n )
+    assert CondensedSize( n ) == len( pairs )
+
+    for position, ( i, j ) in enumerate( pairs ):
+        assert CondensedOffset( n, i ) + j - i - 1 == position
+
+    # Vectorized over i as well
+    rows = np.arange( n )
+    assert CondensedOffset( n, rows ).tolist() == [ CondensedOffset( n, i ) for i in range( n ) ]
+
+def test_condensed_row():
+    n = 9
+    full = np.random.default_rng( 0 ).random( ( n, n ) )
+    full = full + full.T
+    np.fill_diagonal( full, 0. )
+
+    condensed = np.array( [ full[i, j] for i, j in Pairs( n ) ] )
+
+    for i in range( n ):
+        assert CondensedRow( condensed, n, i ).tolist() == full[i].tolist()
+
+def test_get_condensed_matrix():
+    rng = np.random.default_rng( 0 )
+    profiles = rng.integers( 0, 4, size=( 30, 130 ) )
+
+    condensed = GetCondensedMatrix( profiles, tilesize=7 )
+    expected = [ GetDistance( profiles[i], profiles[j] ) for i, j in Pairs( 30 ) ]
+
+    assert condensed.tolist() == expected
+
+def test_condensed_matrix_save_load(tmp_path):
+    keys = [ 'a', 'b', 'c', 'd' ]
+    full = np.array( [ [ 0., .2, 1., 2. ], [ .2, 0., 3., 4. ],
+        [ 1., 3., 0., 5. ], [ 2., 4., 5., 0. ] ] )
+
+    path = str( tmp_path / 'dist.npy' )
+    CondensedMatrix( keys, np.array( [ full[i, j] for i, j in Pairs( 4 ) ] ) ).Save( path )
+
+    matrix = CondensedMatrix.Load( path )
+
+    assert matrix.Keys() == keys
+    assert matrix.Condensed().dtype == CACHE_DTYPE
+
+    for i, key in enumerate( keys ):
+        assert np.array_equal( matrix.Row( key ), full[i].astype( CACHE_DTYPE ) )
+
+    # 3 mismatches in 1500 loci is exactly on 0.2, the float32 copy
+    # of it is a little past it but not past the cutoff
+    assert matrix.Distance( 'a', 'b' ) > .2
+    assert matrix.Distance( 'a', 'b' ) <= matrix.Cutoffs( [ .2 ] )[0]
+
+def WriteJson(path, keys, full, indent=None):
+    data = { key: { other: float( full[i, j] ) for j, other in enumerate( keys ) if i != j }
+        for i, key in enumerate( keys ) }
+
+    with open( path, 'w' ) as f:
+        json.dump( data, f, indent=indent )
+
+@pytest.mark.parametrize( 'chunksize', [ 64, 1 << 24 ] )
+def test_convert_json_matrix(tmp_path, chunksize):
+    keys = [ 'PNUSAL{:06d}'.format( i ) for i in range( 12 ) ]
+    full = np.round( np.random.default_rng( 1 ).random( ( 12, 12 ) ) * 10, 3 )
+    full = full + full.T
+    np.fill_diagonal( full, 0. )
+
+    jsonPath = str( tmp_path / 'dist.json' )
+    WriteJson( jsonPath, keys, full, indent=1 )
+
+    matrix = ConvertJsonMatrix( jsonPath, str( tmp_path / 'dist.npy' ), chunksize=chunksize )
+
+    assert matrix.Keys() == keys
+    for i, key in enumerate( keys ):
+        assert np.array_equal( matrix.Row( key ), full[i].astype( CACHE_DTYPE ) )
+
+def test_convert_json_matrix_rejects_asymmetric(tmp_path):
+    keys = [ 'a', 'b', 'c' ]
+    full = np.array( [ [ 0., 1., 2. ], [ 1., 0., 3. ], [ 2., 4., 0. ] ] )
+
+    jsonPath = str( tmp_path / 'dist.json' )
+    WriteJson( jsonPath, keys, full )
+
+    with pytest.raises( ValueError, match='not symmetric' ):
+        ConvertJsonMatrix( jsonPath, str( tmp_path / 'dist.npy' ) )
+
+    # Nothing is left behind
+    assert sorted( p.name for p in tmp_path.iterdir() ) == [ 'dist.json' ]
+
+def test_convert_json_matrix_rejects_missing_pairs(tmp_path):
+    jsonPath = str( tmp_path / 'dist.json' )
+
+    with open( jsonPath, 'w' ) as f:
+        json.dump( { 'a': { 'b': 1., 'c': 2. }, 'b': { 'a': 1. }, 'c': { 'a': 2., 'b': 3. } }, f )
+
+    with pytest.raises( ValueError, match='every other isolate' ):
+        ConvertJsonMatrix( jsonPath, str( tmp_path / 'dist.npy' ) )
@@ -0,0 +1,59 @@
+###########################################################
+# Checks QCSweep against the per entry presence QC it
+# replaced, one cut-off at a time
+# Author: Milan Patel
+# Version: 0.1
+# Contact: mpatel5@cdc.gov
+###########################################################
+
+import numpy as np
+import pytest
+
+from .qc import PresenceFractions, QCSweep
+
+def QC(profiles, minPresence):
+    """
+    The QC loop from Database.QC, rows under minPresence
+    """
+    failed = []
+
+    for i, calls in enumerate( profiles ):
+        nonZero = len( calls[ calls > 0 ] )
+
+        if float( nonZero ) / float( len( calls ) ) < minPresence:
+            failed.append( i )
+
+    return failed
+
+@pytest.fixture
+def profiles():
+    rng = np.random.default_rng( 0 )
+    profiles = rng.integers( 1, 5, size=( 300, 40 ) )
+
+    # Every presence from nothing to everything, so some sit right on a cut-off
+    for i, row in enumerate( profiles ):
+        row[ :i % 41 ] = 0
+
+    return profiles
+
+def test_presence_fractions(profiles):
+    fractions = PresenceFractions( profiles, chunksize=7 )
+
+    assert fractions.tolist() == [ np.count_nonzero( row ) / 40 for row in profiles ]
+    assert PresenceFractions( list( profiles ) ).tolist() == fractions.tolist()
+    assert len( PresenceFractions( np.zeros( ( 0, 40 ) ) ) ) == 0
+
+def test_qc_sweep(profiles):
+    minPresences = [ 0., 0.1, 0.3, 0.5, 0.95, 1., 1.1 ]
+    swept = QCSweep( PresenceFractions( profiles ), minPresences )
+
+    assert sorted( swept ) == minPresences
+    for minPresence in minPresences:
+        assert swept[ minPresence ].tolist() == QC( profiles, minPresence )
+
+def test_qc_sweep_percent(profiles):
+    fractions = PresenceFractions( profiles )
+    swept = QCSweep( fractions, [ 25., 50. ], scale=100. )
+
+    assert swept[ 25. ].tolist() == QC( profiles, 0.25 )
+    assert swept[ 50. ].tolist() == QC( profiles, 0.5 )
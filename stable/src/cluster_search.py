@@ -8,7 +8,6 @@
 
 import os
 import sys
-import re
 import csv
 import argparse
 
@@ -17,22 +16,7 @@ from operator import itemgetter
 from collections import defaultdict
 from tqdm import *
 
-# These are used to extract date, if you're seeing issues with
-# dates not being extracted properly, please make sure they're
-# at least in the below formats
-REUPLOADDATE_1 = re.compile( r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})' )
-REUPLOADDATE_2 = re.compile( r'([0-9]{4})/([0-9]{1,2})/([0-9]{1,2})' )
-REUPLOADDATE_3 = re.compile( r'([0-9]{1,2})-([0-9]{1,2})-([0-9]{4})' )
-REUPLOADDATE_4 = re.compile( r'([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})' )
-REUPLOADDATE_5 = re.compile( r'([0-9]{4})' )
-
-REUPLOADDATE = {
-                    REUPLOADDATE_1: '%m/%d/%Y',
-                    REUPLOADDATE_2: '%Y/%m/%d',
-                    REUPLOADDATE_3: '%m-%d-%Y',
-                    REUPLOADDATE_4: '%Y-%m-%d',
-                    REUPLOADDATE_5: '%Y'
-                    }
+from wgst.loader import ParseUploadDate
 
 def ParseAndValidateCommandLine():
 
@@ -296,15 +280,8 @@ class Database( object ):
 
                 key = fldsAndData['key']
 
-                uploadDate = None
-                for matchObj in REUPLOADDATE.keys():
-                    if matchObj.match( fldsAndData['uploaddate'] ):
-                        uploadDate = datetime.strptime( 
-                            fldsAndData['uploaddate'] , REUPLOADDATE[matchObj] ).date()
-                        break
-
-                if uploadDate is None:
-                    uploadDate = datetime.strptime( '1/1/2000', "%m/%d/%Y" ).date()
+                # Cached, the same few dates come up over and over
+                uploadDate = ParseUploadDate( fldsAndData['uploaddate'] )
 
                 srcType = fldsAndData['sourcetype']
 
@@ -331,15 +308,8 @@ class Database( object ):
 
                 key = fldsAndData['key']
 
-                uploadDate = None
-                for matchObj in REUPLOADDATE.keys():
-                    if matchObj.match( fldsAndData['uploaddate'] ):
-                        uploadDate = datetime.strptime( 
-                            fldsAndData['uploaddate'] , REUPLOADDATE[matchObj] ).date()
-                        break
-
-                if uploadDate is None:
-                    uploadDate = datetime.strptime( '1/1/2000', "%m/%d/%Y" ).date()
+                # Cached, the same few dates come up over and over
+                uploadDate = ParseUploadDate( fldsAndData['uploaddate'] )
 
                 srcType = fldsAndData['sourcetype']
 
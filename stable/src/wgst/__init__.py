@@ -2,4 +2,12 @@
 
 init file for calc stability
 
-"""
\ No newline at end of file
+"""
+
+import os
+
+# The kernels, caches and stores are shared with the other tree and live
+# once under shared/src/wgst. Adding that to the package path makes them
+# wgst.distance, wgst.matrix... here, modules in this directory come first
+__path__.append( os.path.normpath( os.path.join( os.path.dirname(
+    os.path.abspath( __file__ ) ), os.pardir, os.pardir, os.pardir, 'shared', 'src', 'wgst' ) ) )
@@ -8,29 +8,16 @@
 
 import os
 import sys
-import csv
 from datetime import datetime
-import re
 import json
 import numpy as np
 from tqdm import *
-
-# These are used to extract date, if you're seeing issues with
-# dates not being extracted properly, please make sure they're
-# at least in the below formats
-REUPLOADDATE_1 = re.compile( r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})' )
-REUPLOADDATE_2 = re.compile( r'([0-9]{4})/([0-9]{1,2})/([0-9]{1,2})' )
-REUPLOADDATE_3 = re.compile( r'([0-9]{1,2})-([0-9]{1,2})-([0-9]{4})' )
-REUPLOADDATE_4 = re.compile( r'([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})' )
-REUPLOADDATE_5 = re.compile( r'([0-9]{4})' )
-
-REUPLOADDATE = {
-                    REUPLOADDATE_1: '%m/%d/%Y',
-                    REUPLOADDATE_2: '%Y/%m/%d',
-                    REUPLOADDATE_3: '%m-%d-%Y',
-                    REUPLOADDATE_4: '%Y-%m-%d',
-                    REUPLOADDATE_5: '%Y'
-                    }
+from .codebook import AlleleCodebook
+from .loader import ProjectView
+from .store import ProfileStore
+from .qc import PresenceFractions, QCSweep
+from .export import WriteRows, WriteProfiles, SaveProfiles
+from .keys import KeyRegistry
 
 #=================== DATABASE CLASS =====================================#
 class DB(object):
@@ -39,12 +26,18 @@ class DB(object):
     # using the class method
     VIEWS = {}
 
-    def __init__(self, scheme, fieldsPath, viewsPath, outdir, adding_file = None ): 
+    def __init__(self, scheme, fieldsPath, viewsPath, outdir, adding_file = None, cores = 1 ): 
         self._entries = {}
+        self._cores = cores
         self._fieldsPath = fieldsPath
         self._viewsPath = viewsPath
         self._view = scheme
         self._outdir = outdir
+        self._codebook = None
+
+        # Every key gets an id on load, entries are also kept by id
+        self._registry = KeyRegistry()
+        self._byId = []
 
         if adding_file is not None:
             self._addingPath = adding_file
@@ -56,11 +49,24 @@ class DB(object):
         self.LoadCalls()
 
     def AddEntry(self, key, mlst, outbreak, srcType, uploadDate, alleleCalls):
-        self._entries[ key ] = DbaseEntry( key, mlst, outbreak, srcType, uploadDate, alleleCalls )
+        i = self._registry.Intern( key )
+        entry = DbaseEntry( key, mlst, outbreak, srcType, uploadDate, alleleCalls, i )
+        self._entries[ key ] = entry
+
+        if i == len( self._byId ):
+            self._byId.append( entry )
+        else:
+            self._byId[i] = entry
 
     def GetEntry(self, key):
         return self._entries[ key ]
 
+    def GetEntryById(self, i):
+        return self._byId[i]
+
+    def Registry(self):
+        return self._registry
+
     def GetEntries(self):
         return self._entries
 
@@ -71,137 +77,154 @@ class DB(object):
         for view in data:
             DB.VIEWS[ view ] = tuple( data[ view ] )
 
-    def ExtractData( self, header, reader, **flags ):
+    def ExtractData( self, store, **flags ):
 
         refHeader = ( 'key', 'mlst_st', 'outbreak', 'sourcetype', 'uploaddate' )
 
         for head in refHeader:
-            if head not in header:
+            if head not in store.Header():
                 raise ValueError('Missing field: {}'.format( head ) )
 
         if 'externaldata' in flags:
             self._addingSet = []
 
-        loci = 0
-        for fld in header:
-            if fld.lower().startswith('lmo'):
-                loci += 1
+        loci = len( store.Loci() )
 
         if loci < 1747:
             raise ValueError("Only found {} loci, "
                 "make sure we're not missing anything".format( 
                 str( loci) ) )
 
-        for row in tqdm( reader, desc= 'Loading metadata and allele calls' ):
-            
-            fldsAndData = { h:f for h,f in zip( header, row ) }
-            
-            key = fldsAndData['key']
-            
-            if len( fldsAndData['outbreak'] ) > 1:
-                outbreak = fldsAndData['outbreak']
-            else:
-                outbreak = None
-
-            if len( fldsAndData['mlst_st'] ) > 1:
-                mlst = fldsAndData['mlst_st'].lower().strip()
+        # Calls are kept as small per locus codes, the codebook is
+        # shared by every file we load
+        if self._codebook is None:
+            if self._view == 'whole':
+                activeLoci = store.Loci()
             else:
-                mlst = fldsAndData['mlst_st']
-
-            mlst = None
+                activeLoci = [ locus.lower() for locus in DB.GetView( self._view ) ]
 
-            if len( fldsAndData['sourcetype'] ) > 1:
-                srcType = fldsAndData['sourcetype'].lower().strip()
-            else:
-                srcType = None
+            self._codebook = AlleleCodebook.Load( self.CodebookPath(), activeLoci )
 
-            uploadDate = None
-            for matchObj in REUPLOADDATE.keys():
-                if matchObj.match( fldsAndData['uploaddate'] ):
-                    uploadDate = datetime.strptime( 
-                    fldsAndData['uploaddate'] , REUPLOADDATE[matchObj] ).date()
+        # Every allele call of the file sits in one array, each entry
+        # holds a read only view of its row
+        profiles = store.Profiles( self._codebook )
+        outbreaks = store.Metadata( 'outbreak' )
+        srcTypes = store.Metadata( 'sourcetype' )
+        uploadDates = store.UploadDates()
 
-            if uploadDate is None:
-                uploadDate = datetime.strptime( '1/1/2000', "%m/%d/%Y" ).date()
+        for i, key in enumerate( tqdm( store.Keys(), desc='Loading metadata and allele calls' ) ):
 
-            if self._view == 'whole':
-                alleleCalls = []
-                for i, fld in enumerate( header ):
-                    if fld.startswith('lmo'):
-                        alleleCalls.append( row[i] )
+            if len( outbreaks[i] ) > 1:
+                outbreak = outbreaks[i]
+            else:
+                outbreak = None
 
-                alleleCalls = np.asarray( alleleCalls, dtype=int )
-                alleleCalls.flags.writeable = False
+            mlst = None
 
+            if len( srcTypes[i] ) > 1:
+                srcType = srcTypes[i].lower().strip()
             else:
-                activeLoci = DB.GetView( self._view )
-                calls = {}
-                for i, fld in enumerate( header ):
-                    if fld.startswith('lmo'):
-                        calls[fld] = row[i]
+                srcType = None
 
-                alleleCalls = np.asarray( [ calls[locus.lower()] for locus in activeLoci ], dtype=int )
-                alleleCalls.flags.writeable = False
+            uploadDate = uploadDates[i]
+            alleleCalls = profiles[i]
 
             if 'externaldata' in flags:
                 if key not in self._entries:
-                    self.AddEntry( key, outbreak, uploadDate, alleleCalls)
+                    self.AddEntry( key, mlst, outbreak, srcType, uploadDate, alleleCalls)
                     self._addingSet.append( self._entries[ key ] )
             else:
                 self.AddEntry( key, mlst, outbreak, srcType, uploadDate, alleleCalls)
 
     def LoadCalls(self):
 
-        with open(self._fieldsPath, 'r', encoding='cp1252') as myFile:
-            reader = csv.reader( myFile )
-            header = tuple( map( str.lower, next( reader ) ) )
-
-            self.ExtractData( header, reader )
+        # Parsed once into a binary store next to the export, later
+        # runs read the store
+        self.ExtractData( ProfileStore.Open( self._fieldsPath, 'lmo', cores=self._cores ) )
 
         if self._addExternal:
+            self.ExtractData( ProfileStore.Open( self._addingPath, 'lmo', cores=self._cores ),
+                externaldata=True )
+
+        # Keep the codes stable for the next run
+        self._codebook.Save( self.CodebookPath() )
+
+    def CodebookPath(self):
+        return os.path.join( self._outdir, 'allele_codebook_{}.json'.format( self._view ) )
 
-            with open( self._addingPath, 'r', encoding='cp1252' ) as f:
-                reader = csv.reader( f )
-                header = tuple ( map( str.lower, next( reader ) ) )
+    def Decode(self, calls):
+        # Allele codes back to allele ids
+        return self._codebook.Decode( calls )
 
-                self.ExtractData( header, reader, externaldata=True)
+    def SetView(self, view):
+        """
+        Switches every entry over to another view of the loci already
+        loaded, e.g. core after whole, by gathering the columns out of
+        the loaded calls instead of reading the files again. The codes
+        stay the same, the codebook isn't saved for the new view.
+        """
+        loci = [ locus.lower() for locus in DB.GetView( view ) ]
+        entries = list( self._entries.values() )
+
+        if entries:
+            profiles = ProjectView( np.stack( [ entry.Calls() for entry in entries ] ),
+                self._codebook.Loci(), loci )
+            profiles.flags.writeable = False
+
+            for entry, alleleCalls in zip( entries, profiles ):
+                entry._alleleCalls = alleleCalls
+
+        self._codebook = self._codebook.Project( loci )
+        self._view = view
 
     def QC( self, minPresence ):
-        poorQuality = 0
-        for entry in tqdm( self.GetEntries().values(), desc='QC'):
-            
-            nonZero = len( list( filter( lambda x: x != 0, entry.Calls() ) ) )
-            total = len( entry.Calls() )
-
-            if float( nonZero ) / float( total ) < minPresence:
-                entry.SetQC( False )
-                poorQuality += 1
-            else:
-                entry.SetQC( True )
+        entries = list( self.GetEntries().values() )
+        failed = self.QCSweep( [ minPresence ] )[ minPresence ]
 
-        print( 'Poor quality entries: {:d}'.format( poorQuality ) )
+        for entry in entries:
+            entry.SetQC( True )
 
-    def Save( self, clusterSearch = False ):
+        for key in failed:
+            self._entries[ key ].SetQC( False )
 
-        OUT_NAME = datetime.now().strftime("%m-%d-%y@%H-%M-%S")
-        OUT_DIR = os.path.join( self._outdir, 'snsp_data')
+        print( 'Poor quality entries: {:d}'.format( len( failed ) ) )
 
-        if not os.path.isdir( OUT_DIR ):
-            os.mkdir( OUT_DIR )
+    def QCSweep( self, minPresences ):
+        """
+        Presence QC for several cut-offs in one pass over the calls
+
+        :return: { minPresence: keys of the entries under it }
+        """
+        entries = list( self.GetEntries().values() )
+        fractions = PresenceFractions( [ entry.Calls() for entry in entries ] )
+
+        return { minPresence: [ entries[i].Key() for i in rows.tolist() ]
+            for minPresence, rows in QCSweep( fractions, minPresences ).items() }
+
+    def Save( self, clusterSearch = False, binary = False ):
+        """
+        Every output comes out of one pass over the entries. The allele
+        calls for validation are decoded and written a chunk of isolates
+        at a time, or with binary saved as a profile store instead.
+        """
+        OUT_NAME = datetime.now().strftime("%m-%d-%y@%H-%M-%S")
+        HEADER = ['KEY', 'MLST_ST', 'OUTBREAK', 'SOURCETYPE', 'UPLOADDATE', 'WGST', \
+            'WGST History']
 
-        PATH = os.path.join( OUT_DIR , 'database_{}.csv'.format( OUT_NAME ) )
+        entries = list( self._entries.values() )
+        rows = []
 
-        with open(PATH, 'w', newline='') as f:
-            writer = csv.writer( f )
+        for entry in tqdm( entries, desc = 'Saving' ):
+            rows.append( [ entry.Key(), entry.Mlst(), entry.Outbreak(), entry.SrcType(), \
+                entry.UploadDate(), entry.Wgst(), '|'.join( map( str, entry.WgstHistory() ) ) ] )
 
-            writer.writerow( ['KEY', 'MLST_ST', 'OUTBREAK', 'SOURCETYPE', 'UPLOADDATE', 'WGST', \
-                'WGST History'] )
+        OUT_DIR = os.path.join( self._outdir, 'snsp_data')
 
-            for entry in tqdm( self._entries.values(), desc = 'Saving' ):
-                oArray = [ entry.Key(), entry.Mlst(), entry.Outbreak(), entry.SrcType(), \
-                    entry.UploadDate(), entry.Wgst(), '|'.join( map( str, entry.WgstHistory() ) ) ]
+        if not os.path.isdir( OUT_DIR ):
+            os.mkdir( OUT_DIR )
 
-                writer.writerow( oArray )
+        WriteRows( os.path.join( OUT_DIR , 'database_{}.csv'.format( OUT_NAME ) ),
+            HEADER, rows )
 
         # The below code is if you want to save the database to calculate
         # intra/inter cluster error
@@ -211,16 +234,15 @@ class DB(object):
         if not os.path.isdir( OUT_DIR ):
             os.mkdir( OUT_DIR )
 
-        PATH = os.path.join( OUT_DIR , 'database_{}.csv'.format( OUT_NAME ) )
-
-        with open( PATH, 'w', newline='') as f:
-
-            writer = csv.writer( f )
+        names = [ [ row[0], row[5] ] for row in rows ]
+        calls = [ entry.Calls() for entry in entries ]
 
-            for entry in tqdm( self._entries.values(), desc = 'Saving For Validation' ):
-                oArray = [ entry.Key(), entry.Wgst() ]
-                oArray.extend( list( entry.Calls() ) )
-                writer.writerow( oArray )
+        if binary:
+            SaveProfiles( os.path.join( OUT_DIR , 'database_{}.store'.format( OUT_NAME ) ),
+                [ 'key', 'wgst' ], names, calls, self._codebook )
+        else:
+            WriteProfiles( os.path.join( OUT_DIR , 'database_{}.csv'.format( OUT_NAME ) ),
+                None, names, calls, self._codebook )
 
         if clusterSearch:
             OUT_DIR = os.path.join( self._outdir, 'cluster_search' )
@@ -228,20 +250,10 @@ class DB(object):
             if not os.path.isdir( OUT_DIR ):
                 os.mkdir( OUT_DIR )
 
-            OUT_NAME = datetime.now().strftime("%m-%d-%y@%H-%M-%S")
-            PATH = os.path.join( OUT_DIR , 'cls_search_{}.csv'.format( OUT_NAME ) )
-
-            with open( PATH, 'w', newline='' ) as f:
-                writer = csv.writer( f )
-
-                writer.writerow( ['KEY', 'MLST_ST', 'OUTBREAK', 'SOURCETYPE', 'UPLOADDATE', 'WGST', \
-                    'WGST History'] )
+            index = { entry.Key(): i for i, entry in enumerate( entries ) }
 
-                for entry in tqdm( self._addingSet, desc='Saving for cluster search' ):
-                    oArray = [ entry.Key(), entry.Mlst(), entry.Outbreak(), entry.SrcType(), \
-                        entry.UploadDate(), entry.Wgst(), '|'.join( map( str, entry.WgstHistory() ) ) ]
-                    
-                    writer.writerow(oArray)
+            WriteRows( os.path.join( OUT_DIR , 'cls_search_{}.csv'.format( OUT_NAME ) ),
+                HEADER, [ rows[ index[ entry.Key() ] ] for entry in self._addingSet ] )
 
     def TotalIsolates(self):
         return len( self._entries )
@@ -257,9 +269,15 @@ class DB(object):
 
 class DbaseEntry(object):
 
-    def __init__(self, key, mlst, outbreak, srcType, uploadDate, alleleCalls):
+    # A few hundred thousand of these, no __dict__ on each one. The
+    # calls are a read only row of the profile matrix of the file.
+    __slots__ = ( '_key', '_mlst', '_outbreak', '_srcType', '_uploadDate',
+        '_alleleCalls', '_wgst', '_qcStatus', '_wgstHistory', '_id' )
+
+    def __init__(self, key, mlst, outbreak, srcType, uploadDate, alleleCalls, ID = None):
 
         self._key = key
+        self._id = ID
         self._mlst = mlst
         self._outbreak = outbreak
         self._srcType = srcType
@@ -271,6 +289,9 @@ class DbaseEntry(object):
 
     def Key(self):
         return self._key
+
+    def Id(self):
+        return self._id
     
     def Mlst(self):
         return self._mlst
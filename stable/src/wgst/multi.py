@@ -18,6 +18,10 @@ import random
 import re
 import numpy as np
 
+from .matrix import CondensedMatrix
+from .neighbors import NeighborList
+from .store import ProfileStore
+
 REQUEST_GET_NEXT = '__request_next__'
 RESPONSE_DATA = '__response_data__'
 RESPONSE_DONE = '__response_done__'
@@ -139,6 +143,8 @@ def DataConsumer( pipe ):
 
 		def __init__(self, path): 
 			self._entries = {}
+			self._byId = []
+			self._registry = None
 			self._dataPath = path
 			self.LoadDistanceData()
 			self.LoadCalls()
@@ -150,61 +156,33 @@ def DataConsumer( pipe ):
 		def GetEntry(self, key):
 			return self._entries.get( key, None)
 
+		def GetEntryById(self, i):
+			return self._byId[i]
+
+		def Registry(self):
+			return self._registry
+
 		def GetEntries(self):
 			return self._entries
 
 		def LoadCalls(self):
 
-			REUPLOADDATE_1 = re.compile( r'([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})' )
-			REUPLOADDATE_2 = re.compile( r'([0-9]{4})/([0-9]{1,2})/([0-9]{1,2})' )
-			REUPLOADDATE_3 = re.compile( r'([0-9]{1,2})-([0-9]{1,2})-([0-9]{4})' )
-			REUPLOADDATE_4 = re.compile( r'([0-9]{4})-([0-9]{1,2})-([0-9]{1,2})' )
-			REUPLOADDATE_5 = re.compile( r'([0-9]{4})' )
-
-			REUPLOADDATE = {
-								REUPLOADDATE_1: '%m/%d/%Y',
-								REUPLOADDATE_2: '%Y/%m/%d',
-								REUPLOADDATE_3: '%m-%d-%Y',
-								REUPLOADDATE_4: '%Y-%m-%d',
-								REUPLOADDATE_5: '%Y'
-								}
-
-			with open(self._dataPath, 'r', encoding='cp1252') as myFile:
-				reader = csv.reader( myFile )
-				
-				# Assumes that you have headers in your file. Comment
-				# the next line if that is not the case
-				header = tuple( map( str.lower, next(reader) ) )
-				refHeader = ( 'key', 'uploaddate' )
-				
-				for head in refHeader:
-					if head not in header:
-						raise ValueError('Missing field: {}'.format( head ) )
-
-				for row in reader:
+			# The export was parsed into its profile store when the
+			# matrix was built, so this only loads the index and the
+			# parsed dates from disk
+			store = ProfileStore.Open( self._dataPath, Main.args.get( 'organism', 'lmo' ) )
 
-					fldsAndData = { h:f for h,f in zip( header, row ) }
+			if 'uploaddate' not in store.Header():
+				raise ValueError('Missing field: uploaddate')
 
-					if len( fldsAndData['key'] ) > 0:
-						key = fldsAndData['key']
-					else:
-						continue
+			for key, uploadDate in zip( store.Keys(), store.UploadDates() ):
 
-					# Entries should have been loaded by now
-					entry = self.GetEntry( fldsAndData['key'] )
+				# Entries should have been loaded by now
+				entry = self.GetEntry( key ) if len( key ) > 0 else None
 
-					if entry is None: continue
+				if entry is None: continue
 
-					uploadDate = None
-					for matchObj in REUPLOADDATE.keys():
-						if matchObj.match( fldsAndData['uploaddate'] ):
-							uploadDate = datetime.strptime( 
-							fldsAndData['uploaddate'] , REUPLOADDATE[matchObj] ).date()
-
-					if uploadDate is None:
-						uploadDate = datetime.strptime( '1/1/2000', "%m/%d/%Y" ).date()
-
-					entry._uploadDate = uploadDate
+				entry._uploadDate = uploadDate
 
 			print('Pid: {} has loaded qualifiers for {} isolates at {}'.format(
 						os.getpid(), len( self._entries ), datetime.now() ))
@@ -221,15 +199,16 @@ def DataConsumer( pipe ):
 
 		def LoadDistanceData(self):
 
-			lenDatabase = len( Main.distance_matrix )
+			# The matrix is mapped read only, every entry
+			# just looks up its own row in it. The ids are the rows.
+			self._registry = Main.distance_matrix.Registry()
 
-			for k, v in Main.distance_matrix.items():
+			for k in Main.distance_matrix.Keys():
 				
 				newEntry = self.AddEntry( k )
-				
-				assert len( v ) == lenDatabase - 1
 
-				newEntry.AddDistanceData( v )
+				newEntry.AddDistanceData( Main.distance_matrix )
+				self._byId.append( newEntry )
 
 			print('Pid: {} has loaded distance matrix at {}'.format( os.getpid(), datetime.now() ))
 
@@ -247,6 +226,9 @@ def DataConsumer( pipe ):
 	#====================== DATABASE ENTRY OBJECT ===========================#
 	class DbaseEntry(object):
 
+		__slots__ = ( '_key', '_uploadDate', '_wgst', '_qcStatus', '_wgstHistory',
+			'distances', '_id' )
+
 		def __init__(self, key ):
 
 			self._key = key
@@ -259,31 +241,35 @@ def DataConsumer( pipe ):
 			return self._key
 
 		def AddDistanceData(self, value):
-			assert isinstance( value, dict )
+			assert isinstance( value, ( CondensedMatrix, NeighborList ) )
 			self.distances = value
+			self._id = value.Index( self._key )
 
 		def Distance(self, other):
-			if isinstance(other, str):
-				dist = self.distances.get(other, None)
-				
-				if dist == None:
-					raise ValueError( 'Distance Accession Error: {}-{}'.format(self._key, other ) )
-				else:
-					return dist
+			if isinstance(other, type(self) ):
+				other = other.Key()
 
-			elif isinstance(other, type(self) ):
-				dist = self.distances.get(other.Key(), None)
-				
-				if dist == None:
-					raise ValueError( 'Distance Accession Error: {}-{}'.format(self._key, other.Key() ) )
-				else:
-					return dist
-
-			else:
+			elif not isinstance(other, str):
 				raise TypeError( 'Invalid object for dist accession: {}'.format( repr( other ) ) )
 
+			try:
+				return self.distances.Distance( self._key, other )
+
+			except KeyError:
+				raise ValueError( 'Distance Accession Error: {}-{}'.format(self._key, other ) )
+
+		def Id(self):
+			return self._id
+
+		def Distances(self, ids, bound=None):
+			"""
+			Distances to a list of isolate ids at once, as an array.
+			Neighbor lists only have the pairs up to bound.
+			"""
+			return self.distances.IdDistances( self._id, ids, bound )
+
 		def GetDistances(self):
-			return self.distances
+			return self.distances.RowData( self._key )
 
 		def QC(self):
 			return self._qcStatus
@@ -578,6 +564,9 @@ def DataConsumer( pipe ):
 			self.thresholds = thresholds
 			self._entryBase = database
 
+			# What the distances are compared against, see Cutoffs
+			self._cutoffs = Main.distance_matrix.Cutoffs( thresholds )
+
 		def DoValidation(self):
 
 			existingNames = Names()
@@ -599,43 +588,48 @@ def DataConsumer( pipe ):
 			
 		def DoCalc(self, selection, existingNames, status, iteration = 0):
 
+			# Names go by isolate id, the same as the rows of the matrix
 			namedEntries = []
+			named = self._entryBase.Registry().Mask()
 			nameFrequencies = {}
 
 			for entry in self._entryBase.GetEntries().values():
-				if existingNames.HasResolvedName( entry.Key() ):
-					namedEntries.append( entry.Key() )
+				if existingNames.HasResolvedName( entry.Id() ):
+					namedEntries.append( entry.Id() )
+					named[ entry.Id() ] = True
 					nameFrequencies[ entry.Wgst() ] = nameFrequencies.get( entry.Wgst(), 0) + 1
 
 			#for each entry, calculate the name 
 			for entry in selection:
 				
+				i = entry.Id()
 				qcStatus = entry.QC()
 					
-				if qcStatus and entry.Key() in namedEntries:
+				if qcStatus and named[i]:
 					continue
 					
-				if existingNames.HasName( entry.Key() ):
-					existingNames.DropName( entry.Key() )
+				if existingNames.HasName( i ):
+					existingNames.DropName( i )
 
-				dists = [ entry.Distance( e ) for e in namedEntries ]
+				dists = entry.Distances( namedEntries, bound = max( self._cutoffs ) )
 				
 				#calculate the name of the entry
-				existingNames = CalcName(namedEntries, existingNames, entry.Key(), dists, self.thresholds, qcStatus)
+				existingNames = CalcName(namedEntries, existingNames, i, dists, self._cutoffs, qcStatus)
 				
 				#keep track of the data
-				if existingNames.HasResolvedName( entry.Key() ):
-					namedEntries.append( entry.Key() )
+				if existingNames.HasResolvedName( i ):
+					namedEntries.append( i )
+					named[i] = True
 
 			if iteration == 0:
-				for entry in namedEntries:
-					self._entryBase.GetEntry( entry ).Wgst( existingNames.GetStrName( entry ) )
+				for i in namedEntries:
+					self._entryBase.GetEntryById( i ).Wgst( existingNames.GetStrName( i ) )
 
-			for entry in namedEntries:
-				dbEntry = self._entryBase.GetEntry( entry )
+			for i in namedEntries:
+				dbEntry = self._entryBase.GetEntryById( i )
 
 				oldName = dbEntry.Wgst()
-				newName = existingNames.GetStrName( dbEntry.Key() )
+				newName = existingNames.GetStrName( i )
 
 				if oldName == newName:
 					continue
@@ -742,8 +736,9 @@ def Main(args):
 	numConsumers = args['cores'] - 3
 
 	# Assign the distance_matrix to the current namespace, children
-	# will inherit it
-	Main.distance_matrix = args['matrix']
+	# will inherit it. It's kept in shared memory so every child
+	# reads the same copy
+	Main.distance_matrix = args['matrix'].Shared()
 
 	# Communication for the children
 	pipes = [ Pipe( duplex=True ) for x in range( numConsumers ) ]
@@ -16,19 +16,10 @@ import random
 import numpy as np
 
 from wgst import database
+from wgst.distance import GetDistances, ProfileStack
+from wgst.neighbors import GetNeighborList
 from tqdm import *
 
-# ======================== DISTANCE FUNCTION ================================#
-def GetDistance(p1, p2):
-    
-    common = np.multiply(p1>0, p2>0)
-    nCommon = np.sum(common)
-    nSame = np.sum(p1[common]==p2[common])
-    if nCommon:
-        return 100.0 * (float(nCommon) - float(nSame)) / float(nCommon) #nCommon-nSame
-    else:
-        return 100.0
-
 # ======================== NAME EVENT OBJECT ================================#
 class NameEvent(object):
     def __init__(self, oldname, newname, key, info):
@@ -51,8 +42,8 @@ class Dbase(database.DB):
 
     CHILDREN = []
 
-    def __init__( self, scheme, fieldsPath, viewsPath, outdir, adding_file = None ):
-        super().__init__( scheme, fieldsPath, viewsPath, outdir, adding_file )
+    def __init__( self, scheme, fieldsPath, viewsPath, outdir, adding_file = None, cores = 1 ):
+        super().__init__( scheme, fieldsPath, viewsPath, outdir, adding_file, cores )
         Dbase.CHILDREN.append( self )
 
     def CreateSubset( self ):
@@ -72,8 +63,9 @@ class Dbase(database.DB):
         if self._addExternal:
             if len( self._addingSet ) > 0:
                 print( 'Creating subset based on external adding set' )
-                startingSet = [entry for entry in self._entries.values() if entry \
-                    not in self._addingSet ]
+                adding = self._registry.Mask( [ entry.Id() for entry in self._addingSet ] )
+                startingSet = [entry for entry in self._entries.values() if not \
+                    adding[ entry.Id() ] ]
 
                 addingSet = [ self._addingSet[i:i+30] for i in range(0, len(self._addingSet), 30) ]
 
@@ -494,16 +486,33 @@ class Calculator(object):
             args['fields_path'],
             args['views_path'],
             args['outdir'],
-            args['adding_file'] )
+            args['adding_file'],
+            args.get( 'cores' ) or 1 )
 
         self._entryBase.QC( self.minPresenceThreshold )
 
+        # With a radius every close pair is found up front, a tile at
+        # a time, and naming only looks them up by isolate id
+        self._neighbors = None
+
+        # Rows in id order, the isolate ids of the neighbor lists are
+        # the ids of the entries
+        if args.get( 'radius' ) is not None:
+            registry = self._entryBase.Registry()
+            self._neighbors = GetNeighborList( registry, np.asarray( [
+                self._entryBase.GetEntryById( i ).Calls() for i in range( len( registry ) ) ] ),
+                args['radius'], cores = args.get( 'cores' ) or 1 )
+
     def DoValidation(self):
 
         existingNames = Names()
         
         # Create starting and adding sets return the updated Names object to track history
         self._startingSet, addingSet = self._entryBase.CreateSubset()
+
+        # By id, the starting set holds entries and not keys
+        self._seed = self._entryBase.Registry().Mask( [ entry.Id() for entry in self._startingSet ] )
+
         existingNames = self.DoCalc(self._startingSet, existingNames, 'Initializing' )
 
         self._wgstHistory = WgstHistory( self.thresholds, self._args['outdir'], \
@@ -513,65 +522,87 @@ class Calculator(object):
         for i in trange( len( addingSet), desc='Clustering' ):
             existingNames = self.DoCalc(addingSet[i], existingNames, 'Incrementing', i+1 )
 
-        self._entryBase.Save( clusterSearch = self._args['clustersearch'] )
+        self._entryBase.Save( clusterSearch = self._args['clustersearch'],
+            binary = self._args.get( 'binaryout', False ) )
         self._wgstHistory.Save()
 
     def DoCalc(self, selection, existingNames, status, iteration = 0):
 
+        # Names and everything else in here go by isolate id, the
+        # keys only come back out through the entries
         namedEntries = []
+        named = self._entryBase.Registry().Mask()
         nameFrequencies = {}
+
+        # Allele calls of the named entries, row i belongs to namedEntries[i].
+        # The neighbor lists take the ids as they are.
+        namedProfiles = ProfileStack()
         
         for entry in self._entryBase.GetEntries().values():
-            if existingNames.HasResolvedName( entry.Key() ):
-                namedEntries.append( entry.Key() )
+            if existingNames.HasResolvedName( entry.Id() ):
+                self.AddNamed( entry, namedEntries, named, namedProfiles )
                 nameFrequencies[ entry.Wgst() ] = nameFrequencies.get(entry.Wgst(), 0) + 1
 
         #for each entry, calculate the name 
         for entry in tqdm( selection, desc=status ):
             
+            i = entry.Id()
             qcStatus = entry.QC()
                 
-            if qcStatus and entry.Key() in namedEntries:
+            if qcStatus and named[i]:
                 continue
                 
-            if existingNames.HasName( entry.Key() ):
-                existingNames.DropName( entry.Key() )
+            if existingNames.HasName( i ):
+                existingNames.DropName( i )
             
             #calculate the distance between the unnamed sample and all the named samples
-            dists = [ GetDistance( entry.Calls(), self._entryBase.GetEntry( e ).Calls() ) \
-                         for e in namedEntries ]
+            #only the distances within the biggest threshold matter for naming
+            if self._neighbors is not None:
+                dists = self._neighbors.IdDistances( i, namedEntries,
+                    bound = max( self.thresholds ) )
+
+            else:
+                dists = GetDistances( entry.Calls(), namedProfiles.Array(),
+                    namedProfiles.Presence(), bound = max( self.thresholds ) )
             
             #calculate the name of the entry
-            existingNames = CalcName(namedEntries, existingNames, entry.Key(), dists, self.thresholds, qcStatus)
+            existingNames = CalcName(namedEntries, existingNames, i, dists, self.thresholds, qcStatus)
             
             #keep track of the data
-            if existingNames.HasResolvedName( entry.Key() ):
-                namedEntries.append( entry.Key() )
-                nameFrequencies[ existingNames.GetStrName( entry.Key() ) ] = nameFrequencies.get( existingNames.GetStrName( entry.Key() ), 0) + 1
+            if existingNames.HasResolvedName( i ):
+                self.AddNamed( entry, namedEntries, named, namedProfiles )
+                nameFrequencies[ existingNames.GetStrName( i ) ] = nameFrequencies.get( existingNames.GetStrName( i ), 0) + 1
 
 
         if iteration == 0:
-            for entry in namedEntries:
-                self._entryBase.GetEntry( entry ).Wgst( existingNames.GetStrName( entry ) )
+            for i in namedEntries:
+                self._entryBase.GetEntryById( i ).Wgst( existingNames.GetStrName( i ) )
 
-        for entry in namedEntries:
-            dbEntry = self._entryBase.GetEntry( entry )
+        for i in namedEntries:
+            dbEntry = self._entryBase.GetEntryById( i )
 
             oldName = dbEntry.Wgst()
 
-            newName = existingNames.GetStrName( dbEntry.Key() )
+            newName = existingNames.GetStrName( i )
 
             if oldName == newName:
                 continue
             
             if iteration > 0 and oldName and nameFrequencies[oldName] > 1:
                 ob = bool( dbEntry.Outbreak() )
-                self._wgstHistory.TrackChanges( oldName, newName, iteration, ob = ob, seed = entry in self._startingSet )
+                self._wgstHistory.TrackChanges( oldName, newName, iteration, ob = ob, seed = bool( self._seed[i] ) )
 
             dbEntry.Wgst( newName )
         
         return( existingNames )
 
+    def AddNamed(self, entry, namedEntries, named, namedProfiles):
+        namedEntries.append( entry.Id() )
+        named[ entry.Id() ] = True
+
+        if self._neighbors is None:
+            namedProfiles.Append( entry.Calls() )
+
 def Main(args):
 
     calc = Calculator( args )
@@ -16,19 +16,9 @@ import random
 import numpy as np
 
 from wgst import database
+from wgst.distance import GetDistance
 from tqdm import *
 
-# ======================== DISTANCE FUNCTION ================================#
-def GetDistance(p1, p2):
-    
-    common = np.multiply(p1>0, p2>0)
-    nCommon = np.sum(common)
-    nSame = np.sum(p1[common]==p2[common])
-    if nCommon:
-        return 100.0 * (float(nCommon) - float(nSame)) / float(nCommon) #nCommon-nSame
-    else:
-        return 100.0
-
 # =========================== DATABASE OBJECT ===============================#
 class Dbase(database.DB):
 
@@ -273,7 +263,8 @@ class Calculator(object):
         for i in trange( len( addingSet), desc='Clustering' ):
             existingNames = self.DoCalc(addingSet[i], existingNames, 'Incrementing', i+1 )
 
-        self._entryBase.Save( clusterSearch = self._args['clustersearch'] )
+        self._entryBase.Save( clusterSearch = self._args['clustersearch'],
+            binary = self._args.get( 'binaryout', False ) )
         self._wgstHistory.Save()
 
     def DoCalc(self, selection, existingNames, status, iteration = 0):